@@ -38,6 +38,7 @@ from api.utils.api_utils import server_error_response, get_data_error_result, ge
     generate_confirmation_token
 
 from api.utils.file_utils import filename_type, thumbnail
+from rag.utils.parse_cache import PARSE_ARTIFACTS
 from rag.utils.storage_factory import STORAGE_IMPL
 
 from api.db.services.canvas_service import UserCanvasService
@@ -650,6 +651,8 @@ def document_rm():
             FileService.filter_delete([File.source_type == FileSource.KNOWLEDGEBASE, File.id == f2d[0].file_id])
             File2DocumentService.delete_by_document_id(doc_id)
 
+            PARSE_ARTIFACTS.remove(b, n)
+
             STORAGE_IMPL.rm(b, n)
         except Exception as e:
             errors += str(e)
@@ -43,6 +43,7 @@ from api.utils.api_utils import (
 from api.utils import get_uuid
 from api import settings
 from api.utils.api_utils import get_json_result
+from rag.utils.parse_cache import PARSE_ARTIFACTS
 from rag.utils.storage_factory import STORAGE_IMPL
 from api.utils.file_utils import filename_type, thumbnail, get_project_base_directory
 from api.utils.web_utils import html2pdf, is_valid_url
@@ -332,6 +333,8 @@ def rm():
             FileService.filter_delete([File.source_type == FileSource.KNOWLEDGEBASE, File.id == f2d[0].file_id])
             File2DocumentService.delete_by_document_id(doc_id)
 
+            PARSE_ARTIFACTS.remove(b, n)
+
             STORAGE_IMPL.rm(b, n)
         except Exception as e:
             errors += str(e)
@@ -372,6 +375,9 @@ def run():
                 TaskService.filter_delete([Task.doc_id == id])
                 if settings.docStoreConn.indexExist(search.index_name(tenant_id), doc.kb_id):
                     settings.docStoreConn.delete({"doc_id": id}, search.index_name(tenant_id), doc.kb_id)
+            elif str(req["run"]) == TaskStatus.CANCEL.value:
+                # The tasks will not finish, so the chunks of the previous parse are deleted now.
+                DocumentService.remove_stale_chunks(doc, Task.query(doc_id=id))
 
             if str(req["run"]) == TaskStatus.RUNNING.value:
                 e, doc = DocumentService.get_by_id(id)
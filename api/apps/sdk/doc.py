@@ -40,6 +40,7 @@ from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.utils.api_utils import construct_json_result, get_parser_config
 from rag.nlp import search
 from rag.utils import rmSpace
+from rag.utils.parse_cache import PARSE_ARTIFACTS
 from rag.utils.storage_factory import STORAGE_IMPL
 
 from pydantic import BaseModel, Field, validator
@@ -598,6 +599,8 @@ def delete(tenant_id, dataset_id):
             )
             File2DocumentService.delete_by_document_id(doc_id)
 
+            PARSE_ARTIFACTS.remove(b, n)
+
             STORAGE_IMPL.rm(b, n)
         except Exception as e:
             errors += str(e)
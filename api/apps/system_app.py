@@ -36,6 +36,7 @@ from rag.utils.storage_factory import STORAGE_IMPL, STORAGE_IMPL_TYPE
 from timeit import default_timer as timer
 
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
 
 
 @manager.route("/version", methods=["GET"])  # noqa: F821
@@ -86,6 +87,9 @@ def status():
             database:
               type: object
               description: Database status.
+            retrieval_cache:
+              type: object
+              description: Retrieval cache hits and misses of this server.
       503:
         description: Service unavailable.
         schema:
@@ -155,6 +159,8 @@ def status():
             "error": str(e),
         }
 
+    res["retrieval_cache"] = RETRIEVAL_CACHE.stats()
+
     task_executor_heartbeats = {}
     try:
         task_executors = REDIS_CONN.smembers("TASKEXE")
@@ -857,6 +857,8 @@ class Task(DataBaseModel):
     retry_count = IntegerField(default=0)
     digest = TextField(null=True, help_text="task digest", default="")
     chunk_ids = LongTextField(null=True, help_text="chunk ids", default="")
+    chunk_digests = LongTextField(null=True, help_text="digests of the indexed chunks, in chunk_ids order", default="")
+    stale_chunk_ids = LongTextField(null=True, help_text="id:digest of the previous parse's chunks", default="")
 
 
 class Dialog(DataBaseModel):
@@ -1115,3 +1117,19 @@ def migrate_db():
             )
         except Exception:
             pass
+        try:
+            migrate(
+                migrator.add_column("task", "chunk_digests",
+                                    LongTextField(null=True, help_text="digests of the indexed chunks, in chunk_ids order",
+                                                  default=""))
+            )
+        except Exception:
+            pass
+        try:
+            migrate(
+                migrator.add_column("task", "stale_chunk_ids",
+                                    LongTextField(null=True, help_text="id:digest of the previous parse's chunks",
+                                                  default=""))
+            )
+        except Exception:
+            pass
@@ -29,7 +29,6 @@ from api.db.db_utils import bulk_insert_into_db
 from api import settings
 from api.utils import current_timestamp, get_format_time, get_uuid
 from graphrag.general.mind_map_extractor import MindMapExtractor
-from rag.settings import SVR_QUEUE_NAME
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.nlp import search, rag_tokenizer
 
@@ -39,7 +38,7 @@ from api.db.db_models import Document
 from api.db.services.common_service import CommonService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db import StatusEnum
-from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.task_queue import TASK_QUEUE
 
 
 class DocumentService(CommonService):
@@ -151,7 +150,7 @@ class DocumentService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def get_unfinished_docs(cls):
+    def get_unfinished_docs(cls, doc_ids=None):
         fields = [cls.model.id, cls.model.process_begin_at, cls.model.parser_config, cls.model.progress_msg,
                   cls.model.run, cls.model.parser_id]
         docs = cls.model.select(*fields) \
@@ -160,6 +159,8 @@ class DocumentService(CommonService):
             ~(cls.model.type == FileType.VIRTUAL.value),
             cls.model.progress < 1,
             cls.model.progress > 0)
+        if doc_ids is not None:
+            docs = docs.where(cls.model.id.in_(doc_ids))
         return list(docs.dicts())
 
     @classmethod
@@ -375,14 +376,20 @@ class DocumentService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def update_progress(cls):
+    def update_progress(cls, doc_ids=None):
+        """
+        Aggregates the progress of the tasks of each unfinished document, or of those in `doc_ids`, into the
+        document, which is only written if its progress, message or status changed.
+        """
         MSG = {
             "raptor": "Start RAPTOR (Recursive Abstractive Processing for Tree-Organized Retrieval).",
             "graphrag": "Start Graph Extraction",
             "graph_resolution": "Start Graph Resolution",
             "graph_community": "Start Graph Community Reports Generation"
         }
-        docs = cls.get_unfinished_docs()
+        if doc_ids is not None and not doc_ids:
+            return
+        docs = cls.get_unfinished_docs(doc_ids)
         for d in docs:
             try:
                 tsks = Task.query(doc_id=d["id"], order_by=Task.create_time)
@@ -403,6 +410,8 @@ class DocumentService(CommonService):
                     if t.progress == -1:
                         bad += 1
                 prg /= len(tsks)
+                if finished:
+                    cls.remove_stale_chunks(doc, tsks)
                 if finished and bad:
                     prg = -1
                     status = TaskStatus.FAIL.value
@@ -437,11 +446,32 @@ class DocumentService(CommonService):
                     info["progress"] = prg
                 if msg:
                     info["progress_msg"] = msg
+                if info.get("progress", doc.progress) == doc.progress and status == doc.run \
+                        and info.get("progress_msg", doc.progress_msg) == doc.progress_msg:
+                    continue
                 cls.update_by_id(d["id"], info)
             except Exception as e:
                 if str(e).find("'0'") < 0:
                     logging.exception("fetch task exception")
 
+    @classmethod
+    @DB.connection_context()
+    def remove_stale_chunks(cls, doc, tsks):
+        """
+        Once the tasks parsing a document again are over or cancelled, deletes the chunks of the previous parse
+        (`Task.stale_chunk_ids`, see `queue_tasks`) that the new tasks did not produce again.
+        """
+        stale, keep = set(), set()
+        for t in tsks:
+            stale.update(i.partition(":")[0] for i in (t.stale_chunk_ids or "").split())
+            keep.update((t.chunk_ids or "").split())
+        if not stale:
+            return
+        chunk_ids = list(stale - keep)
+        if chunk_ids:
+            settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(cls.get_tenant_id(doc.id)), doc.kb_id)
+        Task.update(stale_chunk_ids="").where(Task.doc_id == doc.id).execute()
+
     @classmethod
     @DB.connection_context()
     def get_kb_doc_count(cls, kb_id):
@@ -482,7 +512,8 @@ def queue_raptor_o_graphrag_tasks(doc, ty, msg):
     task["digest"] = hasher.hexdigest()
     bulk_insert_into_db(Task, [task], True)
     task["task_type"] = ty
-    assert REDIS_CONN.queue_product(SVR_QUEUE_NAME, message=task), "Can't access Redis. Please check the Redis' status."
+    assert TASK_QUEUE.put(task, chunking_config["tenant_id"], TASK_QUEUE.priority(ty)), \
+        "Can't access Redis. Please check the Redis' status."
 
 
 def doc_upload_and_parse(conversation_id, file_objs, user_id):
@@ -17,6 +17,8 @@ import json
 import logging
 import os
 
+import numpy as np
+
 from api.db.services.user_service import TenantService
 from api.utils.file_utils import get_project_base_directory
 from rag.llm import EmbeddingModel, CvModel, ChatModel, RerankModel, Seq2txtModel, TTSModel
@@ -24,6 +26,7 @@ from api.db import LLMType
 from api.db.db_models import DB
 from api.db.db_models import LLMFactories, LLM, TenantLLM
 from api.db.services.common_service import CommonService
+from rag.utils.embedding_cache import EMBEDDING_CACHE, QUERY_EMBEDDING_CACHE
 
 
 class LLMFactoriesService(CommonService):
@@ -232,15 +235,54 @@ class LLMBundle(object):
             break
 
     def encode(self, texts: list):
-        embeddings, used_tokens = self.mdl.encode(texts)
-        if not TenantLLMService.increase_usage(
-                self.tenant_id, self.llm_type, used_tokens):
-            logging.error(
-                "LLMBundle.encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
-        return embeddings, used_tokens
+        cache_key = self.cache_key()
+        if not EMBEDDING_CACHE.enabled or not cache_key or not texts:
+            embeddings, used_tokens = self.mdl.encode(texts)
+            if not TenantLLMService.increase_usage(
+                    self.tenant_id, self.llm_type, used_tokens):
+                logging.error(
+                    "LLMBundle.encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
+            return embeddings, used_tokens
+
+        vects = EMBEDDING_CACHE.get_many(cache_key, texts)
+        missed = [i for i, v in enumerate(vects) if v is None]
+        used_tokens = 0
+        if missed:
+            embeddings, used_tokens = self.mdl.encode([texts[i] for i in missed])
+            # Fresh vectors get the cache's precision too, so re-parses produce identical vectors.
+            embeddings = np.asarray(embeddings, dtype=EMBEDDING_CACHE.dtype).astype(np.float32)
+            EMBEDDING_CACHE.set_many(cache_key, [texts[i] for i in missed], embeddings)
+            for j, i in enumerate(missed):
+                vects[i] = embeddings[j]
+            if not TenantLLMService.increase_usage(
+                    self.tenant_id, self.llm_type, used_tokens):
+                logging.error(
+                    "LLMBundle.encode can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
+        return np.stack(vects), used_tokens
+
+    def cache_key(self):
+        """
+        Cached vectors are per tenant, model class, endpoint and model name: self-hosted endpoints
+        (OpenAI-compatible, Ollama, LocalAI, Xinference...) may serve different models under one name.
+        """
+        model_name = getattr(self.mdl, "model_name", None) or getattr(self.mdl, "_model_name", None) or self.llm_name
+        if not model_name:
+            return
+        client = getattr(self.mdl, "client", None)
+        base_url = getattr(self.mdl, "base_url", None) or getattr(client, "base_url", None) or \
+            getattr(getattr(client, "_client", None), "base_url", None) or ""
+        return "{}/{}/{}/{}".format(self.tenant_id, type(self.mdl).__name__, str(base_url).rstrip("/"), model_name)
 
     def encode_queries(self, query: str):
+        cache_key = self.cache_key()
+        if QUERY_EMBEDDING_CACHE.enabled and cache_key:
+            emd = QUERY_EMBEDDING_CACHE.get_many(cache_key, [query])[0]
+            if emd is not None:
+                return emd, 0
         emd, used_tokens = self.mdl.encode_queries(query)
+        if QUERY_EMBEDDING_CACHE.enabled and cache_key:
+            emd = np.asarray(emd, dtype=QUERY_EMBEDDING_CACHE.dtype).astype(np.float32)
+            QUERY_EMBEDDING_CACHE.set_many(cache_key, [query], [emd])
         if not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens):
             logging.error(
@@ -13,6 +13,9 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import bisect
+import itertools
+import math
 import os
 import random
 import xxhash
@@ -28,9 +31,10 @@ from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from api.utils import current_timestamp, get_uuid
 from deepdoc.parser.excel_parser import RAGFlowExcelParser
-from rag.settings import SVR_QUEUE_NAME
+from rag.settings import PROGRESS_QUEUE_NAME, TASK_COST_SPLIT
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.task_queue import TASK_QUEUE
 from api import settings
 from rag.nlp import search
 
@@ -111,6 +115,8 @@ class TaskService(CommonService):
             cls.model.progress,
             cls.model.digest,
             cls.model.chunk_ids,
+            cls.model.chunk_digests,
+            cls.model.stale_chunk_ids,
         ]
         tasks = (
             cls.model.select(*fields).order_by(cls.model.from_page.asc(), cls.model.create_time.desc())
@@ -123,8 +129,17 @@ class TaskService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def update_chunk_ids(cls, id: str, chunk_ids: str):
-        cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
+    def update_chunk_ids(cls, id: str, chunk_ids: str, chunk_digests: str = ""):
+        cls.model.update(chunk_ids=chunk_ids, chunk_digests=chunk_digests).where(cls.model.id == id).execute()
+
+    @classmethod
+    @DB.connection_context()
+    def get_stale_chunk_digests(cls, doc_id: str) -> dict[str, str]:
+        """Chunks of the previous parse of a document that are still indexed: {chunk id: digest}."""
+        digests = {}
+        for t in cls.model.select(cls.model.stale_chunk_ids).where(cls.model.doc_id == doc_id).dicts():
+            digests.update(parse_chunk_digests(t["stale_chunk_ids"]))
+        return digests
 
     @classmethod
     @DB.connection_context()
@@ -180,25 +195,24 @@ class TaskService(CommonService):
     @DB.connection_context()
     def update_progress(cls, id, info):
         if os.environ.get("MACOS"):
-            if info["progress_msg"]:
-                task = cls.model.get_by_id(id)
-                progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-            if "progress" in info:
-                cls.model.update(progress=info["progress"]).where(
-                    cls.model.id == id
-                ).execute()
-            return
-
-        with DB.lock("update_progress", -1):
-            if info["progress_msg"]:
-                task = cls.model.get_by_id(id)
-                progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-            if "progress" in info:
-                cls.model.update(progress=info["progress"]).where(
-                    cls.model.id == id
-                ).execute()
+            task = cls._update_progress(id, info)
+        else:
+            with DB.lock("update_progress", -1):
+                task = cls._update_progress(id, info)
+        REDIS_CONN.publish_event(PROGRESS_QUEUE_NAME, {"doc_id": task.doc_id, "task_id": id,
+                                                       "progress": info.get("progress")})
+
+    @classmethod
+    def _update_progress(cls, id, info):
+        task = cls.model.get_by_id(id)
+        if info["progress_msg"]:
+            progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
+            cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
+        if "progress" in info:
+            cls.model.update(progress=info["progress"]).where(
+                cls.model.id == id
+            ).execute()
+        return task
 
 
 def queue_tasks(doc: dict, bucket: str, name: str):
@@ -216,24 +230,30 @@ def queue_tasks(doc: dict, bucket: str, name: str):
             page_size = doc["parser_config"].get("task_page_size", 22)
         if doc["parser_id"] in ["one", "knowledge_graph"] or do_layout != "DeepDOC":
             page_size = 10 ** 9
+        # A task gets about as much work as `page_size` scanned pages, so pages with a text layer go by more at a time.
+        costs = PdfParser.page_costs(doc["name"], file_bin) if TASK_COST_SPLIT and page_size < 10 ** 9 else None
         page_ranges = doc["parser_config"].get("pages") or [(1, 10 ** 5)]
         for s, e in page_ranges:
             s -= 1
             s = max(0, s)
             e = min(e - 1, pages)
-            for p in range(s, e, page_size):
+            for p, q in split_by_cost(costs, s, e, page_size):
                 task = new_task()
                 task["from_page"] = p
-                task["to_page"] = min(p + page_size, e)
+                task["to_page"] = q
                 parse_task_array.append(task)
 
     elif doc["parser_id"] == "table":
         file_bin = STORAGE_IMPL.get(bucket, name)
-        rn = RAGFlowExcelParser.row_number(doc["name"], file_bin)
-        for i in range(0, rn, 3000):
+        rn, cells = RAGFlowExcelParser.size(doc["name"], file_bin)
+        row_size = 3000
+        if TASK_COST_SPLIT and rn:
+            # 3000 rows of 10 columns per task, fewer rows of wider tables.
+            row_size = min(30000, max(300, int(3000 * 10 * rn / max(cells, 1))))
+        for i in range(0, rn, row_size):
             task = new_task()
             task["from_page"] = i
-            task["to_page"] = min(i + 3000, rn)
+            task["to_page"] = min(i + row_size, rn)
             parse_task_array.append(task)
     else:
         parse_task_array.append(new_task())
@@ -259,12 +279,26 @@ def queue_tasks(doc: dict, bucket: str, name: str):
         for task in parse_task_array:
             ck_num += reuse_prev_task_chunks(task, prev_tasks, chunking_config)
         TaskService.filter_delete([Task.doc_id == doc["id"]])
-        chunk_ids = []
+        # The previous chunks stay indexed while the document is parsed again: the new tasks skip embedding and
+        # indexing the ones they produce unchanged, and DocumentService.remove_stale_chunks deletes the rest once
+        # the tasks are over or cancelled.
+        # Only chunks of tasks that finished are known to be indexed: those of the others are deleted, not reused.
+        stale = {}
         for task in prev_tasks:
-            if task["chunk_ids"]:
-                chunk_ids.extend(task["chunk_ids"].split())
-        if chunk_ids:
-            settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(chunking_config["tenant_id"]),
+            stale.update(parse_chunk_digests(task["stale_chunk_ids"]))
+            if task["progress"] == 1.0:
+                stale.update(parse_chunk_digests(task["chunk_ids"], task["chunk_digests"]))
+        for task in prev_tasks:
+            for chunk_id in (task["chunk_ids"] or "").split():
+                stale.setdefault(chunk_id, "")
+        for task in parse_task_array:
+            for chunk_id in task.get("chunk_ids", "").split():
+                stale.pop(chunk_id, None)
+        pending = [task for task in parse_task_array if task["progress"] < 1.0]
+        if pending:
+            pending[0]["stale_chunk_ids"] = " ".join(f"{i}:{d}" for i, d in stale.items())
+        elif stale:
+            settings.docStoreConn.delete({"id": list(stale.keys())}, search.index_name(chunking_config["tenant_id"]),
                                          chunking_config["kb_id"])
     DocumentService.update_by_id(doc["id"], {"chunk_num": ck_num})
 
@@ -272,10 +306,32 @@ def queue_tasks(doc: dict, bucket: str, name: str):
     DocumentService.begin2parse(doc["id"])
 
     unfinished_task_array = [task for task in parse_task_array if task["progress"] < 1.0]
+    priority = TASK_QUEUE.priority(task_num=len(unfinished_task_array))
     for unfinished_task in unfinished_task_array:
-        assert REDIS_CONN.queue_product(
-            SVR_QUEUE_NAME, message=unfinished_task
+        assert TASK_QUEUE.put(
+            unfinished_task, chunking_config["tenant_id"], priority
         ), "Can't access Redis. Please check the Redis' status."
+    if not unfinished_task_array:
+        # Every task reused its chunks: no executor will report on the document.
+        REDIS_CONN.publish_event(PROGRESS_QUEUE_NAME, {"doc_id": doc["id"], "task_id": "", "progress": 1.0})
+
+
+def split_by_cost(costs: list[float] | None, s: int, e: int, target: float) -> list[tuple[int, int]]:
+    """
+    Splits the pages [s, e) into the fewest ranges of about `target` cost each, all of about the same cost.
+    Without `costs`, ranges are `target` pages long.
+    """
+    if not costs or e > len(costs):
+        return [(p, min(p + int(target), e)) for p in range(s, e, int(target))]
+    cum = list(itertools.accumulate(costs[s:e], initial=0.))
+    n = max(1, math.ceil(cum[-1] / target - 1e-9))
+    cuts = [s]
+    for i in range(1, n):
+        p = s + bisect.bisect_left(cum, cum[-1] * i / n)
+        if cuts[-1] < p < e:
+            cuts.append(p)
+    cuts.append(e)
+    return list(zip(cuts[:-1], cuts[1:])) if e > s else []
 
 
 def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config: dict):
@@ -293,6 +349,7 @@ def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config:
     if prev_task["progress"] < 1.0 or not prev_task["chunk_ids"]:
         return 0
     task["chunk_ids"] = prev_task["chunk_ids"]
+    task["chunk_digests"] = prev_task["chunk_digests"] or ""
     task["progress"] = 1.0
     if "from_page" in task and "to_page" in task and int(task['to_page']) - int(task['from_page']) >= 10 ** 6:
         task["progress_msg"] = f"Page({task['from_page']}~{task['to_page']}): "
@@ -303,3 +360,17 @@ def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config:
     prev_task["chunk_ids"] = ""
 
     return len(task["chunk_ids"].split())
+
+
+def parse_chunk_digests(chunk_ids: str | None, chunk_digests: str | None = None) -> dict[str, str]:
+    """
+    {chunk id: digest} out of either "id:digest" pairs, or chunk ids and their digests in the same order.
+    Digests unknown, e.g. of chunks indexed before they were recorded, are "".
+    """
+    ids = (chunk_ids or "").split()
+    if chunk_digests is None:
+        return dict(i.partition(":")[::2] for i in ids)
+    digests = (chunk_digests or "").split()
+    if len(digests) != len(ids):
+        digests = [""] * len(ids)
+    return dict(zip(ids, digests))
@@ -24,6 +24,7 @@ initRootLogger("ragflow_server")
 import logging
 import os
 import signal
+import socket
 import sys
 import time
 import traceback
@@ -40,16 +41,40 @@ from api.db.db_models import init_database_tables as init_web_db
 from api.db.init_data import init_web_data
 from api.versions import get_ragflow_version
 from api.utils import show_configs
-from rag.settings import print_rag_settings
+from rag.settings import print_rag_settings, PROGRESS_QUEUE_NAME, PROGRESS_CONSUMER_GROUP_NAME, \
+    PROGRESS_FLUSH_INTERVAL, PROGRESS_FULL_SCAN_INTERVAL
+from rag.utils.redis_conn import REDIS_CONN
 
 
 def update_progress():
+    """
+    Refreshes the documents named by the progress events of the task executors, each at most once per
+    PROGRESS_FLUSH_INTERVAL seconds however many events it got, and every unfinished document once per
+    PROGRESS_FULL_SCAN_INTERVAL seconds. The API servers share the events through a consumer group.
+    """
+    consumer_name = f"ragflow_server_{socket.gethostname()}_{os.getpid()}"
+    dirty = set()
+    last_flush = last_scan = time.time()
     while True:
-        time.sleep(6)
         try:
-            DocumentService.update_progress()
+            events = REDIS_CONN.consume_events(PROGRESS_QUEUE_NAME, PROGRESS_CONSUMER_GROUP_NAME, consumer_name,
+                                               block=int(PROGRESS_FLUSH_INTERVAL * 1000))
+            if events is None:
+                time.sleep(PROGRESS_FLUSH_INTERVAL)
+            dirty.update(e["doc_id"] for e in events or [] if e.get("doc_id"))
+            now = time.time()
+            if now - last_scan >= PROGRESS_FULL_SCAN_INTERVAL:
+                dirty.clear()
+                last_scan = last_flush = now
+                DocumentService.update_progress()
+            elif dirty and now - last_flush >= PROGRESS_FLUSH_INTERVAL:
+                doc_ids = list(dirty)
+                dirty.clear()
+                last_flush = now
+                DocumentService.update_progress(doc_ids)
         except Exception:
             logging.exception("update_progress exception")
+            time.sleep(PROGRESS_FLUSH_INTERVAL)
 
 
 if __name__ == '__main__':
@@ -168,6 +168,10 @@ def init_settings():
         docStoreConn = rag.utils.es_conn.ESConnection()
     elif lower_case_doc_engine == "infinity":
         docStoreConn = rag.utils.infinity_conn.InfinityConnection()
+    elif lower_case_doc_engine == "embedded":
+        # POSIX only (fcntl), so not imported with the others.
+        from rag.utils.embedded_conn import EmbeddedConnection
+        docStoreConn = EmbeddedConnection()
     else:
         raise Exception(f"Not supported doc engine: {DOC_ENGINE}")
 
@@ -87,18 +87,28 @@ class RAGFlowExcelParser:
 
     @staticmethod
     def row_number(fnm, binary):
+        res = RAGFlowExcelParser.size(fnm, binary)
+        return res[0] if res else None
+
+    @staticmethod
+    def size(fnm, binary):
+        """Rows and cells, empty ones included, of a spreadsheet or CSV file."""
         if fnm.split(".")[-1].lower().find("xls") >= 0:
             wb = load_workbook(BytesIO(binary))
-            total = 0
+            total, cells = 0, 0
             for sheetname in wb.sheetnames:
                 ws = wb[sheetname]
-                total += len(list(ws.rows))
-            return total
+                rn = len(list(ws.rows))
+                total += rn
+                cells += rn * ws.max_column
+            return total, cells
 
         if fnm.split(".")[-1].lower() in ["csv", "txt"]:
             encoding = find_codec(binary)
             txt = binary.decode(encoding, errors="ignore")
-            return len(txt.split("\n"))
+            lines = txt.split("\n")
+            delimiter = "\t" if lines[0].count("\t") > lines[0].count(",") else ","
+            return len(lines), len(lines) + txt.count(delimiter)
 
 
 if __name__ == "__main__":
@@ -15,8 +15,13 @@
 #
 
 import logging
+import multiprocessing
 import os
 import random
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import xgboost as xgb
 from io import BytesIO
@@ -28,18 +33,115 @@ from pypdf import PdfReader as pdf2_read
 
 from api import settings
 from api.utils.file_utils import get_project_base_directory
-from deepdoc.vision import OCR, Recognizer, LayoutRecognizer, TableStructureRecognizer
+from rag.settings import PDF_PARSER_PROCESSES, PDF_PAGE_CACHE, ONNX_QUANTIZED
+from rag.utils.parse_cache import PARSE_ARTIFACTS
+from deepdoc.vision import OCR, Recognizer, BoxTable, LayoutRecognizer, TableStructureRecognizer
 from rag.nlp import rag_tokenizer
 from copy import deepcopy
 from huggingface_hub import snapshot_download
 
+# Version of the OCR, layout and table recognition output, part of the key of cached parse artifacts:
+# bump it when a change to deepdoc or its models changes what they recognize.
+DEEPDOC_VERSION = "1"
+
+class PageImages:
+    """
+    The page images of a PDF, rendered when first used, which only keeps the `cache_size` most recently
+    used ones in memory. Evicted pages are rendered again when needed, their sizes are remembered.
+    Items are `PageImage`s, used like the PIL images they stand for.
+    """
+
+    def __init__(self, pdf, page_from, page_to, zoomin, cache_size):
+        self.pdf = pdf
+        self.page_numbers = list(range(len(pdf.pages)))[page_from:page_to]
+        self.zoomin = zoomin
+        self.cache_size = max(1, cache_size)
+        self.images = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.page_numbers)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("page index out of range")
+        return PageImage(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def put(self, i, img):
+        with self.lock:
+            self.sizes[i] = img.size
+            self.images[i] = img
+            self.images.move_to_end(i)
+            while len(self.images) > self.cache_size:
+                self.images.popitem(last=False)
+
+    def image(self, i):
+        with self.lock:
+            img = self.images.get(i)
+            if img is not None:
+                self.images.move_to_end(i)
+                return img
+            page = self.pdf.pages[self.page_numbers[i]]
+            img = page.to_image(resolution=72 * self.zoomin).annotated
+            page.flush_cache()
+            self.put(i, img)
+            return img
+
+    def size(self, i):
+        with self.lock:
+            if i not in self.sizes:
+                self.image(i)
+            return self.sizes[i]
+
+
+class PageImage:
+    """Stands for the image of a page of `PageImages`, which is only rendered when its pixels are used."""
+
+    def __init__(self, pages, i):
+        self.pages = pages
+        self.i = i
+
+    @property
+    def size(self):
+        return self.pages.size(self.i)
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def __getattr__(self, name):
+        # Private and special names are not delegated: copy and pickle look up `__deepcopy__` and the like
+        # on the proxy itself.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.pages.image(self.i), name)
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles are plain images: the pages they stand for hold an open PDF and a lock.
+        return Image.Image.copy, (self.pages.image(self.i),)
+
+
 class RAGFlowPdfParser:
     def __init__(self):
         self.ocr = OCR()
         if hasattr(self, "model_speciess"):
-            self.layouter = LayoutRecognizer("layout." + self.model_speciess)
+            self.layout_domain = "layout." + self.model_speciess
         else:
-            self.layouter = LayoutRecognizer("layout")
+            self.layout_domain = "layout"
+        self.layouter = LayoutRecognizer(self.layout_domain)
         self.tbl_det = TableStructureRecognizer()
 
         self.updown_cnt_mdl = xgb.Booster()
@@ -177,7 +279,8 @@ class RAGFlowPdfParser:
                     arr[j + 1] = tmp
         return arr
 
-    def _has_color(self, o):
+    @staticmethod
+    def _has_color(o):
         if o.get("ncs", "") == "DeviceGray":
             if o["stroking_color"] and o["stroking_color"][0] == 1 and o["non_stroking_color"] and \
                     o["non_stroking_color"][0] == 1:
@@ -185,7 +288,36 @@ class RAGFlowPdfParser:
                     return False
         return True
 
+    def _load_artifacts(self, stage):
+        """Restores the attributes saved by `_save_artifacts` for this file, if there are any."""
+        cached = PARSE_ARTIFACTS.get(getattr(self, "artifact_key", None), stage)
+        if cached is None:
+            return False
+        for k, v in cached.items():
+            setattr(self, k, v)
+        logging.info(f"Reused parse artifacts: {stage}")
+        return True
+
+    def _save_artifacts(self, stage, names, **extra):
+        PARSE_ARTIFACTS.put(getattr(self, "artifact_key", None), stage, {**{k: getattr(self, k) for k in names}, **extra})
+
+    def _crop(self, pn, box):
+        """Crops page `pn`, reusing the crop of a previous parse of the file so that the page is not rendered again."""
+        stage = "crop-{}-{}".format(pn, "-".join(f"{float(v):.1f}" for v in box))
+        img = PARSE_ARTIFACTS.get_image(getattr(self, "artifact_key", None), stage)
+        if img is None:
+            img = self.page_images[pn].crop(box)
+            PARSE_ARTIFACTS.put_image(getattr(self, "artifact_key", None), stage, img)
+        return img
+
     def _table_transformer_job(self, ZM):
+        stage = f"table-{ZM}"
+        if self._load_artifacts(stage):
+            return
+        self.__table_transformer_job(ZM)
+        self._save_artifacts(stage, ["boxes", "tb_cpns"])
+
+    def __table_transformer_job(self, ZM):
         logging.debug("Table processing...")
         imgs, pos = [], []
         tbcnt = [0]
@@ -238,12 +370,12 @@ class RAGFlowPdfParser:
             return Recognizer.sort_Y_firstly(eles, 0)
 
         # add R,H,C,SP tag to boxes within table layout
-        headers = gather(r".*header$")
-        rows = gather(r".* (row|header)")
-        spans = gather(r".*spanning")
+        headers = BoxTable(gather(r".*header$"))
+        rows = BoxTable(gather(r".* (row|header)"))
+        spans = BoxTable(gather(r".*spanning"))
         clmns = sorted([r for r in self.tb_cpns if re.match(
             r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
-        clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
+        clmns = BoxTable(Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5))
         for b in self.boxes:
             if b.get("layout_type", "") != "table":
                 continue
@@ -277,30 +409,43 @@ class RAGFlowPdfParser:
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3):
-        bxs = self.ocr.detect(np.array(img))
+        bxs, lefted_chars, self.mean_height[-1] = self._ocr_page(self.ocr, pagenum, img, chars, ZM,
+                                                                 self.mean_height[-1])
+        self.lefted_chars.extend(lefted_chars)
+        self.boxes.append(bxs)
+
+    @staticmethod
+    def _ocr_page(ocr, pagenum, img, chars, ZM, mean_height):
+        """
+        Text boxes of one page: OCR detected boxes filled with the page's characters, or recognized when
+        they have none. Returns the boxes, the characters out of any box and the page's mean char height.
+        """
+        lefted_chars = []
+        img_np = np.array(img)
+        bxs = ocr.detect(img_np)
         if not bxs:
-            self.boxes.append([])
-            return
+            return [], lefted_chars, mean_height
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [{"x0": b[0][0] / ZM, "x1": b[1][0] / ZM,
               "top": b[0][1] / ZM, "text": "", "txt": t,
               "bottom": b[-1][1] / ZM,
               "page_number": pagenum} for b, t in bxs if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]],
-            self.mean_height[-1] / 3
+            mean_height / 3
         )
         
         # merge chars in the same rect
+        tbl = BoxTable(bxs)
         for c in Recognizer.sort_Y_firstly(
-                chars, self.mean_height[pagenum - 1] // 4):
-            ii = Recognizer.find_overlapped(c, bxs)
+                chars, mean_height // 4):
+            ii = Recognizer.find_overlapped(c, tbl)
             if ii is None:
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             ch = c["bottom"] - c["top"]
             bh = bxs[ii]["bottom"] - bxs[ii]["top"]
             if abs(ch - bh) / max(ch, bh) >= 0.7 and c["text"] != ' ':
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             if c["text"] == " " and bxs[ii]["text"]:
                 if re.match(r"[0-9a-zA-Zа-яА-Я,.?;:!%%]", bxs[ii]["text"][-1]):
@@ -308,30 +453,41 @@ class RAGFlowPdfParser:
             else:
                 bxs[ii]["text"] += c["text"]
 
+        # boxes without pdfplumber characters are recognized together, in batches
+        boxes_to_reg, regions = [], []
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * \
                                          ZM, b["top"] * ZM, b["bottom"] * ZM
-                b["text"] = self.ocr.recognize(np.array(img),
-                                               np.array([[left, top], [right, top], [right, bott], [left, bott]],
-                                                        dtype=np.float32))
+                boxes_to_reg.append(b)
+                regions.append(np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
             del b["txt"]
+        for b, t in zip(boxes_to_reg, ocr.recognize_batch(img_np, regions)):
+            b["text"] = t
         bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[-1] == 0:
-            self.mean_height[-1] = np.median([b["bottom"] - b["top"]
-                                              for b in bxs])
-        self.boxes.append(bxs)
+        if mean_height == 0:
+            mean_height = np.median([b["bottom"] - b["top"] for b in bxs])
+        return bxs, lefted_chars, mean_height
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
+        stage = f"layout-{ZM}-{int(drop)}"
+        if self._load_artifacts(stage):
+            return
+        layouts = None
+        if PDF_PARSER_PROCESSES > 1 and len(self.page_images) > 1:
+            # The layout model runs page by page on the page pool; what repeats across pages is dropped here.
+            images = [img.pages.image(img.i) if isinstance(img, PageImage) else img for img in self.page_images]
+            layouts = list(page_pool().map(_layout_page, [(self.layout_domain, img) for img in images]))
         self.boxes, self.page_layout = self.layouter(
-            self.page_images, self.boxes, ZM, drop=drop)
+            self.page_images, self.boxes, ZM, drop=drop, layouts=layouts)
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += \
                 self.page_cum_height[self.boxes[i]["page_number"] - 1]
             self.boxes[i]["bottom"] += \
                 self.page_cum_height[self.boxes[i]["page_number"] - 1]
+        self._save_artifacts(stage, ["boxes", "page_layout"])
 
     def _text_merge(self):
         # merge adjusted boxes
@@ -768,9 +924,8 @@ class RAGFlowPdfParser:
                 if right < left:
                     right = left + 1
                 poss.append((pn + self.page_from, left, right, top, bott))
-                return self.page_images[pn] \
-                    .crop((left * ZM, top * ZM,
-                           right * ZM, bott * ZM))
+                return self._crop(pn, (left * ZM, top * ZM,
+                                       right * ZM, bott * ZM))
             pn = {}
             for b in bxs:
                 p = b["page_number"] - 1
@@ -941,6 +1096,36 @@ class RAGFlowPdfParser:
         except Exception:
             logging.exception("total_page_number")
 
+    @staticmethod
+    def page_costs(fnm, binary=None):
+        """
+        Relative cost of parsing each page, 1 for a scanned one: the text of a page with a text layer comes
+        from the PDF instead of being recognized, while images on it add some recognition back.
+        Only page resources are read, not content streams. None if the PDF can not be read.
+        """
+        try:
+            pdf = pdf2_read(fnm if not binary else BytesIO(binary))
+            costs = []
+            for page in pdf.pages:
+                resources = page.get("/Resources")
+                resources = resources.get_object() if resources is not None else {}
+                pixels = 0
+                xobjects = resources.get("/XObject")
+                for xobj in (xobjects.get_object() if xobjects is not None else {}).values():
+                    xobj = xobj.get_object()
+                    if xobj.get("/Subtype") == "/Image":
+                        pixels += int(xobj.get("/Width", 0)) * int(xobj.get("/Height", 0))
+                if resources.get("/Font") is None:
+                    costs.append(1.)
+                    continue
+                # An image as large as the page at 150 dpi counts as a full page of text to recognize.
+                box = page.mediabox
+                area = max(1., float(box.width) * float(box.height) * (150 / 72) ** 2)
+                costs.append(0.4 + 0.6 * min(1., pixels / area))
+            return costs
+        except Exception:
+            logging.exception("page_costs")
+
     def __images__(self, fnm, zoomin=3, page_from=0,
                    page_to=299, callback=None):
         self.lefted_chars = []
@@ -951,17 +1136,37 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        self.artifact_key = PARSE_ARTIFACTS.key(
+            fnm, f"{type(self).__module__}.{type(self).__qualname__}:{getattr(self, 'model_speciess', '')}",
+            version=DEEPDOC_VERSION, quantized=ONNX_QUANTIZED, zoomin=zoomin, page_from=page_from, page_to=page_to)
+        cached = PARSE_ARTIFACTS.get(self.artifact_key, "ocr")
+        pool = page_pool() if PDF_PARSER_PROCESSES > 1 and not cached else None
         try:
             self.pdf = pdfplumber.open(fnm) if isinstance(
                 fnm, str) else pdfplumber.open(BytesIO(fnm))
-            self.page_images = [p.to_image(resolution=72 * zoomin).annotated for i, p in
-                                enumerate(self.pdf.pages[page_from:page_to])]
-            try:
-                self.page_chars = [[{**c, 'top': c['top'], 'bottom': c['bottom']} for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-            except Exception as e:
-                logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
-                
+            if cached:
+                # OCR is reused, pages are only rendered if cropped
+                self.page_images = PageImages(self.pdf, page_from, page_to, zoomin, PDF_PAGE_CACHE or len(self.pdf.pages))
+                self.page_images.sizes = dict(enumerate(tuple(s) for s in cached.pop("page_sizes")))
+                self.page_chars = [[] for _ in range(len(self.page_images))]
+            elif pool:
+                self.page_images, self.page_chars = self.__render_pages(pool, fnm, zoomin, page_from, page_to)
+            elif PDF_PAGE_CACHE > 0:
+                # pages are rendered on demand and only PDF_PAGE_CACHE of them are kept in memory
+                self.page_images = PageImages(self.pdf, page_from, page_to, zoomin, PDF_PAGE_CACHE)
+            else:
+                self.page_images = [p.to_image(resolution=72 * zoomin).annotated for i, p in
+                                    enumerate(self.pdf.pages[page_from:page_to])]
+            if not pool and not cached:
+                try:
+                    self.page_chars = [[{**c, 'top': c['top'], 'bottom': c['bottom']} for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
+                except Exception as e:
+                    logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                    self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+                if PDF_PAGE_CACHE > 0:
+                    for page in self.pdf.pages[page_from:page_to]:
+                        page.flush_cache()
+
             self.total_page = len(self.pdf.pages)
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
@@ -985,6 +1190,24 @@ class RAGFlowPdfParser:
             logging.warning("Miss outlines")
 
         logging.debug("Images converted.")
+        if cached:
+            for k, v in cached.items():
+                setattr(self, k, v)
+            if callback:
+                callback(prog=0.6, msg="Reused the OCR results of a previous parse.")
+        else:
+            self.__ocr_pages(zoomin, pool, callback)
+            self._save_artifacts("ocr", ["boxes", "lefted_chars", "mean_height", "mean_width", "page_cum_height"],
+                                 is_english=bool(self.is_english), page_sizes=[img.size for img in self.page_images])
+            if pool and PDF_PAGE_CACHE > 0:
+                images = PageImages(self.pdf, page_from, page_to, zoomin, PDF_PAGE_CACHE)
+                for i, img in enumerate(self.page_images):
+                    images.put(i, img)
+                self.page_images = images
+        if len(self.boxes) == 0 and zoomin < 9:
+            self.__images__(fnm, zoomin * 3, page_from, page_to, callback)
+
+    def __ocr_pages(self, zoomin, pool, callback):
         self.is_english = [re.search(r"[a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(
             random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i]))))) for i in
                            range(len(self.page_chars))]
@@ -995,6 +1218,7 @@ class RAGFlowPdfParser:
             self.is_english = False
 
         # st = timer()
+        futures = []
         for i, img in enumerate(self.page_images):
             chars = self.page_chars[i] if not self.is_english else []
             self.mean_height.append(
@@ -1013,9 +1237,22 @@ class RAGFlowPdfParser:
                     chars[j]["text"] += " "
                 j += 1
 
+            if pool:
+                # The pixels, not a PageImage: that would pickle the whole PDF along.
+                if isinstance(img, PageImage):
+                    img = img.pages.image(img.i)
+                futures.append(pool.submit(_ocr_page, i + 1, img, chars, zoomin, self.mean_height[-1]))
+                continue
             self.__ocr(i + 1, img, chars, zoomin)
             if callback and i % 6 == 5:
                 callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+        # pages OCRed by the pool are merged back in page order
+        for i, f in enumerate(futures):
+            bxs, lefted_chars, self.mean_height[i] = f.result()
+            self.lefted_chars.extend(lefted_chars)
+            self.boxes.append(bxs)
+            if callback:
+                callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
         # print("OCR:", timer()-st)
 
         if not self.is_english and not any(
@@ -1025,11 +1262,35 @@ class RAGFlowPdfParser:
                                         "".join([b["text"] for b in random.choices(bxes, k=min(30, len(bxes)))]))
 
         logging.debug("Is it English:", self.is_english)
+        if PDF_PAGE_CACHE > 0:
+            # characters not merged into boxes are in self.lefted_chars
+            self.page_chars = [[] for _ in self.page_chars]
 
         self.page_cum_height = np.cumsum(self.page_cum_height)
         assert len(self.page_cum_height) == len(self.page_images) + 1
-        if len(self.boxes) == 0 and zoomin < 9:
-            self.__images__(fnm, zoomin * 3, page_from, page_to, callback)
+
+    def __render_pages(self, pool, fnm, zoomin, page_from, page_to):
+        """Renders the pages and extracts their characters on the page pool, the same as the sequential path."""
+        path = fnm
+        if not isinstance(fnm, str):
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+                f.write(fnm)
+                path = f.name
+        pns = list(range(len(self.pdf.pages))[page_from:page_to])
+        # Each worker opens the file once per run of pages it renders.
+        size = max(1, len(pns) // (PDF_PARSER_PROCESSES * 4))
+        try:
+            pages = [p for run in pool.map(_render_pages, [(path, pns[i:i + size], zoomin)
+                                                            for i in range(0, len(pns), size)]) for p in run]
+        finally:
+            if path != fnm:
+                os.unlink(path)
+        # All of them are OCRed right away: they only go into a PageImages once that is done.
+        page_images = [img for img, _ in pages]
+        if any(chars is None for _, chars in pages):
+            logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}")
+            return page_images, [[] for _ in range(page_to - page_from)]
+        return page_images, [chars for _, chars in pages]
 
     def __call__(self, fnm, need_image=True, zoomin=3, return_html=False):
         self.__images__(fnm, zoomin)
@@ -1077,11 +1338,11 @@ class RAGFlowPdfParser:
             for pn in pns[1:]:
                 bottom += self.page_images[pn - 1].size[1]
             imgs.append(
-                self.page_images[pns[0]].crop((left * ZM, top * ZM,
-                                               right *
-                                               ZM, min(
+                self._crop(pns[0], (left * ZM, top * ZM,
+                                    right *
+                                    ZM, min(
                     bottom, self.page_images[pns[0]].size[1])
-                                               ))
+                                    ))
             )
             if 0 < ii < len(poss) - 1:
                 positions.append((pns[0] + self.page_from, left, right, top, min(
@@ -1089,11 +1350,11 @@ class RAGFlowPdfParser:
             bottom -= self.page_images[pns[0]].size[1]
             for pn in pns[1:]:
                 imgs.append(
-                    self.page_images[pn].crop((left * ZM, 0,
-                                               right * ZM,
-                                               min(bottom,
-                                                   self.page_images[pn].size[1])
-                                               ))
+                    self._crop(pn, (left * ZM, 0,
+                                    right * ZM,
+                                    min(bottom,
+                                        self.page_images[pn].size[1])
+                                    ))
                 )
                 if 0 < ii < len(poss) - 1:
                     positions.append((pn + self.page_from, left, right, 0, min(
@@ -1142,6 +1403,60 @@ class RAGFlowPdfParser:
         return poss
 
 
+_page_pool = None
+_page_pool_lock = threading.Lock()
+_page_worker = {}
+
+
+def page_pool():
+    """
+    The process pool PDF pages are rendered, OCRed and laid out on, shared by the parsers of the process.
+    Workers are spawned, not forked, and load the OCR and layout models once.
+    """
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None or getattr(_page_pool, "_broken", False):
+            _page_pool = ProcessPoolExecutor(max_workers=PDF_PARSER_PROCESSES,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_page_worker)
+        return _page_pool
+
+
+def _init_page_worker():
+    _page_worker["ocr"] = OCR()
+
+
+def _render_pages(args):
+    path, pns, zoomin = args
+    pages = []
+    pdf = pdfplumber.open(path)
+    try:
+        for pn in pns:
+            page = pdf.pages[pn]
+            img = page.to_image(resolution=72 * zoomin).annotated
+            try:
+                chars = [{**c, 'top': c['top'], 'bottom': c['bottom']} for c in page.dedupe_chars().chars if
+                         RAGFlowPdfParser._has_color(c)]
+            except Exception:
+                chars = None
+            pages.append((img, chars))
+    finally:
+        pdf.close()
+    return pages
+
+
+def _layout_page(args):
+    domain, img = args
+    layouters = _page_worker.setdefault("layouters", {})
+    if domain not in layouters:
+        layouters[domain] = LayoutRecognizer(domain)
+    return layouters[domain].forward([img], thr=0.2)[0]
+
+
+def _ocr_page(pagenum, img, chars, ZM, mean_height):
+    return RAGFlowPdfParser._ocr_page(_page_worker["ocr"], pagenum, img, chars, ZM, mean_height)
+
+
 class PlainParser(object):
     def __call__(self, filename, from_page=0, to_page=100000, **kwargs):
         self.outlines = []
@@ -18,7 +18,7 @@ import io
 import pdfplumber
 
 from .ocr import OCR
-from .recognizer import Recognizer
+from .recognizer import Recognizer, BoxTable
 from .layout_recognizer import LayoutRecognizer4YOLOv10 as LayoutRecognizer
 from .table_structure_recognizer import TableStructureRecognizer
 
@@ -72,6 +72,7 @@ def init_in_out(args):
 __all__ = [
     "OCR",
     "Recognizer",
+    "BoxTable",
     "LayoutRecognizer",
     "TableStructureRecognizer",
     "init_in_out",
@@ -24,7 +24,7 @@ import numpy as np
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
-from deepdoc.vision import Recognizer
+from deepdoc.vision import Recognizer, BoxTable
 from deepdoc.vision.operators import nms
 
 
@@ -58,7 +58,7 @@ class LayoutRecognizer(Recognizer):
         self.garbage_layouts = ["footer", "header", "reference"]
 
     def __call__(self, image_list, ocr_res, scale_factor=3,
-                 thr=0.2, batch_size=16, drop=True):
+                 thr=0.2, batch_size=16, drop=True, layouts=None):
         def __is_garbage(b):
             patt = [r"^•+$", r"(版权归©|免责条款|地址[:：])", r"\.{3,}", "^[0-9]{1,2} / ?[0-9]{1,2}$",
                     r"^[0-9]{1,2} of [0-9]{1,2}$", "^http://[^ ]{12,}",
@@ -67,7 +67,8 @@ class LayoutRecognizer(Recognizer):
                     ]
             return any([re.search(p, b["text"]) for p in patt])
 
-        layouts = super().__call__(image_list, thr, batch_size)
+        if layouts is None:
+            layouts = super().__call__(image_list, thr, batch_size)
         # save_results(image_list, layouts, self.labels, output_dir='output/', threshold=0.7)
         assert len(image_list) == len(ocr_res)
         # Tag layout type
@@ -91,7 +92,7 @@ class LayoutRecognizer(Recognizer):
             # Tag layout type, layouts are ready
             def findLayout(ty):
                 nonlocal bxs, lts, self
-                lts_ = [lt for lt in lts if lt["type"] == ty]
+                lts_ = BoxTable([lt for lt in lts if lt["type"] == ty])
                 i = 0
                 while i < len(bxs):
                     if bxs[i].get("layout_type"):
@@ -16,12 +16,15 @@
 
 import logging
 import copy
+import threading
 import time
 import os
 
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
+from rag.settings import ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS, ONNX_CPU_MEM_ARENA, ONNX_GRAPH_OPT_LEVEL, \
+    ONNX_QUANTIZED, OCR_REC_BATCH_SIZE, OCR_REC_BUCKET_RATIO
 from .operators import *  # noqa: F403
 from . import operators
 import math
@@ -65,31 +68,72 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
-def load_model(model_dir, nm):
-    model_file_path = os.path.join(model_dir, nm + ".onnx")
+def cuda_is_available():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return True
+    except Exception:
+        return False
+    return False
+
+
+GRAPH_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# Sessions are shared by every OCR/Recognizer instance of the process, keyed by model file and options.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def model_file(model_dir, nm):
+    if ONNX_QUANTIZED:
+        quantized = os.path.join(model_dir, nm + ".int8.onnx")
+        if os.path.exists(quantized):
+            return quantized
+    return os.path.join(model_dir, nm + ".onnx")
+
+
+def load_model(model_dir, nm, intra_op_num_threads=2, inter_op_num_threads=2, enable_cpu_mem_arena=False):
+    """
+    Returns the session of model `nm` with its first input and run options, created once per process.
+    Thread counts (0: as many as cores) and the CPU arena default to the arguments, which the
+    ONNX_* environment variables override.
+    """
+    model_file_path = model_file(model_dir, nm)
     if not os.path.exists(model_file_path):
         raise ValueError("not find model file path {}".format(
             model_file_path))
 
-    def cuda_is_available():
-        try:
-            import torch
-            if torch.cuda.is_available():
-                return True
-        except Exception:
-            return False
-        return False
+    intra_op_num_threads = int(ONNX_INTRA_OP_THREADS or intra_op_num_threads)
+    inter_op_num_threads = int(ONNX_INTER_OP_THREADS or inter_op_num_threads)
+    enable_cpu_mem_arena = bool(int(ONNX_CPU_MEM_ARENA or enable_cpu_mem_arena))
+    key = (model_file_path, intra_op_num_threads, inter_op_num_threads, enable_cpu_mem_arena)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = _create_session(model_file_path, nm, intra_op_num_threads, inter_op_num_threads,
+                                             enable_cpu_mem_arena)
+        return _sessions[key]
+
 
+def _create_session(model_file_path, nm, intra_op_num_threads, inter_op_num_threads, enable_cpu_mem_arena):
     options = ort.SessionOptions()
-    options.enable_cpu_mem_arena = False
+    options.enable_cpu_mem_arena = enable_cpu_mem_arena
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = inter_op_num_threads
+    options.graph_optimization_level = GRAPH_OPT_LEVELS.get(ONNX_GRAPH_OPT_LEVEL.lower(),
+                                                            ort.GraphOptimizationLevel.ORT_ENABLE_ALL)
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
     run_options = ort.RunOptions()
     if cuda_is_available():
+        options.enable_cpu_mem_arena = False
         cuda_provider_options = {
             "device_id": 0, # Use specific GPU
             "gpu_mem_limit": 512 * 1024 * 1024, # Limit gpu memory
@@ -102,21 +146,24 @@ def load_model(model_dir, nm):
             provider_options=[cuda_provider_options]
             )
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:0")
-        logging.info(f"TextRecognizer {nm} uses GPU")
+        logging.info(f"Model {nm} ({model_file_path}) uses GPU")
     else:
         sess = ort.InferenceSession(
             model_file_path,
             options=options,
             providers=['CPUExecutionProvider'])
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
-        logging.info(f"TextRecognizer {nm} uses CPU")
+        logging.info(f"Model {nm} ({model_file_path}) uses CPU, {intra_op_num_threads} intra-op threads")
     return sess, sess.get_inputs()[0], run_options
 
 
 class TextRecognizer(object):
     def __init__(self, model_dir):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
+        self.rec_batch_num = OCR_REC_BATCH_SIZE
+        self.rec_bucket_ratio = OCR_REC_BUCKET_RATIO
+        # input tensors are views of a per-thread buffer, grown when a batch needs more room
+        self.batch_buffer = threading.local()
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
@@ -125,16 +172,22 @@ class TextRecognizer(object):
         self.postprocess_op = build_post_process(postprocess_params)
         self.predictor, self.input_tensor, self.run_options = load_model(model_dir, 'rec')
 
-    def resize_norm_img(self, img, max_wh_ratio):
+    def padded_width(self, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
-
-        assert imgC == img.shape[2]
         imgW = int((imgH * max_wh_ratio))
         w = self.input_tensor.shape[3:][0]
         if isinstance(w, str):
             pass
         elif w is not None and w > 0:
             imgW = w
+        return imgW
+
+    def resize_norm_img(self, img, max_wh_ratio, out=None):
+        """Resizes and normalizes a crop, padded with zeros to the batch width; written into `out` if given, which must be zeroed."""
+        imgC, imgH, imgW = self.rec_image_shape
+
+        assert imgC == img.shape[2]
+        imgW = self.padded_width(max_wh_ratio)
         h, w = img.shape[:2]
         ratio = w / float(h)
         if math.ceil(imgH * ratio) > imgW:
@@ -147,7 +200,7 @@ class TextRecognizer(object):
         resized_image = resized_image.transpose((2, 0, 1)) / 255
         resized_image -= 0.5
         resized_image /= 0.5
-        padding_im = np.zeros((imgC, imgH, imgW), dtype=np.float32)
+        padding_im = np.zeros((imgC, imgH, imgW), dtype=np.float32) if out is None else out
         padding_im[:, :, 0:resized_w] = resized_image
         return padding_im
 
@@ -335,6 +388,35 @@ class TextRecognizer(object):
 
         return img
 
+    def batches(self, ratios):
+        """Cuts crops sorted by width-height ratio into batches, each one within a width bucket."""
+        imgC, imgH, imgW = self.rec_image_shape[:3]
+        batches = []
+        beg = 0
+        for i, r in enumerate(ratios):
+            if i > beg and (i - beg >= self.rec_batch_num or
+                            r > max(ratios[beg], imgW / imgH) * self.rec_bucket_ratio):
+                batches.append((beg, i))
+                beg = i
+        if beg < len(ratios):
+            batches.append((beg, len(ratios)))
+        return batches
+
+    def batch_tensor(self, n, imgW):
+        imgC, imgH = self.rec_image_shape[:2]
+        size = n * imgC * imgH * imgW
+        default = self.rec_batch_num * imgC * imgH * self.rec_image_shape[2]
+        # A batch of very wide crops gets its own tensor, so the buffer each thread keeps stays within a few default batches.
+        if size > 4 * default:
+            return np.zeros((n, imgC, imgH, imgW), dtype=np.float32)
+        buf = getattr(self.batch_buffer, "buf", None)
+        if buf is None or buf.size < size:
+            buf = np.empty(max(size, default), dtype=np.float32)
+            self.batch_buffer.buf = buf
+        tensor = buf[:size].reshape((n, imgC, imgH, imgW))
+        tensor.fill(0)
+        return tensor
+
     def __call__(self, img_list):
         img_num = len(img_list)
         # Calculate the aspect ratio of all text bars
@@ -344,12 +426,9 @@ class TextRecognizer(object):
         # Sorting can speed up the recognition process
         indices = np.argsort(np.array(width_list))
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
         st = time.time()
 
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
-            norm_img_batch = []
+        for beg_img_no, end_img_no in self.batches([width_list[i] for i in indices]):
             imgC, imgH, imgW = self.rec_image_shape[:3]
             max_wh_ratio = imgW / imgH
             # max_wh_ratio = 0
@@ -357,13 +436,9 @@ class TextRecognizer(object):
                 h, w = img_list[indices[ino]].shape[0:2]
                 wh_ratio = w * 1.0 / h
                 max_wh_ratio = max(max_wh_ratio, wh_ratio)
+            norm_img_batch = self.batch_tensor(end_img_no - beg_img_no, self.padded_width(max_wh_ratio))
             for ino in range(beg_img_no, end_img_no):
-                norm_img = self.resize_norm_img(img_list[indices[ino]],
-                                                max_wh_ratio)
-                norm_img = norm_img[np.newaxis, :]
-                norm_img_batch.append(norm_img)
-            norm_img_batch = np.concatenate(norm_img_batch)
-            norm_img_batch = norm_img_batch.copy()
+                self.resize_norm_img(img_list[indices[ino]], max_wh_ratio, norm_img_batch[ino - beg_img_no])
 
             input_dict = {}
             input_dict[self.input_tensor.name] = norm_img_batch
@@ -609,6 +684,14 @@ class OCR(object):
             return ""
         return text
 
+    def recognize_batch(self, ori_im, boxes):
+        """Same as calling `recognize` for every box of the image, with the crops recognized in batches."""
+        if not boxes:
+            return []
+        img_crops = [self.get_rotate_crop_image(ori_im, box) for box in boxes]
+        rec_res, elapse = self.text_recognizer(img_crops)
+        return [text if score >= self.drop_score else "" for text, score in rec_res]
+
     def __call__(self, img, cls=True):
         time_dict = {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}
 
@@ -14,6 +14,7 @@
 #  limitations under the License.
 #
 
+import bisect
 import logging
 import os
 import math
@@ -21,13 +22,57 @@ import numpy as np
 import cv2
 from copy import deepcopy
 
-import onnxruntime as ort
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
 from .operators import *  # noqa: F403
 from .operators import preprocess
 from . import operators
+from .ocr import load_model
+
+
+class BoxTable(object):
+    """
+    Struct-of-arrays view of a list of boxes (dicts with x0, x1, top and bottom) for the geometry of
+    `Recognizer`. Indexing returns the boxes themselves, slicing returns a view sharing the arrays.
+    Build it once for boxes that are matched many times, e.g. a page's text boxes against its characters.
+    """
+
+    def __init__(self, boxes, _arrays=None):
+        self.boxes = boxes
+        if _arrays is None:
+            _arrays = [np.array([b[k] for b in boxes], dtype=np.float64).reshape(-1)
+                       for k in ["x0", "x1", "top", "bottom"]]
+            _arrays.append(np.array([b.get("page_number", 0) for b in boxes], dtype=np.int64).reshape(-1))
+        self.x0, self.x1, self.top, self.bottom, self.page = _arrays
+        self._bottom_max = None
+        self._top_min = None
+
+    @staticmethod
+    def of(boxes):
+        return boxes if isinstance(boxes, BoxTable) else BoxTable(boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __iter__(self):
+        return iter(self.boxes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return BoxTable(self.boxes[i], [a[i] for a in [self.x0, self.x1, self.top, self.bottom, self.page]])
+        return self.boxes[i]
+
+    def span(self, top, bottom):
+        """
+        Range [s, e) out of which no box overlaps rows `top` to `bottom`. Tight when the boxes are
+        sorted by top, as from `Recognizer.sort_Y_firstly`.
+        """
+        if self._bottom_max is None:
+            self._bottom_max = np.maximum.accumulate(self.bottom)
+            self._top_min = np.minimum.accumulate(self.top[::-1])[::-1]
+        return int(np.searchsorted(self._bottom_max, top, "left")), \
+            int(np.searchsorted(self._top_min, bottom, "right"))
 
 
 class Recognizer(object):
@@ -52,119 +97,103 @@ class Recognizer(object):
                 model_dir = snapshot_download(repo_id="InfiniFlow/deepdoc",
                                               local_dir=os.path.join(get_project_base_directory(), "rag/res/deepdoc"),
                                               local_dir_use_symlinks=False)
-                model_file_path = os.path.join(model_dir, task_name + ".onnx")
-        else:
-            model_file_path = os.path.join(model_dir, task_name + ".onnx")
 
-        if not os.path.exists(model_file_path):
-            raise ValueError("not find model file path {}".format(
-                model_file_path))
-
-        def cuda_is_available():
-            try:
-                import torch
-                if torch.cuda.is_available():
-                    return True
-            except Exception:
-                return False
-            return False
-
-        # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
-        # Shrink GPU memory after execution
-        self.run_options = ort.RunOptions()
-
-        if cuda_is_available():
-            options = ort.SessionOptions()
-            options.enable_cpu_mem_arena = False
-            cuda_provider_options = {
-                "device_id": 0, # Use specific GPU
-                "gpu_mem_limit": 512 * 1024 * 1024, # Limit gpu memory
-                "arena_extend_strategy": "kNextPowerOfTwo",  # gpu memory allocation strategy
-            }
-            self.ort_sess = ort.InferenceSession(
-                model_file_path, options=options,
-                providers=['CUDAExecutionProvider'],
-                provider_options=[cuda_provider_options]
-            )
-            self.run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:0")
-            logging.info(f"Recognizer {task_name} uses GPU")
-        else:
-            self.ort_sess = ort.InferenceSession(model_file_path, providers=['CPUExecutionProvider'])
-            self.run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
-            logging.info(f"Recognizer {task_name} uses CPU")
+        # Unlike OCR models, recognizers use every core and the CPU memory arena unless configured otherwise.
+        self.ort_sess, _, self.run_options = load_model(model_dir, task_name, 0, 0, True)
         self.input_names = [node.name for node in self.ort_sess.get_inputs()]
         self.output_names = [node.name for node in self.ort_sess.get_outputs()]
         self.input_shape = self.ort_sess.get_inputs()[0].shape[2:4]
         self.label_list = label_list
 
     @staticmethod
-    def sort_Y_firstly(arr, threashold):
-        # sort using y1 first and then x1
-        arr = sorted(arr, key=lambda r: (r["top"], r["x0"]))
+    def _restore_order(arr, pending, cond, copy=False):
+        """
+        Same as: for i in range(len(arr) - 1), for j from i down to 0, swap arr[j] and arr[j + 1] if
+        cond(arr[j], arr[j + 1]). `pending` holds the j for which cond holds in `arr` as given.
+
+        A pass changes nothing but the pairs it swaps and their neighbours, so only the pairs known to
+        hold are visited. cond(a, b) must imply not cond(b, a). With `copy`, moved boxes are deep copies.
+        """
+        pending = sorted(pending)
+        moved = set()
+
+        def update(j):
+            if j < 0 or j + 1 >= len(arr):
+                return
+            k = bisect.bisect_left(pending, j)
+            present = k < len(pending) and pending[k] == j
+            if cond(arr[j], arr[j + 1]):
+                if not present:
+                    pending.insert(k, j)
+            elif present:
+                pending.pop(k)
+
         for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if abs(arr[j + 1]["top"] - arr[j]["top"]) < threashold \
-                        and arr[j + 1]["x0"] < arr[j]["x0"]:
-                    tmp = deepcopy(arr[j])
-                    arr[j] = deepcopy(arr[j + 1])
-                    arr[j + 1] = deepcopy(tmp)
+            k = bisect.bisect_right(pending, i)
+            while k:
+                j = pending.pop(k - 1)
+                arr[j], arr[j + 1] = arr[j + 1], arr[j]
+                if copy:
+                    moved.update([id(arr[j]), id(arr[j + 1])])
+                update(j - 1)
+                update(j + 1)
+                k = bisect.bisect_right(pending, j - 1)
+        if moved:
+            arr = [deepcopy(b) if id(b) in moved else b for b in arr]
         return arr
 
     @staticmethod
-    def sort_X_firstly(arr, threashold, copy=True):
+    def _sort_firstly(arr, first, second, threashold, copy):
+        # sort using `first` and then `second`, then restore the order of `second` within `threashold` of `first`
+        if not arr:
+            return list(arr)
+        tbl = BoxTable.of(arr)
+        f, s = getattr(tbl, first), getattr(tbl, second)
+        idx = np.lexsort((s, f))
+        f, s = f[idx], s[idx]
+        arr = [tbl[i] for i in idx]
+        pending = np.flatnonzero((np.abs(f[1:] - f[:-1]) < threashold) & (s[1:] < s[:-1]))
+        if not len(pending):
+            return arr
+        return Recognizer._restore_order(
+            arr, pending.tolist(),
+            lambda a, b: abs(b[first] - a[first]) < threashold and b[second] < a[second], copy)
+
+    @staticmethod
+    def sort_Y_firstly(arr, threashold):
         # sort using y1 first and then x1
-        arr = sorted(arr, key=lambda r: (r["x0"], r["top"]))
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if abs(arr[j + 1]["x0"] - arr[j]["x0"]) < threashold \
-                        and arr[j + 1]["top"] < arr[j]["top"]:
-                    tmp = deepcopy(arr[j]) if copy else arr[j]
-                    arr[j] = deepcopy(arr[j + 1]) if copy else arr[j + 1]
-                    arr[j + 1] = deepcopy(tmp) if copy else tmp
-        return arr
+        return Recognizer._sort_firstly(arr, "top", "x0", threashold, True)
+
+    @staticmethod
+    def sort_X_firstly(arr, threashold, copy=True):
+        # sort using x1 first and then y1
+        return Recognizer._sort_firstly(arr, "x0", "top", threashold, copy)
 
     @staticmethod
     def sort_C_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["x0"], r["top"]))
         arr = Recognizer.sort_X_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if "C" not in arr[j] or "C" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["C"] < arr[j]["C"] \
-                        or (
-                        arr[j + 1]["C"] == arr[j]["C"]
-                        and arr[j + 1]["top"] < arr[j]["top"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
 
-        return sorted(arr, key=lambda r: (r.get("C", r["x0"]), r["top"]))
+        def cond(a, b):
+            if "C" not in a or "C" not in b:
+                return False
+            return b["C"] < a["C"] or (b["C"] == a["C"] and b["top"] < a["top"])
+
+        return Recognizer._restore_order(arr, [j for j in range(len(arr) - 1) if cond(arr[j], arr[j + 1])], cond)
 
     @staticmethod
     def sort_R_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["top"], r["x0"]))
         arr = Recognizer.sort_Y_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                if "R" not in arr[j] or "R" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["R"] < arr[j]["R"] \
-                        or (
-                        arr[j + 1]["R"] == arr[j]["R"]
-                        and arr[j + 1]["x0"] < arr[j]["x0"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+
+        def cond(a, b):
+            if "R" not in a or "R" not in b:
+                return False
+            return b["R"] < a["R"] or (b["R"] == a["R"] and b["x0"] < a["x0"])
+
+        return Recognizer._restore_order(arr, [j for j in range(len(arr) - 1) if cond(arr[j], arr[j + 1])], cond)
 
     @staticmethod
     def overlapped_area(a, b, ratio=True):
@@ -187,6 +216,24 @@ class Recognizer(object):
             ov /= (x1 - x0) * (btm - tp)
         return ov
 
+    @staticmethod
+    def overlapped_areas(a, b, ratio=True):
+        """`overlapped_area` where `a` or `b` is a `BoxTable`: an array with one area per box of the table."""
+        def coords(x):
+            if isinstance(x, BoxTable):
+                return x.top, x.bottom, x.x0, x.x1
+            return x["top"], x["bottom"], x["x0"], x["x1"]
+
+        tp, btm, x0, x1 = coords(a)
+        b_tp, b_btm, b_x0, b_x1 = coords(b)
+        ov = (np.minimum(b_btm, btm) - np.maximum(b_tp, tp)) * (np.minimum(b_x1, x1) - np.maximum(b_x0, x0))
+        area = (x1 - x0) * (btm - tp)
+        apart = (b_x0 > x1) | (b_x1 < x0) | (b_btm < tp) | (b_tp > btm) | (x1 - x0 == 0) | (btm - tp == 0)
+        ov = np.where(apart, 0., ov)
+        if ratio:
+            ov = np.divide(ov, area, out=ov.copy(), where=ov > 0)
+        return ov
+
     @staticmethod
     def layouts_cleanup(boxes, layouts, far=2, thr=0.7):
         def notOverlapped(a, b):
@@ -196,6 +243,7 @@ class Recognizer(object):
                         a["top"] > b["bottom"]])
 
         i = 0
+        table = None
         while i + 1 < len(layouts):
             j = i + 1
             while j < min(i + far, len(layouts)) \
@@ -217,12 +265,10 @@ class Recognizer(object):
                     layouts.pop(i)
                 continue
 
-            area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not notOverlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not notOverlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if table is None:
+                table = BoxTable.of(boxes)
+            area_i = Recognizer.overlapped_areas(table, layouts[i], False).sum()
+            area_i_1 = Recognizer.overlapped_areas(table, layouts[j], False).sum()
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -275,7 +321,8 @@ class Recognizer(object):
     def find_overlapped(box, boxes_sorted_by_y, naive=False):
         if not boxes_sorted_by_y:
             return
-        bxs = boxes_sorted_by_y
+        tbl = boxes_sorted_by_y if isinstance(boxes_sorted_by_y, BoxTable) else None
+        bxs = tbl.boxes if tbl is not None else boxes_sorted_by_y
         s, e, ii = 0, len(bxs), 0
         while s < e and not naive:
             ii = (e + s) // 2
@@ -296,46 +343,49 @@ class Recognizer(object):
                 e -= 1
             break
 
-        max_overlaped_i, max_overlaped = None, 0
-        for i in range(s, e):
-            ov = Recognizer.overlapped_area(bxs[i], box)
-            if ov <= max_overlaped:
-                continue
-            max_overlaped_i = i
-            max_overlaped = ov
+        if e - s > 32 and tbl is not None:
+            lo, hi = tbl.span(box["top"], box["bottom"])
+            s, e = max(s, lo), min(e, hi)
+        if e - s <= 32:
+            # too few to be worth arrays
+            max_overlaped_i, max_overlaped = None, 0
+            for i in range(s, e):
+                ov = Recognizer.overlapped_area(bxs[i], box)
+                if ov <= max_overlaped:
+                    continue
+                max_overlaped_i = i
+                max_overlaped = ov
+            return max_overlaped_i
 
-        return max_overlaped_i
+        tbl = tbl[s:e] if tbl is not None else BoxTable(bxs[s:e])
+        ov = Recognizer.overlapped_areas(tbl, box)
+        i = int(np.argmax(ov))
+        return s + i if ov[i] > 0 else None
 
     @staticmethod
     def find_horizontally_tightest_fit(box, boxes):
         if not boxes:
             return
-        min_dis, min_i = 1000000, None
-        for i,b in enumerate(boxes):
-            if box.get("layoutno", "0") != b.get("layoutno", "0"):
-                continue
-            dis = min(abs(box["x0"] - b["x0"]), abs(box["x1"] - b["x1"]), abs(box["x0"]+box["x1"] - b["x1"] - b["x0"])/2)
-            if dis < min_dis:
-                min_i = i
-                min_dis = dis
-        return min_i
+        tbl = BoxTable.of(boxes)
+        dis = np.minimum(np.minimum(np.abs(box["x0"] - tbl.x0), np.abs(box["x1"] - tbl.x1)),
+                         np.abs(box["x0"] + box["x1"] - tbl.x1 - tbl.x0) / 2)
+        layoutno = box.get("layoutno", "0")
+        dis[[b.get("layoutno", "0") != layoutno for b in tbl]] = np.inf
+        i = int(np.argmin(dis))
+        return i if dis[i] < 1000000 else None
 
     @staticmethod
     def find_overlapped_with_threashold(box, boxes, thr=0.3):
         if not boxes:
             return
-        max_overlapped_i, max_overlapped, _max_overlapped = None, thr, 0
-        s, e = 0, len(boxes)
-        for i in range(s, e):
-            ov = Recognizer.overlapped_area(box, boxes[i])
-            _ov = Recognizer.overlapped_area(boxes[i], box)
-            if (ov, _ov) < (max_overlapped, _max_overlapped):
-                continue
-            max_overlapped_i = i
-            max_overlapped = ov
-            _max_overlapped = _ov
-
-        return max_overlapped_i
+        tbl = BoxTable.of(boxes)
+        ov = Recognizer.overlapped_areas(box, tbl)
+        _ov = Recognizer.overlapped_areas(tbl, box)
+        # the last of the greatest (ov, _ov), as long as it is no less than (thr, 0)
+        i = int(np.lexsort((_ov, ov))[-1])
+        if (ov[i], _ov[i]) < (thr, 0):
+            return None
+        return i
 
     def preprocess(self, image_list):
         inputs = []
@@ -465,18 +515,13 @@ class Recognizer(object):
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        imgs = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                imgs.append(np.array(image_list[i]))
-            else:
-                imgs.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(imgs)) / batch_size)
+        # images are converted one batch at a time, so only a batch of page arrays is held in memory
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(imgs))
-            batch_image_list = imgs[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = [img if isinstance(img, np.ndarray) else np.array(img)
+                                for img in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
             for ins in inputs:
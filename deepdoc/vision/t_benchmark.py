@@ -0,0 +1,95 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import time
+import numpy as np
+
+from api.utils.file_utils import get_project_base_directory
+from deepdoc.vision.ocr import load_model, model_file
+
+# Batch, channels, height and width used for the dynamic dimensions of each model's first input.
+SHAPES = {
+    "det": (1, 3, 960, 960),
+    "rec": (16, 3, 48, 320),
+}
+DEFAULT_SHAPE = (1, 3, 640, 640)
+ONNX_TYPES = {"tensor(float)": np.float32, "tensor(float16)": np.float16, "tensor(int64)": np.int64,
+              "tensor(int32)": np.int32}
+
+
+def dummy_inputs(sess, nm):
+    default = SHAPES.get(nm, DEFAULT_SHAPE)
+    inputs = {}
+    for inp in sess.get_inputs():
+        shape = [d if isinstance(d, int) and d > 0 else default[i] if i < len(default) else 1
+                 for i, d in enumerate(inp.shape)]
+        inputs[inp.name] = np.random.rand(*shape).astype(ONNX_TYPES.get(inp.type, np.float32))
+    return inputs
+
+
+def main(args):
+    model_dir = args.model_dir or os.path.join(get_project_base_directory(), "rag/res/deepdoc")
+    print(f"{'model':<24}{'file':<28}{'load(s)':>9}{'warmup(ms)':>12}{'p50(ms)':>10}{'p95(ms)':>10}  input")
+    for nm in args.models.split(","):
+        st = time.time()
+        try:
+            # OCR models default to 2 threads without arena, recognizers to all cores with it.
+            if nm in ["det", "rec"]:
+                sess, _, run_options = load_model(model_dir, nm)
+            else:
+                sess, _, run_options = load_model(model_dir, nm, 0, 0, True)
+        except Exception as e:
+            print(f"{nm:<24}{e}")
+            continue
+        load = time.time() - st
+        inputs = dummy_inputs(sess, nm)
+
+        st = time.time()
+        for _ in range(args.warmup):
+            sess.run(None, inputs, run_options)
+        warmup = (time.time() - st) * 1000. / max(1, args.warmup)
+
+        elapsed = []
+        for _ in range(args.iterations):
+            st = time.time()
+            sess.run(None, inputs, run_options)
+            elapsed.append((time.time() - st) * 1000.)
+        shapes = ",".join("x".join(str(d) for d in v.shape) for v in inputs.values())
+        print(f"{nm:<24}{os.path.basename(model_file(model_dir, nm)):<28}{load:>9.2f}{warmup:>12.1f}"
+              f"{np.percentile(elapsed, 50):>10.1f}{np.percentile(elapsed, 95):>10.1f}  {shapes}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', help="Comma separated model names. Default: det,rec,layout,tsr",
+                        default="det,rec,layout,tsr")
+    parser.add_argument('--model_dir', help="Directory of the ONNX models. Default: rag/res/deepdoc",
+                        default="")
+    parser.add_argument('--warmup', help="Runs before measuring. Default: 3", type=int, default=3)
+    parser.add_argument('--iterations', help="Measured runs. Default: 20", type=int, default=20)
+    args = parser.parse_args()
+    main(args)
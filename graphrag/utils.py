@@ -23,7 +23,9 @@ from networkx.readwrite import json_graph
 
 from api import settings
 from rag.nlp import search, rag_tokenizer
+from rag.settings import EMBEDDING_CACHE_DTYPE
 from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.embedding_cache import pack_vector, unpack_vector
 from rag.utils.redis_conn import REDIS_CONN
 
 ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
@@ -78,51 +80,69 @@ def dict_has_keys_with_types(
     return True
 
 
-def get_llm_cache(llmnm, txt, history, genconf):
+def _llm_cache_key(llmnm, txt, history, genconf):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
     hasher.update(str(history).encode("utf-8"))
     hasher.update(str(genconf).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
+
+def get_llm_cache(llmnm, txt, history, genconf):
+    k = _llm_cache_key(llmnm, txt, history, genconf)
     bin = REDIS_CONN.get(k)
     if not bin:
         return
     return bin
 
 
-def set_llm_cache(llmnm, txt, v, history, genconf):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-    hasher.update(str(history).encode("utf-8"))
-    hasher.update(str(genconf).encode("utf-8"))
+def get_llm_cache_batch(llmnm, txts, history, genconf):
+    keys = [_llm_cache_key(llmnm, t, history, genconf) for t in txts]
+    return [bin if bin else None for bin in REDIS_CONN.mget(keys)]
 
-    k = hasher.hexdigest()
+
+def set_llm_cache(llmnm, txt, v, history, genconf):
+    k = _llm_cache_key(llmnm, txt, history, genconf)
     REDIS_CONN.set(k, v.encode("utf-8"), 24*3600)
 
 
-def get_embed_cache(llmnm, txt):
+def _embed_cache_key(llmnm, txt):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
+
+def _decode_embed_cache(bin):
     if not bin:
         return
-    return np.array(json.loads(bin))
+    arr = unpack_vector(bin)
+    if arr is not None:
+        return arr
+    # entries written before the binary format are JSON lists of floats
+    try:
+        return np.array(json.loads(bin))
+    except Exception:
+        return
+
+
+def get_embed_cache(llmnm, txt):
+    return get_embed_cache_batch(llmnm, [txt])[0]
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+    set_embed_cache_batch(llmnm, [txt], [arr])
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24*3600)
+
+def get_embed_cache_batch(llmnm, txts):
+    keys = [_embed_cache_key(llmnm, t) for t in txts]
+    return [_decode_embed_cache(bin) for bin in REDIS_CONN.mget_bin(keys)]
+
+
+def set_embed_cache_batch(llmnm, txts, arrs):
+    REDIS_CONN.mset_bin({_embed_cache_key(llmnm, t): pack_vector(arr, EMBEDDING_CACHE_DTYPE) for t, arr in zip(txts, arrs)},
+                        24*3600)
 
 
 def get_tags_from_cache(kb_ids):
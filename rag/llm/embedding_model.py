@@ -35,6 +35,10 @@ import json
 
 
 class Base(ABC):
+    # How many encode() calls may run at once; remote APIs overlap network latency,
+    # models running in this process gain nothing from it.
+    max_concurrency = 4
+
     def __init__(self, key, model_name):
         pass
 
@@ -57,6 +61,7 @@ class Base(ABC):
 
 
 class DefaultEmbedding(Base):
+    max_concurrency = 1
     _model = None
     _model_name = ""
     _model_lock = threading.Lock()
@@ -340,6 +345,7 @@ class XinferenceEmbed(Base):
 
 
 class YoudaoEmbed(Base):
+    max_concurrency = 1
     _client = None
 
     def __init__(self, key=None, model_name="maidalun1020/bce-embedding-base_v1", **kwargs):
@@ -404,6 +410,8 @@ class JinaEmbed(Base):
 
 
 class InfinityEmbed(Base):
+    # In process, and every encode starts and stops the engine: batches must not overlap.
+    max_concurrency = 1
     _model = None
 
     def __init__(
@@ -18,6 +18,7 @@ import logging
 import random
 from collections import Counter
 
+from rag.settings import TOKENIZER_PROCESSES
 from rag.utils import num_tokens_from_string
 from . import rag_tokenizer
 import re
@@ -254,8 +255,20 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_many(ds, ts, eng):
+    """Same as calling `tokenize` on every pair of ds and ts, with the texts tokenized in one batch."""
+    texts = []
+    for d, t in zip(ds, ts):
+        d["content_with_weight"] = t
+        texts.append(re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t))
+    for d, (ltks, sm_ltks) in zip(ds, rag_tokenizer.tokenize_batch(texts, True, TOKENIZER_PROCESSES)):
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
     res = []
+    texts = []
     # wrap up as es documents
     for ck in chunks:
         if len(ck.strip()) == 0:
@@ -269,13 +282,15 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 ck = pdf_parser.remove_tag(ck)
             except NotImplementedError:
                 pass
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    tokenize_many(res, texts, eng)
     return res
 
 
 def tokenize_chunks_docx(chunks, doc, eng, images):
     res = []
+    texts = []
     # wrap up as es documents
     for ck, image in zip(chunks, images):
         if len(ck.strip()) == 0:
@@ -283,8 +298,9 @@ def tokenize_chunks_docx(chunks, doc, eng, images):
         logging.debug("-- {}".format(ck))
         d = copy.deepcopy(doc)
         d["image"] = image
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    tokenize_many(res, texts, eng)
     return res
 
 
@@ -206,19 +206,29 @@ class FulltextQueryer:
         return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
 
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
-            d = {}
+        import numpy as np
+
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = {}
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] = qtwt.get(t, 0) + c
+        if not btkss:
+            return []
+        # Same score as similarity(): the share of query weight whose terms occur in the candidate.
+        # Only the presence of a term in a candidate counts, so candidates are never weighted;
+        # all of them are scored at once as a term-occurrence matrix times the query weights.
+        terms = list(qtwt.keys())
+        wts = np.array([qtwt[t] for t in terms], dtype=np.float64)
+        hits = np.zeros((len(btkss), len(terms)), dtype=np.float64)
+        for r, tks in enumerate(btkss):
             if isinstance(tks, str):
                 tks = tks.split()
-            for t, c in self.tw.weights(tks, preprocess=False):
-                if t not in d:
-                    d[t] = 0
-                d[t] += c
-            return d
-
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            tks = set(tks)
+            cols = [i for i, t in enumerate(terms) if t in tks]
+            if cols:
+                hits[r, cols] = 1
+        return ((hits @ wts + 1e-9) / (wts.sum() + 1e-9)).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
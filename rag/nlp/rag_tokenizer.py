@@ -15,13 +15,16 @@
 #
 
 import logging
-import copy
 import datrie
+import functools
 import math
+import multiprocessing
 import os
 import re
 import string
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from hanziconv import HanziConv
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
@@ -66,6 +69,13 @@ class RagTokenizer:
         self.stemmer = PorterStemmer()
         self.lemmatizer = WordNetLemmatizer()
 
+        # Tokenization only depends on the dictionary, so results are memoized per segment, token and word.
+        self.segment_tokens = functools.lru_cache(maxsize=200000)(self.segment_tokens_)
+        self.fine_grained_token = functools.lru_cache(maxsize=200000)(self.fine_grained_token_)
+        self.stem = functools.lru_cache(maxsize=200000)(self.stem_)
+        # Bumped whenever the dictionary changes, so memos kept outside the tokenizer know to drop their results.
+        self.dict_version = 0
+
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-z\.-]+|[0-9,\.-]+)"
 
         trie_file_name = self.DIR_ + ".txt.trie"
@@ -88,6 +98,7 @@ class RagTokenizer:
         self.loadDict_(self.DIR_ + ".txt")
 
     def loadUserDict(self, fnm):
+        self.clear_cache()
         try:
             self.trie_ = datrie.Trie.load(fnm + ".trie")
             return
@@ -96,8 +107,14 @@ class RagTokenizer:
         self.loadDict_(fnm)
 
     def addUserDict(self, fnm):
+        self.clear_cache()
         self.loadDict_(fnm)
 
+    def clear_cache(self):
+        self.segment_tokens.cache_clear()
+        self.fine_grained_token.cache_clear()
+        self.dict_version += 1
+
     def _strQ2B(self, ustring):
         """Convert full-width characters to half-width characters"""
         rstring = ""
@@ -117,52 +134,57 @@ class RagTokenizer:
         return HanziConv.toSimplified(line)
 
     def dfs_(self, chars, s, preTks, tkslist):
+        path = None
+        for tk in preTks:
+            path = (tk, path)
+        return self._dfs(chars, s, path, len(preTks), tkslist)
+
+    def _dfs(self, chars, s, path, n, tkslist):
+        # `path` holds the tokens picked so far as immutable (token, parent) cells, newest first,
+        # so that branches share their common prefix instead of copying it.
         res = s
         # if s > MAX_L or s>= len(chars):
         if s >= len(chars):
-            tkslist.append(preTks)
+            tks = [None] * n
+            for i in range(n - 1, -1, -1):
+                tks[i], path = path
+            tkslist.append(tks)
             return res
 
         # pruning
         S = s + 1
         if s + 2 <= len(chars):
-            t1, t2 = "".join(chars[s:s + 1]), "".join(chars[s:s + 2])
+            t1, t2 = chars[s:s + 1], chars[s:s + 2]
             if self.trie_.has_keys_with_prefix(self.key_(t1)) and not self.trie_.has_keys_with_prefix(
                     self.key_(t2)):
                 S = s + 2
-        if len(preTks) > 2 and len(
-                preTks[-1][0]) == 1 and len(preTks[-2][0]) == 1 and len(preTks[-3][0]) == 1:
-            t1 = preTks[-1][0] + "".join(chars[s:s + 1])
+        if n > 2 and len(path[0][0]) == 1 and len(path[1][0][0]) == 1 and len(path[1][1][0][0]) == 1:
+            t1 = path[0][0] + chars[s:s + 1]
             if self.trie_.has_keys_with_prefix(self.key_(t1)):
                 S = s + 2
 
         ################
         for e in range(S, len(chars) + 1):
-            t = "".join(chars[s:e])
+            t = chars[s:e]
             k = self.key_(t)
 
             if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
                 break
 
             if k in self.trie_:
-                pretks = copy.deepcopy(preTks)
-                if k in self.trie_:
-                    pretks.append((t, self.trie_[k]))
-                else:
-                    pretks.append((t, (-12, '')))
-                res = max(res, self.dfs_(chars, e, pretks, tkslist))
+                res = max(res, self._dfs(chars, e, ((t, self.trie_[k]), path), n + 1, tkslist))
 
         if res > s:
             return res
 
-        t = "".join(chars[s:s + 1])
+        t = chars[s:s + 1]
         k = self.key_(t)
         if k in self.trie_:
-            preTks.append((t, self.trie_[k]))
+            tk = (t, self.trie_[k])
         else:
-            preTks.append((t, (-12, '')))
+            tk = (t, (-12, ''))
 
-        return self.dfs_(chars, s + 1, preTks, tkslist)
+        return self._dfs(chars, s + 1, (tk, path), n + 1, tkslist)
 
     def freq(self, tk):
         k = self.key_(tk)
@@ -260,8 +282,67 @@ class RagTokenizer:
 
         return self.score_(res[::-1])
 
+    def stem_(self, t):
+        return self.stemmer.stem(self.lemmatizer.lemmatize(t))
+
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self.stem(t) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+
+    def segment_tokens_(self, L):
+        """Tokens of one segment of `tokenize`, picked among forward, backward and DFS maximum matching."""
+        res = []
+        # use maxforward for the first time
+        tks, s = self.maxForward_(L)
+        tks1, s1 = self.maxBackward_(L)
+        if self.DEBUG:
+            logging.debug("[FW] {} {}".format(tks, s))
+            logging.debug("[BW] {} {}".format(tks1, s1))
+
+        i, j, _i, _j = 0, 0, 0, 0
+        same = 0
+        while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+            same += 1
+        if same > 0:
+            res.append(" ".join(tks[j: j + same]))
+        _i = i + same
+        _j = j + same
+        j = _j + 1
+        i = _i + 1
+
+        while i < len(tks1) and j < len(tks):
+            tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
+            if tk1 != tk:
+                if len(tk1) > len(tk):
+                    j += 1
+                else:
+                    i += 1
+                continue
+
+            if tks1[i] != tks[j]:
+                i += 1
+                j += 1
+                continue
+            # backward tokens from_i to i are different from forward tokens from _j to j.
+            tkslist = []
+            self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
+            res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+
+            same = 1
+            while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+                same += 1
+            res.append(" ".join(tks[j: j + same]))
+            _i = i + same
+            _j = j + same
+            j = _j + 1
+            i = _i + 1
+
+        if _i < len(tks1):
+            assert _j < len(tks)
+            assert "".join(tks1[_i:]) == "".join(tks[_j:])
+            tkslist = []
+            self.dfs_("".join(tks[_j:]), 0, [], tkslist)
+            res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+        return tuple(res)
 
     def tokenize(self, line):
         line = re.sub(r"\W+", " ", line)
@@ -269,7 +350,7 @@ class RagTokenizer:
         line = self._tradi2simp(line)
         zh_num = len([1 for c in line if is_chinese(c)])
         if zh_num == 0:
-            return " ".join([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(line)])
+            return " ".join([self.stem(t) for t in word_tokenize(line)])
 
         arr = re.split(self.SPLIT_CHAR, line)
         res = []
@@ -278,64 +359,35 @@ class RagTokenizer:
                     r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
                 res.append(L)
                 continue
-            # print(L)
-
-            # use maxforward for the first time
-            tks, s = self.maxForward_(L)
-            tks1, s1 = self.maxBackward_(L)
-            if self.DEBUG:
-                logging.debug("[FW] {} {}".format(tks, s))
-                logging.debug("[BW] {} {}".format(tks1, s1))
-
-            i, j, _i, _j = 0, 0, 0, 0
-            same = 0
-            while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                same += 1
-            if same > 0:
-                res.append(" ".join(tks[j: j + same]))
-            _i = i + same
-            _j = j + same
-            j = _j + 1
-            i = _i + 1
-
-            while i < len(tks1) and j < len(tks):
-                tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
-                if tk1 != tk:
-                    if len(tk1) > len(tk):
-                        j += 1
-                    else:
-                        i += 1
-                    continue
-
-                if tks1[i] != tks[j]:
-                    i += 1
-                    j += 1
-                    continue
-                # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
-
-                same = 1
-                while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                    same += 1
-                res.append(" ".join(tks[j: j + same]))
-                _i = i + same
-                _j = j + same
-                j = _j + 1
-                i = _i + 1
-
-            if _i < len(tks1):
-                assert _j < len(tks)
-                assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+            res.extend(self.segment_tokens(L))
 
         res = " ".join(self.english_normalize_(res))
         logging.debug("[TKS] {}".format(self.merge_(res)))
         return self.merge_(res)
 
+    def fine_grained_token_(self, tk):
+        tkslist = []
+        if len(tk) > 10:
+            tkslist.append(tk)
+        else:
+            self.dfs_(tk, 0, [], tkslist)
+        if len(tkslist) < 2:
+            return tk
+        stk = self.sortTks_(tkslist)[1][0]
+        if len(stk) == len(tk):
+            stk = tk
+        else:
+            if re.match(r"[a-z\.-]+$", tk):
+                for t in stk:
+                    if len(t) < 3:
+                        stk = tk
+                        break
+                else:
+                    stk = " ".join(stk)
+            else:
+                stk = " ".join(stk)
+        return stk
+
     def fine_grained_tokenize(self, tks):
         tks = tks.split()
         zh_num = len([1 for c in tks if c and is_chinese(c[0])])
@@ -350,32 +402,47 @@ class RagTokenizer:
             if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
                 res.append(tk)
                 continue
-            tkslist = []
-            if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
-            if len(tkslist) < 2:
-                res.append(tk)
-                continue
-            stk = self.sortTks_(tkslist)[1][0]
-            if len(stk) == len(tk):
-                stk = tk
-            else:
-                if re.match(r"[a-z\.-]+$", tk):
-                    for t in stk:
-                        if len(t) < 3:
-                            stk = tk
-                            break
-                    else:
-                        stk = " ".join(stk)
-                else:
-                    stk = " ".join(stk)
-
-            res.append(stk)
+            res.append(self.fine_grained_token(tk))
 
         return " ".join(self.english_normalize_(res))
 
+    def tokenize_batch(self, lines, fine_grained=False, processes=0):
+        """
+        Tokenizes many lines. With `fine_grained`, every result is a (tokens, fine grained tokens) pair.
+        Large batches are spread over the `processes` workers of the tokenizer pool, each one keeping its own memo.
+        """
+        if processes > 1 and len(lines) >= 64:
+            return list(tokenize_pool(processes).map(functools.partial(_tokenize_line, fine_grained=fine_grained),
+                                                     lines, chunksize=max(1, len(lines) // (processes * 4))))
+        return [self.tokenize_line(line, fine_grained) for line in lines]
+
+    def tokenize_line(self, line, fine_grained=False):
+        tks = self.tokenize(line)
+        if not fine_grained:
+            return tks
+        return tks, self.fine_grained_tokenize(tks)
+
+
+_tokenize_pool = None
+_tokenize_pool_lock = threading.Lock()
+
+
+def tokenize_pool(processes):
+    """
+    The process pool batches are tokenized on, shared by the threads of the process and kept for its lifetime.
+    Workers are spawned, not forked, so they never inherit locks held by other threads.
+    """
+    global _tokenize_pool
+    with _tokenize_pool_lock:
+        if _tokenize_pool is None or getattr(_tokenize_pool, "_broken", False):
+            _tokenize_pool = ProcessPoolExecutor(max_workers=processes,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return _tokenize_pool
+
+
+def _tokenize_line(line, fine_grained=False):
+    return tokenizer.tokenize_line(line, fine_grained)
+
 
 def is_chinese(s):
     if s >= u'\u4e00' and s <= u'\u9fa5':
@@ -412,6 +479,7 @@ def naiveQie(txt):
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
+tokenize_batch = tokenizer.tokenize_batch
 tag = tokenizer.tag
 freq = tokenizer.freq
 loadUserDict = tokenizer.loadUserDict
@@ -22,6 +22,7 @@ from rag.utils import rmSpace
 from rag.nlp import rag_tokenizer, query
 import numpy as np
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE, model_key
 
 
 def index_name(uid): return f"ragflow_{uid}"
@@ -357,6 +358,19 @@ class Dealer:
         if isinstance(tenant_ids, str):
             tenant_ids = tenant_ids.split(",")
 
+        cache_key = None
+        models = [model_key(embd_mdl), model_key(rerank_mdl)]
+        if None not in models:
+            cache_key = RETRIEVAL_CACHE.key([index_name(tid) for tid in tenant_ids], kb_ids,
+                                            question=question, doc_ids=sorted(doc_ids) if doc_ids else doc_ids,
+                                            page=page, page_size=page_size, similarity_threshold=similarity_threshold,
+                                            vector_similarity_weight=vector_similarity_weight, top=top, aggs=aggs,
+                                            highlight=highlight, rank_feature=rank_feature, models=models)
+        if cache_key:
+            cached = RETRIEVAL_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
+
         sres = self.search(req, [index_name(tid) for tid in tenant_ids],
                            kb_ids, embd_mdl, highlight, rank_feature=rank_feature)
         ranks["total"] = sres.total
@@ -422,6 +436,8 @@ class Dealer:
                                                                    key=lambda x: x[1]["count"] * -1)]
         ranks["chunks"] = ranks["chunks"][:page_size]
 
+        if cache_key:
+            RETRIEVAL_CACHE.set(cache_key, ranks)
         return ranks
 
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
@@ -46,7 +46,7 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
 
     def _embedding_encode(self, txt):
         response = get_embed_cache(self._embd_model.llm_name, txt)
-        if response:
+        if response is not None:
             return response
         embds, _ = self._embd_model.encode([txt])
         if len(embds) < 1 or len(embds[0]) < 1:
@@ -87,9 +87,9 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
                 cnt = re.sub("(······\n由于长度的原因，回答被截断了，要继续吗？|For the content length reason, it stopped, continue?)", "",
                              cnt)
                 logging.debug(f"SUM: {cnt}")
-                embds, _ = self._embd_model.encode([cnt])
+                embds = self._embedding_encode(cnt)
                 with lock:
-                    chunks.append((cnt, self._embedding_encode(cnt)))
+                    chunks.append((cnt, embds))
             except Exception as e:
                 logging.exception("summarize got exception")
                 return e
@@ -23,6 +23,7 @@ RAG_CONF_PATH = os.path.join(get_project_base_directory(), "conf")
 
 ES = get_base_config("es", {})
 INFINITY = get_base_config("infinity", {"uri": "infinity:23817"})
+EMBEDDED = get_base_config("embedded", {"path": "data/doc_store"})
 AZURE = get_base_config("azure", {})
 S3 = get_base_config("s3", {})
 MINIO = decrypt_database_config(name="minio")
@@ -38,12 +39,109 @@ SVR_QUEUE_RETENTION = 60*60
 SVR_QUEUE_MAX_LEN = 1024
 SVR_CONSUMER_NAME = "rag_flow_svr_consumer"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_consumer_group"
+# Tasks are queued per priority (interactive, bulk, graph) and tenant. Executors take them in weighted round robin over
+# the priorities and in round robin over the tenants. Documents split into more than TASK_QUEUE_BULK_TASKS tasks are bulk.
+TASK_QUEUE_WEIGHTS = os.environ.get("TASK_QUEUE_WEIGHTS", "interactive:6,bulk:3,graph:1")
+TASK_QUEUE_BULK_TASKS = int(os.environ.get("TASK_QUEUE_BULK_TASKS", "4"))
+# PDFs and spreadsheets are split into tasks of about the same estimated cost instead of fixed page and row counts.
+TASK_COST_SPLIT = int(os.environ.get("TASK_COST_SPLIT", "1"))
+# Idle task executors claim the unacknowledged tasks of executors without a heartbeat for TASK_RECLAIM_IDLE seconds,
+# looking for them at most once per TASK_RECLAIM_INTERVAL seconds.
+TASK_RECLAIM_INTERVAL = int(os.environ.get("TASK_RECLAIM_INTERVAL", "60"))
+TASK_RECLAIM_IDLE = int(os.environ.get("TASK_RECLAIM_IDLE", "180"))
+# Task executors publish an event to PROGRESS_QUEUE_NAME whenever a task progresses; the API servers refresh only the
+# documents named by events, each at most once per PROGRESS_FLUSH_INTERVAL seconds, and every unfinished document
+# once per PROGRESS_FULL_SCAN_INTERVAL seconds in case an event was lost.
+PROGRESS_QUEUE_NAME = "rag_flow_progress"
+PROGRESS_QUEUE_MAX_LEN = 100000
+PROGRESS_CONSUMER_GROUP_NAME = "rag_flow_progress_aggregator"
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", "2"))
+PROGRESS_FULL_SCAN_INTERVAL = int(os.environ.get("PROGRESS_FULL_SCAN_INTERVAL", "120"))
+# A task executor writes the progress of a task at most once per PROGRESS_REPORT_INTERVAL seconds unless the task failed
+# or is done, and reads whether it was canceled at most once per PROGRESS_CANCEL_TTL seconds.
+PROGRESS_REPORT_INTERVAL = float(os.environ.get("PROGRESS_REPORT_INTERVAL", "1"))
+PROGRESS_CANCEL_TTL = float(os.environ.get("PROGRESS_CANCEL_TTL", "3"))
 PAGERANK_FLD = "pagerank_fea"
 TAG_FLD = "tag_feas"
 
+# Tasks a task executor handles at the same time, each on its own thread (ignored with TASK_PIPELINE).
+TASK_SLOTS = int(os.environ.get("TASK_SLOTS", "1"))
+# Staged task pipeline of the task executor: parse -> enrich -> embed -> index.
+TASK_PIPELINE = int(os.environ.get("TASK_PIPELINE", "0"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "2"))
+PIPELINE_PARSE_WORKERS = int(os.environ.get("PIPELINE_PARSE_WORKERS", "1"))
+PIPELINE_ENRICH_WORKERS = int(os.environ.get("PIPELINE_ENRICH_WORKERS", "1"))
+PIPELINE_EMBED_WORKERS = int(os.environ.get("PIPELINE_EMBED_WORKERS", "1"))
+PIPELINE_INDEX_WORKERS = int(os.environ.get("PIPELINE_INDEX_WORKERS", "1"))
+
+# Bulk indexing of chunks into the doc store.
+DOC_BULK_SIZE = int(os.environ.get("DOC_BULK_SIZE", "64"))
+DOC_BULK_BYTES = int(os.environ.get("DOC_BULK_BYTES", str(8 * 1024 * 1024)))
+DOC_BULK_CONCURRENCY = int(os.environ.get("DOC_BULK_CONCURRENCY", "2"))
+
+# Chunk embedding: at most EMBEDDING_BATCH_SIZE texts and EMBEDDING_BATCH_TOKENS tokens per request
+# (0 means 4 times the model's max tokens), EMBEDDING_CONCURRENCY requests in flight (0 means per provider).
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", "0"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "0"))
+
+# LLM enrichment of chunks (auto keywords/questions, tagging): concurrent LLM calls per task, and
+# per tenant across the tasks of one executor; ENRICH_TENANT_RPM caps a tenant's calls per minute.
+ENRICH_CONCURRENCY = int(os.environ.get("ENRICH_CONCURRENCY", "4"))
+ENRICH_TENANT_CONCURRENCY = int(os.environ.get("ENRICH_TENANT_CONCURRENCY", "0"))
+ENRICH_TENANT_RPM = int(os.environ.get("ENRICH_TENANT_RPM", "0"))
+
+# Embedding cache shared by every LLMBundle.encode call: a per-process LRU in front of Redis.
+EMBEDDING_CACHE = int(os.environ.get("EMBEDDING_CACHE", "1"))
+EMBEDDING_CACHE_LOCAL_SIZE = int(os.environ.get("EMBEDDING_CACHE_LOCAL_SIZE", "20000"))
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+# Query embeddings: a per-process LRU, backed by Redis if QUERY_EMBEDDING_CACHE_REDIS is set.
+QUERY_EMBEDDING_CACHE = int(os.environ.get("QUERY_EMBEDDING_CACHE", "1"))
+QUERY_EMBEDDING_CACHE_LOCAL_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_LOCAL_SIZE", "4096"))
+QUERY_EMBEDDING_CACHE_REDIS = int(os.environ.get("QUERY_EMBEDDING_CACHE_REDIS", "0"))
+
+# Results of Dealer.retrieval cached in Redis, invalidated by any write to the knowledge bases searched.
+RETRIEVAL_CACHE = int(os.environ.get("RETRIEVAL_CACHE", "1"))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "3600"))
+
+# PDF pages are rendered, OCRed and laid out on a pool of PDF_PARSER_PROCESSES processes (0 or 1: one page at a time).
+# Slots share one interpreter, so with TASK_SLOTS > 1 there are as many processes unless set.
+PDF_PARSER_PROCESSES = int(os.environ.get("PDF_PARSER_PROCESSES", str(TASK_SLOTS) if TASK_SLOTS > 1 else "0"))
+# Page images a PDF parser keeps in memory, others are rendered again when needed (0: all pages).
+PDF_PAGE_CACHE = int(os.environ.get("PDF_PAGE_CACHE", "0"))
+# OCR, layout and table recognition results of PDF parses kept in object storage, reused by later parses of the same file.
+PARSE_CACHE = int(os.environ.get("PARSE_CACHE", "1"))
+
+# Chunks of a document are tokenized on a pool of TOKENIZER_PROCESSES spawned processes (0 or 1: in the caller).
+TOKENIZER_PROCESSES = int(os.environ.get("TOKENIZER_PROCESSES", str(TASK_SLOTS) if TASK_SLOTS > 1 else "0"))
+
+# ONNX Runtime settings of the deepdoc models. Unset values keep each model's defaults.
+ONNX_INTRA_OP_THREADS = os.environ.get("ONNX_INTRA_OP_THREADS", "")
+ONNX_INTER_OP_THREADS = os.environ.get("ONNX_INTER_OP_THREADS", "")
+ONNX_CPU_MEM_ARENA = os.environ.get("ONNX_CPU_MEM_ARENA", "")
+# disable, basic, extended or all
+ONNX_GRAPH_OPT_LEVEL = os.environ.get("ONNX_GRAPH_OPT_LEVEL", "all")
+# Use `<model>.int8.onnx` instead of `<model>.onnx` when it exists.
+ONNX_QUANTIZED = int(os.environ.get("ONNX_QUANTIZED", "0"))
+# Text recognition batches hold at most OCR_REC_BATCH_SIZE crops whose width-height ratios are
+# within OCR_REC_BUCKET_RATIO times each other, so that one wide line does not pad a batch of short ones.
+OCR_REC_BATCH_SIZE = int(os.environ.get("OCR_REC_BATCH_SIZE", "16"))
+OCR_REC_BUCKET_RATIO = float(os.environ.get("OCR_REC_BUCKET_RATIO", "1.5"))
+
 
 def print_rag_settings():
     logging.info(f"MAX_CONTENT_LENGTH: {DOC_MAXIMUM_SIZE}")
     logging.info(f"SERVER_QUEUE_MAX_LEN: {SVR_QUEUE_MAX_LEN}")
     logging.info(f"SERVER_QUEUE_RETENTION: {SVR_QUEUE_RETENTION}")
-    logging.info(f"MAX_FILE_COUNT_PER_USER: {int(os.environ.get('MAX_FILE_NUM_PER_USER', 0))}")
\ No newline at end of file
+    logging.info(f"MAX_FILE_COUNT_PER_USER: {int(os.environ.get('MAX_FILE_NUM_PER_USER', 0))}")
+    logging.info(f"DOC_BULK_SIZE: {DOC_BULK_SIZE}, DOC_BULK_BYTES: {DOC_BULK_BYTES}, DOC_BULK_CONCURRENCY: {DOC_BULK_CONCURRENCY}")
+    if TASK_SLOTS > 1 and not TASK_PIPELINE:
+        logging.info(f"TASK_SLOTS: {TASK_SLOTS}, PDF_PARSER_PROCESSES: {PDF_PARSER_PROCESSES}, "
+                     f"TOKENIZER_PROCESSES: {TOKENIZER_PROCESSES}")
+        if PDF_PARSER_PROCESSES <= 1 or TOKENIZER_PROCESSES <= 1:
+            logging.warning("TASK_SLOTS > 1 parses the documents of all slots on one interpreter unless "
+                            "PDF_PARSER_PROCESSES and TOKENIZER_PROCESSES are above 1")
+    if TASK_PIPELINE:
+        logging.info(f"TASK_PIPELINE: queue_size={PIPELINE_QUEUE_SIZE}, parse={PIPELINE_PARSE_WORKERS}, "
+                     f"enrich={PIPELINE_ENRICH_WORKERS}, embed={PIPELINE_EMBED_WORKERS}, index={PIPELINE_INDEX_WORKERS}")
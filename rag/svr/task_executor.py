@@ -22,7 +22,7 @@ from api.utils.log_utils import initRootLogger
 from graphrag.general.index import WithCommunity, WithResolution, Dealer
 from graphrag.light.graph_extractor import GraphExtractor as LightKGExt
 from graphrag.general.graph_extractor import GraphExtractor as GeneralKGExt
-from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
+from graphrag.utils import get_llm_cache_batch, set_llm_cache, get_tags_from_cache, set_tags_to_cache
 
 CONSUMER_NO = "0" if len(sys.argv) < 2 else sys.argv[1]
 CONSUMER_NAME = "task_executor_" + CONSUMER_NO
@@ -37,6 +37,7 @@ import copy
 import re
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 from io import BytesIO
 from multiprocessing.context import TimeoutError
@@ -59,9 +60,20 @@ from rag.app import laws, paper, presentation, manual, qa, table, book, resume,
     email, tag
 from rag.nlp import search, rag_tokenizer
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
-from rag.settings import DOC_MAXIMUM_SIZE, SVR_QUEUE_NAME, print_rag_settings, TAG_FLD, PAGERANK_FLD
+from rag.settings import DOC_MAXIMUM_SIZE, print_rag_settings, TAG_FLD, PAGERANK_FLD, \
+    TASK_PIPELINE, TASK_SLOTS, PIPELINE_QUEUE_SIZE, PIPELINE_PARSE_WORKERS, PIPELINE_ENRICH_WORKERS, PIPELINE_EMBED_WORKERS, \
+    PIPELINE_INDEX_WORKERS, DOC_BULK_SIZE, DOC_BULK_BYTES, DOC_BULK_CONCURRENCY, \
+    EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS, EMBEDDING_CONCURRENCY, ENRICH_CONCURRENCY, \
+    ENRICH_TENANT_CONCURRENCY, ENRICH_TENANT_RPM, PROGRESS_REPORT_INTERVAL, PROGRESS_CANCEL_TTL
 from rag.utils import num_tokens_from_string
-from rag.utils.redis_conn import REDIS_CONN, Payload
+from rag.utils.bulk_indexer import BulkIndexer
+from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.embedding_cache import EMBEDDING_CACHE
+from rag.utils.embedding_scheduler import EmbeddingScheduler
+from rag.utils.pipeline import Pipeline, Stage
+from rag.utils.rate_limiter import get_limiter
+from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.task_queue import TASK_QUEUE
 from rag.utils.storage_factory import STORAGE_IMPL
 
 BATCH_SIZE = 64
@@ -86,15 +98,17 @@ FACTORY = {
 }
 
 CONSUMER_NAME = "task_consumer_" + CONSUMER_NO
-PAYLOAD: Payload | None = None
 BOOT_AT = datetime.now().astimezone().isoformat(timespec="milliseconds")
 PENDING_TASKS = 0
 LAG_TASKS = 0
 
 mt_lock = threading.Lock()
+collect_lock = threading.Lock()
 DONE_TASKS = 0
 FAILED_TASKS = 0
 CURRENT_TASK = None
+CURRENT_TASKS = {}
+PIPELINE: Pipeline | None = None
 
 
 class TaskCanceledException(Exception):
@@ -102,17 +116,107 @@ class TaskCanceledException(Exception):
         self.msg = msg
 
 
+class ProgressReporter:
+    """
+    Progress of the tasks of this executor. The messages and the latest progress of a task are buffered and
+    written at most once per `interval` seconds, all at once, or right away when the task fails or is done.
+    What a report leaves buffered is written by `run` once `interval` is over, even if no report follows.
+    Whether the document of a task was canceled is read from the database at most once per `cancel_ttl` seconds.
+    """
+
+    def __init__(self, interval=1., cancel_ttl=3.):
+        self.interval = interval
+        self.cancel_ttl = cancel_ttl
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.cancels = {}
+
+    def canceled(self, task_id) -> bool:
+        now = time.time()
+        with self.lock:
+            cached = self.cancels.get(task_id)
+        if cached and now - cached[1] < self.cancel_ttl:
+            return cached[0]
+        try:
+            cancel = TaskService.do_cancel(task_id)
+        finally:
+            close_connection()
+        with self.lock:
+            self.cancels[task_id] = (cancel, now)
+        return cancel
+
+    def report(self, task_id, prog=None, msg=""):
+        terminal = prog is not None and (prog < 0 or prog >= 1)
+        with self.lock:
+            st = self.tasks.setdefault(task_id, {"msgs": [], "progress": None, "flushed": 0.,
+                                                 "lock": threading.Lock()})
+            if msg:
+                st["msgs"].append(msg)
+            if prog is not None:
+                st["progress"] = prog
+            if not terminal and time.time() - st["flushed"] < self.interval:
+                return
+        self.flush(task_id)
+
+    def flush(self, task_id):
+        """Writes what is buffered for the task."""
+        with self.lock:
+            st = self.tasks.get(task_id)
+        if not st:
+            return
+        with st["lock"]:
+            with self.lock:
+                d = {"progress_msg": "\n".join(st["msgs"])}
+                if st["progress"] is not None:
+                    d["progress"] = st["progress"]
+                st["msgs"], st["progress"], st["flushed"] = [], None, time.time()
+                if "progress" in d and (d["progress"] < 0 or d["progress"] >= 1):
+                    self.tasks.pop(task_id, None)
+                    self.cancels.pop(task_id, None)
+            if not d["progress_msg"] and "progress" not in d:
+                return
+            try:
+                TaskService.update_progress(task_id, d)
+            finally:
+                close_connection()
+
+    def flush_due(self):
+        """Writes what is buffered for the tasks last written `interval` seconds ago or more."""
+        now = time.time()
+        with self.lock:
+            due = [task_id for task_id, st in self.tasks.items()
+                   if (st["msgs"] or st["progress"] is not None) and now - st["flushed"] >= self.interval]
+        for task_id in due:
+            try:
+                self.flush(task_id)
+            except Exception:
+                logging.exception(f"ProgressReporter.flush_due({task_id}) got exception")
+
+    def run(self):
+        while True:
+            time.sleep(self.interval / 2)
+            self.flush_due()
+
+    def done(self, task_id):
+        """Writes what is buffered for the task and forgets it."""
+        try:
+            self.flush(task_id)
+        finally:
+            with self.lock:
+                self.tasks.pop(task_id, None)
+                self.cancels.pop(task_id, None)
+
+
+PROGRESS = ProgressReporter(PROGRESS_REPORT_INTERVAL, PROGRESS_CANCEL_TTL)
+
+
 def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing..."):
-    global PAYLOAD
     if prog is not None and prog < 0:
         msg = "[ERROR]" + msg
     try:
-        cancel = TaskService.do_cancel(task_id)
+        cancel = PROGRESS.canceled(task_id)
     except DoesNotExist:
         logging.warning(f"set_progress task {task_id} is unknown")
-        if PAYLOAD:
-            PAYLOAD.ack()
-            PAYLOAD = None
         return
 
     if cancel:
@@ -125,43 +229,37 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
                 msg = f"Page({from_page + 1}~{to_page + 1}): " + msg
     if msg:
         msg = datetime.now().strftime("%H:%M:%S") + " " + msg
-    d = {"progress_msg": msg}
-    if prog is not None:
-        d["progress"] = prog
 
     logging.info(f"set_progress({task_id}), progress: {prog}, progress_msg: {msg}")
     try:
-        TaskService.update_progress(task_id, d)
+        PROGRESS.report(task_id, prog, msg)
     except DoesNotExist:
         logging.warning(f"set_progress task {task_id} is unknown")
-        if PAYLOAD:
-            PAYLOAD.ack()
-            PAYLOAD = None
         return
 
-    close_connection()
-    if cancel and PAYLOAD:
-        PAYLOAD.ack()
-        PAYLOAD = None
+    if cancel:
         raise TaskCanceledException(msg)
 
 
-def collect():
-    global CONSUMER_NAME, PAYLOAD, DONE_TASKS, FAILED_TASKS
+def collect(check_unacked=True):
+    """Returns the next message of the queue and its task, None if the task is not to be handled."""
+    global CONSUMER_NAME, DONE_TASKS, FAILED_TASKS
     try:
-        PAYLOAD = REDIS_CONN.get_unacked_for(CONSUMER_NAME, SVR_QUEUE_NAME, "rag_flow_svr_task_broker")
-        if not PAYLOAD:
-            PAYLOAD = REDIS_CONN.queue_consumer(SVR_QUEUE_NAME, "rag_flow_svr_task_broker", CONSUMER_NAME)
-        if not PAYLOAD:
+        payload = None
+        if check_unacked:
+            payload = TASK_QUEUE.get_unacked_for(CONSUMER_NAME) or TASK_QUEUE.reclaim(CONSUMER_NAME)
+        if not payload:
+            payload = TASK_QUEUE.get(CONSUMER_NAME)
+        if not payload:
             time.sleep(1)
-            return None
+            return None, None
     except Exception:
         logging.exception("Get task event from queue exception")
-        return None
+        return None, None
 
-    msg = PAYLOAD.get_message()
+    msg = payload.get_message()
     if not msg:
-        return None
+        return payload, None
 
     task = None
     canceled = False
@@ -179,10 +277,10 @@ def collect():
         with mt_lock:
             DONE_TASKS += 1
         logging.info(f"collect task {msg['id']} {state}")
-        return None
+        return payload, None
 
     task["task_type"] = msg.get("task_type", "")
-    return task
+    return payload, task
 
 
 def get_storage_binary(bucket, name):
@@ -265,22 +363,57 @@ def build_chunks(task, progress_callback):
         del d["image"]
         docs.append(d)
     logging.info("MINIO PUT({}):{}".format(task["name"], el))
+    return docs
 
+
+def run_llm_enrichment(task, docs, chat_mdl, history, gen_conf, generate, name, progress_callback):
+    """
+    Returns one LLM result per doc. Cached results are fetched in one round trip, the rest are
+    generated concurrently, bounded by ENRICH_CONCURRENCY per task and by the tenant's limiter.
+    """
+    texts = [d["content_with_weight"] for d in docs]
+    results = get_llm_cache_batch(chat_mdl.llm_name, texts, history, gen_conf)
+    todo = [i for i, r in enumerate(results) if not r]
+    if not todo:
+        return results
+    progress_callback(msg="{}: {} cached, {} to generate".format(name, len(docs) - len(todo), len(todo)))
+    limiter = get_limiter(f"enrich:{task['tenant_id']}", ENRICH_TENANT_CONCURRENCY, ENRICH_TENANT_RPM)
+
+    def work(i):
+        with limiter:
+            res = generate(docs[i])
+        if res:
+            set_llm_cache(chat_mdl.llm_name, texts[i], res, history, gen_conf)
+        return i, res
+
+    reported_at = timer()
+    with ThreadPoolExecutor(max_workers=max(1, ENRICH_CONCURRENCY), thread_name_prefix="enrich") as pool:
+        futures = [pool.submit(work, i) for i in todo]
+        try:
+            for n, f in enumerate(as_completed(futures), start=1):
+                i, res = f.result()
+                results[i] = res
+                if timer() - reported_at > 30:
+                    reported_at = timer()
+                    progress_callback(msg="{}: {}/{} generated".format(name, n, len(todo)))
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+    return results
+
+
+def enrich_chunks(task, docs, progress_callback):
     if task["parser_config"].get("auto_keywords", 0):
         st = timer()
         progress_callback(msg="Start to generate keywords for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-        for d in docs:
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords",
-                                   {"topn": task["parser_config"]["auto_keywords"]})
-            if not cached:
-                cached = keyword_extraction(chat_mdl, d["content_with_weight"],
-                                            task["parser_config"]["auto_keywords"])
-                if cached:
-                    set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords",
-                                  {"topn": task["parser_config"]["auto_keywords"]})
-
-            d["important_kwd"] = cached.split(",")
+        topn = task["parser_config"]["auto_keywords"]
+        results = run_llm_enrichment(task, docs, chat_mdl, "keywords", {"topn": topn},
+                                     lambda d: keyword_extraction(chat_mdl, d["content_with_weight"], topn),
+                                     "Keywords", progress_callback)
+        for d, cached in zip(docs, results):
+            d["important_kwd"] = (cached or "").split(",")
             d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
         progress_callback(msg="Keywords generation completed in {:.2f}s".format(timer() - st))
 
@@ -288,16 +421,12 @@ def build_chunks(task, progress_callback):
         st = timer()
         progress_callback(msg="Start to generate questions for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-        for d in docs:
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question",
-                                   {"topn": task["parser_config"]["auto_questions"]})
-            if not cached:
-                cached = question_proposal(chat_mdl, d["content_with_weight"], task["parser_config"]["auto_questions"])
-                if cached:
-                    set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question",
-                                  {"topn": task["parser_config"]["auto_questions"]})
-
-            d["question_kwd"] = cached.split("\n")
+        topn = task["parser_config"]["auto_questions"]
+        results = run_llm_enrichment(task, docs, chat_mdl, "question", {"topn": topn},
+                                     lambda d: question_proposal(chat_mdl, d["content_with_weight"], topn),
+                                     "Questions", progress_callback)
+        for d, cached in zip(docs, results):
+            d["question_kwd"] = (cached or "").split("\n")
             d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
         progress_callback(msg="Question generation completed in {:.2f}s".format(timer() - st))
 
@@ -316,20 +445,25 @@ def build_chunks(task, progress_callback):
         else:
             all_tags = json.loads(all_tags)
 
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+        # Chunks tagged by similar tagged content become the few-shot examples of the LLM tagging below.
+        docs_to_tag = []
         for d in docs:
             if settings.retrievaler.tag_content(tenant_id, kb_ids, d, all_tags, topn_tags=topn_tags, S=S):
                 examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
                 continue
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
-            if not cached:
-                cached = content_tagging(chat_mdl, d["content_with_weight"], all_tags,
-                                         random.choices(examples, k=2) if len(examples)>2 else examples,
-                                         topn=topn_tags)
-                if cached:
-                    cached = json.dumps(cached)
+            docs_to_tag.append(d)
+
+        def tagging(d):
+            tags = content_tagging(chat_mdl, d["content_with_weight"], all_tags,
+                                   random.choices(examples, k=2) if len(examples)>2 else examples,
+                                   topn=topn_tags)
+            return json.dumps(tags) if tags else None
+
+        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+        results = run_llm_enrichment(task, docs_to_tag, chat_mdl, all_tags, {"topn": topn_tags}, tagging,
+                                     "Tagging", progress_callback)
+        for d, cached in zip(docs_to_tag, results):
             if cached:
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
                 d[TAG_FLD] = json.loads(cached)
 
         progress_callback(msg="Tagging completed in {:.2f}s".format(timer() - st))
@@ -345,7 +479,6 @@ def init_kb(row, vector_size: int):
 def embedding(docs, mdl, parser_config=None, callback=None):
     if parser_config is None:
         parser_config = {}
-    batch_size = 16
     tts, cnts = [], []
     for d in docs:
         tts.append(d.get("docnm_kwd", "Title"))
@@ -358,25 +491,23 @@ def embedding(docs, mdl, parser_config=None, callback=None):
         cnts.append(c)
 
     tk_count = 0
+    title_vec = None
     if len(tts) == len(cnts):
+        # all chunks share the document title, its single row is broadcast below
         vts, c = mdl.encode(tts[0: 1])
-        tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
+        title_vec = np.asarray(vts)
         tk_count += c
 
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), batch_size):
-        vts, c = mdl.encode(cnts[i: i + batch_size])
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
-        tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+    def embedding_progress(done, total):
+        callback(prog=0.7 + 0.2 * done / total, msg="")
+
+    cnts, c = EmbeddingScheduler(mdl, max_batch_size=EMBEDDING_BATCH_SIZE, batch_tokens=EMBEDDING_BATCH_TOKENS,
+                                 concurrency=EMBEDDING_CONCURRENCY).encode(cnts, embedding_progress)
+    tk_count += c
 
     title_w = float(parser_config.get("filename_embd_weight", 0.1))
-    vects = (title_w * tts + (1 - title_w) *
-             cnts) if len(tts) == len(cnts) else cnts
+    vects = (title_w * title_vec + (1 - title_w) *
+             cnts) if title_vec is not None else cnts
 
     assert len(vects) == len(docs)
     vector_size = 0
@@ -445,21 +576,18 @@ def run_graphrag(row, chat_model, language, embedding_model, callback=None):
                     callback=callback)
 
 
-def do_handle_task(task):
+def parse_stage(job):
+    task = job["task"]
     task_id = task["id"]
-    task_from_page = task["from_page"]
-    task_to_page = task["to_page"]
     task_tenant_id = task["tenant_id"]
     task_embedding_id = task["embd_id"]
     task_language = task["language"]
     task_llm_id = task["llm_id"]
-    task_dataset_id = task["kb_id"]
-    task_doc_id = task["doc_id"]
     task_document_name = task["name"]
-    task_parser_config = task["parser_config"]
 
     # prepare the progress callback function
-    progress_callback = partial(set_progress, task_id, task_from_page, task_to_page)
+    progress_callback = partial(set_progress, task_id, task["from_page"], task["to_page"])
+    job["progress_callback"] = progress_callback
 
     # FIXME: workaround, Infinity doesn't support table parsing method, this check is to notify user
     lower_case_doc_engine = settings.DOC_ENGINE.lower()
@@ -489,6 +617,8 @@ def do_handle_task(task):
     vts, _ = embedding_model.encode(["ok"])
     vector_size = len(vts[0])
     init_kb(task, vector_size)
+    job["embedding_model"] = embedding_model
+    job["vector_size"] = vector_size
 
     # Either using RAPTOR or Standard chunking methods
     if task.get("task_type", "") == "raptor":
@@ -504,6 +634,11 @@ def do_handle_task(task):
             progress_callback(-1, msg=error_message)
             logging.exception(error_message)
             raise
+        job["chunks"] = chunks
+        job["token_count"] = token_count
+        # RAPTOR chunks are summarized and embedded already
+        job["embedded"] = True
+        return job
     # Either using graphrag or Standard chunking methods
     elif task.get("task_type", "") == "graphrag":
         start_ts = timer()
@@ -553,59 +688,129 @@ def do_handle_task(task):
             logging.exception(error_message)
             raise
         return
-    else:
-        # Standard chunking methods
-        start_ts = timer()
-        chunks = build_chunks(task, progress_callback)
-        logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
-        if chunks is None:
-            return
-        if not chunks:
-            progress_callback(1., msg=f"No chunk built from {task_document_name}")
-            return
-        # TODO: exception handler
-        ## set_progress(task["did"], -1, "ERROR: ")
-        progress_callback(msg="Generate {} chunks".format(len(chunks)))
-        start_ts = timer()
-        try:
-            token_count, vector_size = embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
+
+    # Standard chunking methods
+    start_ts = timer()
+    chunks = build_chunks(task, progress_callback)
+    logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
+    if chunks is None:
+        return
+    if not chunks:
+        progress_callback(1., msg=f"No chunk built from {task_document_name}")
+        return
+    job["chunks"] = chunks
+    return job
+
+
+def enrich_stage(job):
+    if job.get("embedded"):
+        return job
+    enrich_chunks(job["task"], job["chunks"], job["progress_callback"])
+    return job
+
+
+def chunk_digest(task, chunk):
+    """Digest of what gets indexed for a chunk, vectors aside: equal digests of a chunk id mean equal documents."""
+    fields = {k: v for k, v in chunk.items() if k not in ["id", "create_time", "create_timestamp_flt"]}
+    fields["embd_id"] = task["embd_id"]
+    fields["filename_embd_weight"] = task["parser_config"].get("filename_embd_weight", 0.1)
+    return xxhash.xxh64(json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def embedding_stage(job):
+    if job.get("embedded"):
+        return job
+    progress_callback = job["progress_callback"]
+    task = job["task"]
+    chunks = job["chunks"]
+    # Chunks the previous parse of the document indexed exactly the same are still there: keep them as they are.
+    job["digests"] = [chunk_digest(task, ck) for ck in chunks]
+    stale = TaskService.get_stale_chunk_digests(task["doc_id"])
+    job["unchanged"] = set(i for i, dg in dict(zip([ck["id"] for ck in chunks], job["digests"])).items()
+                           if dg and stale.get(i) == dg)
+    if job["unchanged"]:
+        # Unless they are not: deleted by hand, or the index was lost.
+        ids, indexed = list(job["unchanged"]), set()
+        for b in range(0, len(ids), 1024):
+            res = settings.docStoreConn.search(["doc_id"], [], {"id": ids[b:b + 1024]}, [], OrderByExpr(), 0, 1024,
+                                               search.index_name(task["tenant_id"]), [str(task["kb_id"])])
+            indexed.update(settings.docStoreConn.getChunkIds(res))
+        job["unchanged"] &= indexed
+    if job["unchanged"]:
+        chunks = [ck for ck in chunks if ck["id"] not in job["unchanged"]]
+        progress_callback(msg="{} chunks unchanged since the previous parse".format(len(job["unchanged"])))
+    # TODO: exception handler
+    ## set_progress(task["did"], -1, "ERROR: ")
+    progress_callback(msg="Generate {} chunks".format(len(chunks)))
+    start_ts = timer()
+    if not chunks:
+        job["token_count"] = 0
+        job["embedded"] = True
+        return job
+    try:
+        token_count, vector_size = embedding(chunks, job["embedding_model"], task["parser_config"],
+                                             progress_callback)
+    except Exception as e:
+        error_message = "Generate embedding error:{}".format(str(e))
+        progress_callback(-1, error_message)
+        logging.exception(error_message)
+        raise
+    progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
+    logging.info(progress_message)
+    progress_callback(msg=progress_message)
+    job["token_count"] = token_count
+    job["vector_size"] = vector_size
+    job["embedded"] = True
+    return job
+
+
+def index_stage(job):
+    task = job["task"]
+    chunks = job["chunks"]
+    token_count = job["token_count"]
+    progress_callback = job["progress_callback"]
+    task_tenant_id = task["tenant_id"]
+    task_dataset_id = task["kb_id"]
+    task_document_name = task["name"]
+    task_from_page = task["from_page"]
+    task_to_page = task["to_page"]
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
     start_ts = timer()
-    doc_store_result = ""
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
-        doc_store_result = settings.docStoreConn.insert(chunks[b:b + es_bulk_size], search.index_name(task_tenant_id),
-                                                        task_dataset_id)
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + es_bulk_size]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task["id"], chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
-            doc_store_result = settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id),
-                                                            task_dataset_id)
-            return
+    # Chunk ids are content hashes known before indexing, so they are persisted once up front:
+    # if indexing dies halfway, the next run of queue_tasks still deletes whatever got in.
+    # Their digests, which let the next parse skip them, only once every chunk is indexed.
+    chunk_ids = [chunk["id"] for chunk in chunks]
+    try:
+        TaskService.update_chunk_ids(task["id"], " ".join(chunk_ids))
+    except DoesNotExist:
+        logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
+        return
+    unchanged = job.get("unchanged", set())
+    to_index = [chunk for chunk in chunks if chunk["id"] not in unchanged]
+
+    def indexing_progress(indexed):
+        progress_callback(prog=0.8 + 0.1 * indexed / len(to_index), msg="")
+
+    indexer = BulkIndexer(settings.docStoreConn, search.index_name(task_tenant_id), task_dataset_id,
+                          max_docs=DOC_BULK_SIZE, max_bytes=DOC_BULK_BYTES, concurrency=DOC_BULK_CONCURRENCY,
+                          callback=indexing_progress)
+    try:
+        for chunk in to_index:
+            indexer.add(chunk)
+    finally:
+        doc_store_result = indexer.close()
+    if doc_store_result:
+        error_message = f"Insert chunk error: {doc_store_result[:3]}, please check log file and Elasticsearch/Infinity status!"
+        progress_callback(-1, msg=error_message)
+        raise Exception(error_message)
+    if job.get("digests"):
+        TaskService.update_chunk_ids(task["id"], " ".join(chunk_ids), " ".join(job["digests"]))
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
                                                                                      task_to_page, len(chunks),
                                                                                      timer() - start_ts))
 
-    DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, token_count, chunk_count, 0)
+    DocumentService.increment_chunk_num(task["doc_id"], task_dataset_id, token_count, chunk_count, 0)
 
     time_cost = timer() - start_ts
     progress_callback(prog=1.0, msg="Done ({:.2f}s)".format(time_cost))
@@ -613,11 +818,94 @@ def do_handle_task(task):
         "Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page,
                                                                                    task_to_page, len(chunks),
                                                                                    token_count, time_cost))
+    return job
+
+
+TASK_STAGES = [
+    ("parse", parse_stage, PIPELINE_PARSE_WORKERS),
+    ("enrich", enrich_stage, PIPELINE_ENRICH_WORKERS),
+    ("embed", embedding_stage, PIPELINE_EMBED_WORKERS),
+    ("index", index_stage, PIPELINE_INDEX_WORKERS),
+]
+
+
+def do_handle_task(task):
+    job = {"task": task}
+    for _, stage, _ in TASK_STAGES:
+        job = stage(job)
+        if job is None:
+            return
+
+
+def task_done(job):
+    global DONE_TASKS
+    task = job["task"]
+    with mt_lock:
+        DONE_TASKS += 1
+        CURRENT_TASKS.pop(task["id"], None)
+    try:
+        PROGRESS.done(task["id"])
+    except Exception:
+        logging.exception(f"task_done flushing progress of task {task['id']} got exception")
+    job["payload"].ack()
+    logging.info(f"handle_task done for task {json.dumps(task)}")
+
+
+def task_failed(job, e):
+    global DONE_TASKS, FAILED_TASKS
+    task = job["task"]
+    with mt_lock:
+        if isinstance(e, TaskCanceledException):
+            DONE_TASKS += 1
+        else:
+            FAILED_TASKS += 1
+        CURRENT_TASKS.pop(task["id"], None)
+    try:
+        if isinstance(e, TaskCanceledException):
+            set_progress(task["id"], prog=-1, msg="handle_task got TaskCanceledException")
+        else:
+            set_progress(task["id"], prog=-1, msg=f"[Exception]: {e}")
+    except Exception:
+        pass
+    try:
+        PROGRESS.done(task["id"])
+    except Exception:
+        pass
+    if isinstance(e, TaskCanceledException):
+        logging.debug("handle_task got TaskCanceledException", exc_info=e)
+    else:
+        logging.error(f"handle_task got exception for task {json.dumps(task)}", exc_info=e)
+    job["payload"].ack()
+
+
+def pipeline_handle_tasks():
+    """
+    Overlaps stages of several tasks: while one document is being parsed, another one can wait on
+    the LLM, the embedding endpoint or the doc store. Reading from the queue stops when the
+    parse stage is saturated, so unacked messages stay in Redis instead of piling up in memory.
+    """
+    global PIPELINE
+    PIPELINE = Pipeline([Stage(name, func, workers, PIPELINE_QUEUE_SIZE) for name, func, workers in TASK_STAGES],
+                        on_done=task_done, on_error=task_failed).start()
+    while True:
+        with mt_lock:
+            in_flight = len(CURRENT_TASKS)
+        # Unacked messages of this consumer are only recovered when nothing is in flight,
+        # otherwise the first pending message would be handed out over and over again.
+        payload, task = collect(check_unacked=in_flight == 0)
+        if not task:
+            if payload:
+                payload.ack()
+            continue
+        logging.info(f"handle_task begin for task {json.dumps(task)}")
+        with mt_lock:
+            CURRENT_TASKS[task["id"]] = copy.deepcopy(task)
+        PIPELINE.put({"task": task, "payload": payload})
 
 
 def handle_task():
-    global PAYLOAD, mt_lock, DONE_TASKS, FAILED_TASKS, CURRENT_TASK
-    task = collect()
+    global mt_lock, DONE_TASKS, FAILED_TASKS, CURRENT_TASK
+    payload, task = collect()
     if task:
         try:
             logging.info(f"handle_task begin for task {json.dumps(task)}")
@@ -646,9 +934,48 @@ def handle_task():
             except Exception:
                 pass
             logging.exception(f"handle_task got exception for task {json.dumps(task)}")
-    if PAYLOAD:
-        PAYLOAD.ack()
-        PAYLOAD = None
+        try:
+            PROGRESS.done(task["id"])
+        except Exception:
+            logging.exception(f"handle_task flushing progress of task {task['id']} got exception")
+    if payload:
+        payload.ack()
+
+
+def slot_handle_tasks(slot):
+    """
+    Runs one task at a time next to the other slots of the executor. While one task is parsed, others can wait
+    on the LLM, the embedding endpoint or the doc store; CPU-bound parsing is spread over processes by
+    PDF_PARSER_PROCESSES and TOKENIZER_PROCESSES, which default to TASK_SLOTS.
+    """
+    while True:
+        # Unacked messages of this consumer are only recovered when nothing is in flight, otherwise a slot
+        # would pick up the message another slot is handling. The lock makes checking and claiming one step.
+        with collect_lock:
+            with mt_lock:
+                in_flight = len(CURRENT_TASKS)
+            payload, task = collect(check_unacked=in_flight == 0)
+            if task:
+                with mt_lock:
+                    CURRENT_TASKS[task["id"]] = copy.deepcopy(task)
+        if not task:
+            if payload:
+                payload.ack()
+            continue
+        logging.info(f"handle_task begin for task {json.dumps(task)} in slot {slot}")
+        job = {"task": task, "payload": payload}
+        try:
+            do_handle_task(task)
+        except Exception as e:
+            task_failed(job, e)
+            continue
+        task_done(job)
+
+
+def slots_handle_tasks():
+    for slot in range(1, TASK_SLOTS):
+        threading.Thread(target=slot_handle_tasks, args=(slot,), name=f"task_slot_{slot}", daemon=True).start()
+    slot_handle_tasks(0)
 
 
 def report_status():
@@ -657,13 +984,13 @@ def report_status():
     while True:
         try:
             now = datetime.now()
-            group_info = REDIS_CONN.queue_info(SVR_QUEUE_NAME, "rag_flow_svr_task_broker")
-            if group_info is not None:
-                PENDING_TASKS = int(group_info.get("pending", 0))
-                LAG_TASKS = int(group_info.get("lag", 0))
+            queues = TASK_QUEUE.depth()
+            if queues is not None:
+                PENDING_TASKS = sum(q["pending"] for q in queues.values())
+                LAG_TASKS = sum(q["lag"] for q in queues.values())
 
             with mt_lock:
-                heartbeat = json.dumps({
+                status = {
                     "name": CONSUMER_NAME,
                     "now": now.astimezone().isoformat(timespec="milliseconds"),
                     "boot_at": BOOT_AT,
@@ -672,7 +999,14 @@ def report_status():
                     "done": DONE_TASKS,
                     "failed": FAILED_TASKS,
                     "current": CURRENT_TASK,
-                })
+                }
+                if PIPELINE or TASK_SLOTS > 1:
+                    status["current"] = list(CURRENT_TASKS.values())
+            if PIPELINE:
+                status["pipeline"] = PIPELINE.depth()
+            status["queues"] = queues
+            status["embedding_cache"] = EMBEDDING_CACHE.stats()
+            heartbeat = json.dumps(status)
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
 
@@ -715,6 +1049,7 @@ def main():
     background_thread = threading.Thread(target=report_status)
     background_thread.daemon = True
     background_thread.start()
+    threading.Thread(target=PROGRESS.run, daemon=True).start()
 
     TRACE_MALLOC_DELTA = int(os.environ.get('TRACE_MALLOC_DELTA', "0"))
     TRACE_MALLOC_FULL = int(os.environ.get('TRACE_MALLOC_FULL', "0"))
@@ -723,6 +1058,10 @@ def main():
             TRACE_MALLOC_FULL = TRACE_MALLOC_DELTA
         tracemalloc.start()
         snapshot1 = tracemalloc.take_snapshot()
+    if TASK_PIPELINE:
+        pipeline_handle_tasks()
+    if TASK_SLOTS > 1:
+        slots_handle_tasks()
     while True:
         handle_task()
         num_tasks = DONE_TASKS + FAILED_TASKS
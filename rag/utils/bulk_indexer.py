@@ -0,0 +1,127 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from rag.utils.doc_store_conn import DocStoreConnection
+
+logger = logging.getLogger('ragflow.bulk_indexer')
+
+
+def estimate_size(d: dict) -> int:
+    """Cheap estimate of the serialized size of a chunk, dominated by vectors and text."""
+    n = 0
+    for k, v in d.items():
+        n += len(k) + 4
+        if isinstance(v, str):
+            n += len(v.encode("utf-8")) if not v.isascii() else len(v)
+        elif isinstance(v, (list, tuple)):
+            n += sum(len(x) if isinstance(x, str) else 20 for x in v)
+        else:
+            n += 20
+    return n
+
+
+class BulkIndexer:
+    """
+    Buffers chunks and sends them to the doc store in batches bounded by count and bytes,
+    keeping up to `concurrency` bulk requests in flight. Documents reported as failed by
+    `DocStoreConnection.insert` are retried with backoff, the rest of the batch is not resent.
+
+        indexer = BulkIndexer(settings.docStoreConn, index_name, kb_id)
+        for ck in chunks:
+            indexer.add(ck)
+        errors = indexer.close()
+    """
+
+    def __init__(self, doc_store: DocStoreConnection, index_name: str, kb_id: str,
+                 max_docs: int = 64, max_bytes: int = 8 * 1024 * 1024, concurrency: int = 2,
+                 max_retries: int = 3, callback=None):
+        self.doc_store = doc_store
+        self.index_name = index_name
+        self.kb_id = kb_id
+        self.max_docs = max(1, max_docs)
+        self.max_bytes = max(1, max_bytes)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.callback = callback
+        self.indexed = 0
+        self.errors = []
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._futures = set()
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="bulk_indexer")
+
+    def add(self, doc: dict):
+        size = estimate_size(doc)
+        if self._buffer and (len(self._buffer) >= self.max_docs or self._buffer_bytes + size > self.max_bytes):
+            self.flush()
+        self._buffer.append(doc)
+        self._buffer_bytes += size
+
+    def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        while len(self._futures) >= self.concurrency:
+            self._collect(wait(self._futures, return_when=FIRST_COMPLETED).done)
+        self._futures.add(self._pool.submit(self._send, batch))
+
+    def close(self) -> list[str]:
+        """Flushes the buffer, waits for every request and returns the errors of documents that failed for good."""
+        try:
+            self.flush()
+            self._collect(wait(self._futures).done)
+        finally:
+            self._pool.shutdown(wait=True)
+        return self.errors
+
+    def _collect(self, done):
+        for f in done:
+            self._futures.discard(f)
+            n, errors = f.result()
+            self.indexed += n
+            self.errors.extend(errors)
+            if self.callback and n:
+                self.callback(self.indexed)
+
+    def _send(self, batch: list[dict]):
+        errors = []
+        indexed = 0
+        for attempt in range(self.max_retries + 1):
+            try:
+                errors = self.doc_store.insert(batch, self.index_name, self.kb_id)
+            except Exception as e:
+                errors = [str(e)]
+            if not errors:
+                return indexed + len(batch), []
+
+            # Errors of a bulk response look like "<chunk id>:<reason>", anything else fails the whole batch.
+            ids = {d["id"] for d in batch}
+            failed = {e.split(":", 1)[0] for e in errors}
+            if failed.issubset(ids):
+                retry = [d for d in batch if d["id"] in failed]
+            else:
+                retry = batch
+            logger.warning(f"BulkIndexer {self.index_name}: {len(retry)}/{len(batch)} docs failed "
+                           f"(attempt {attempt + 1}): {errors[0]}")
+            indexed += len(batch) - len(retry)
+            batch = retry
+            if attempt < self.max_retries:
+                time.sleep(min(2 ** attempt, 10))
+        return indexed, errors
@@ -0,0 +1,958 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import copy
+import fcntl
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from rag import settings
+from rag.settings import TAG_FLD, PAGERANK_FLD
+from rag.utils import singleton
+from api.utils.file_utils import get_project_base_directory
+from rag.utils.retrieval_cache import invalidates_retrieval
+from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
+    FusionExpr
+
+logger = logging.getLogger('ragflow.embedded_conn')
+
+# Field name patterns of conf/mapping.json.
+TEXT_FIELD = re.compile(r".*_(tks|ltks)$")
+KEYWORD_FIELD = re.compile(r"^(.*_(kwd|id|ids|uid|uids)|uid)$")
+VECTOR_FIELD = re.compile(r".*_([0-9]+)_vec$")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def parse_query_string(query: str) -> list[tuple]:
+    """
+    Parses the subset of the Lucene query string syntax `rag.nlp.query.FulltextQueryer` generates into
+    clauses ("term", token, boost), ("phrase", [tokens], boost) and ("group", [clauses], boost).
+    `OR`/`AND` are the default operator either way and the slop of phrases is ignored.
+    """
+    tokens = []
+    i = 0
+    while i < len(query):
+        c = query[i]
+        if c.isspace():
+            i += 1
+        elif c in "()":
+            tokens.append((c, None))
+            i += 1
+        elif c in "^~":
+            j = i + 1
+            while j < len(query) and (query[j].isdigit() or query[j] == "."):
+                j += 1
+            try:
+                tokens.append((c, float(query[i + 1:j])))
+            except ValueError:
+                tokens.append((c, None))
+            i = j
+        elif c == '"':
+            j = i + 1
+            txt = []
+            while j < len(query) and query[j] != '"':
+                if query[j] == "\\" and j + 1 < len(query):
+                    j += 1
+                txt.append(query[j])
+                j += 1
+            tokens.append(("phrase", "".join(txt)))
+            i = j + 1
+        else:
+            txt = []
+            while i < len(query) and not query[i].isspace() and query[i] not in '()^~"':
+                if query[i] == "\\" and i + 1 < len(query):
+                    i += 1
+                txt.append(query[i])
+                i += 1
+            txt = "".join(txt)
+            if txt not in ["OR", "AND", "||", "&&", "+"]:
+                tokens.append(("term", txt))
+
+    pos = 0
+
+    def clauses():
+        nonlocal pos
+        res = []
+        while pos < len(tokens) and tokens[pos][0] != ")":
+            kind, v = tokens[pos]
+            pos += 1
+            if kind == "(":
+                clause = ["group", clauses(), 1.]
+                pos += 1
+            elif kind == "phrase":
+                clause = ["phrase", v.split(), 1.]
+            elif kind == "term":
+                clause = ["term", v, 1.]
+            else:
+                continue
+            while pos < len(tokens) and tokens[pos][0] in "^~":
+                if tokens[pos][0] == "^" and tokens[pos][1] is not None:
+                    clause[2] = tokens[pos][1]
+                pos += 1
+            if clause[1]:
+                res.append(tuple(clause))
+        return res
+
+    res = []
+    while pos < len(tokens):
+        res.extend(clauses())
+        pos += 1
+    return res
+
+
+def _field_tokens(field: str, value) -> list[str] | None:
+    """Indexed tokens of a field value, None for fields which are not indexed."""
+    if value is None:
+        return None
+    values = value if isinstance(value, list) else [value]
+    if TEXT_FIELD.match(field):
+        return [t for v in values for t in str(v).split()]
+    if KEYWORD_FIELD.match(field):
+        return [str(v) for v in values if v is not None]
+    return None
+
+
+class VectorColumn:
+    """
+    The vectors of a `*_{dim}_vec` field, appended as float32 rows to a file read through a memory map.
+    Rows of deleted or replaced chunks stay in the file until the table is compacted.
+
+    Past `ivf_min_rows` live rows, searches probe an inverted file index: the rows are clustered by spherical
+    k-means into about 4*sqrt(n) lists and only the `nprobe` lists closest to the query are scanned. Searches
+    restricted to fewer than `ivf_min_rows` rows (a few documents) are always exact.
+    """
+
+    def __init__(self, path: str, dim: int, ivf_min_rows: int, nprobe: int):
+        self.path = path
+        self.dim = dim
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self.rows = 0
+        self.mm = None
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.id_rows = {}
+        self.row_ids = {}
+        self.alive = None
+        self.centroids = None
+        self.lists = []
+        self.ivf_rows = 0
+        self.trained_on = 0
+
+    def append(self, vectors: np.ndarray) -> int:
+        """Appends the rows of `vectors`, returns the row of the first one. The caller holds the table's write lock."""
+        start = os.path.getsize(self.path) // (4 * self.dim) if os.path.exists(self.path) else 0
+        with open(self.path, "ab") as f:
+            f.seek(start * 4 * self.dim)
+            f.truncate()
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        return start
+
+    def put(self, chunk_id: str, row: int):
+        self.remove(chunk_id)
+        self.id_rows[chunk_id] = row
+        self.row_ids[row] = chunk_id
+        self.alive = None
+
+    def remove(self, chunk_id: str):
+        row = self.id_rows.pop(chunk_id, None)
+        if row is not None:
+            self.row_ids.pop(row, None)
+            self.alive = None
+
+    def refresh(self):
+        n = os.path.getsize(self.path) // (4 * self.dim) if os.path.exists(self.path) else 0
+        if n <= self.rows:
+            return
+        self.mm = np.memmap(self.path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        norms = [self.norms]
+        for i in range(self.rows, n, 65536):
+            norms.append(np.linalg.norm(self.mm[i:min(n, i + 65536)], axis=1))
+        self.norms = np.concatenate(norms).astype(np.float32)
+        self.rows = n
+        self.alive = None
+
+    def vector(self, chunk_id: str) -> list[float] | None:
+        row = self.id_rows.get(chunk_id)
+        if row is None:
+            return None
+        self.refresh()
+        return self.mm[row].tolist()
+
+    def _alive(self) -> np.ndarray:
+        if self.alive is None or len(self.alive) != self.rows:
+            self.alive = np.zeros(self.rows, dtype=bool)
+            rows = np.fromiter(self.row_ids.keys(), dtype=np.int64, count=len(self.row_ids))
+            self.alive[rows[rows < self.rows]] = True
+        return self.alive
+
+    def _assign(self, start: int, end: int) -> np.ndarray:
+        res = []
+        for i in range(start, end, 65536):
+            j = min(end, i + 65536)
+            x = self.mm[i:j] / np.maximum(self.norms[i:j], 1e-12)[:, None]
+            res.append(np.argmax(x @ self.centroids.T, axis=1))
+        return np.concatenate(res) if res else np.zeros(0, dtype=np.int64)
+
+    def _train(self):
+        live = len(self.row_ids)
+        if live < self.ivf_min_rows:
+            self.centroids = None
+            return
+        if self.centroids is not None and live < 2 * self.trained_on:
+            if self.ivf_rows < self.rows:
+                assign = self._assign(self.ivf_rows, self.rows)
+                for c in np.unique(assign):
+                    self.lists[c] = np.concatenate([self.lists[c], self.ivf_rows + np.nonzero(assign == c)[0]])
+                self.ivf_rows = self.rows
+            return
+        rng = np.random.default_rng(0)
+        nlist = int(min(4096, max(16, 4 * math.sqrt(live))))
+        rows = np.nonzero(self._alive())[0]
+        sample = np.sort(rng.choice(rows, min(len(rows), 32 * nlist), replace=False))
+        x = self.mm[sample] / np.maximum(self.norms[sample], 1e-12)[:, None]
+        centroids = x[rng.choice(len(x), nlist, replace=False)]
+        for _ in range(6):
+            assign = np.argmax(x @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, x)
+            norms = np.linalg.norm(sums, axis=1)
+            centroids = np.where(norms[:, None] > 0, sums / np.maximum(norms, 1e-12)[:, None], centroids)
+        self.centroids = centroids.astype(np.float32)
+        assign = self._assign(0, self.rows)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+        self.ivf_rows = self.rows
+        self.trained_on = live
+        logger.info(f"VectorColumn {self.path} trained {nlist} lists over {live} rows")
+
+    def search(self, query, topn: int, chunk_ids: set[str] | None, similarity: float) -> list[tuple[str, float]]:
+        """The `topn` chunks (of `chunk_ids` if given) most similar to `query` by cosine, at least `similarity`."""
+        self.refresh()
+        if not self.row_ids or self.mm is None:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        qn = q / max(float(np.linalg.norm(q)), 1e-12)
+        if chunk_ids is not None:
+            rows = np.fromiter((self.id_rows[i] for i in chunk_ids if i in self.id_rows), dtype=np.int64)
+        else:
+            rows = np.nonzero(self._alive())[0]
+        if len(rows) >= self.ivf_min_rows:
+            self._train()
+        if len(rows) >= self.ivf_min_rows and self.centroids is not None:
+            probe = np.argsort(-(self.centroids @ qn))[:self.nprobe]
+            mask = np.zeros(self.rows, dtype=bool)
+            mask[rows] = True
+            candidates = np.concatenate([self.lists[c] for c in probe])
+            rows = np.sort(candidates[mask[candidates]])
+        if len(rows) == 0:
+            return []
+        sims = (self.mm[rows] @ qn) / np.maximum(self.norms[rows], 1e-12)
+        keep = np.nonzero(sims >= similarity)[0]
+        if len(keep) > topn:
+            keep = keep[np.argpartition(-sims[keep], topn - 1)[:topn]]
+        keep = keep[np.argsort(-sims[keep], kind="stable")]
+        return [(self.row_ids[int(rows[k])], float(sims[k])) for k in keep]
+
+
+class Table:
+    """
+    The chunks of one knowledge base in one index, in a directory of:
+     - `log.{gen}.jsonl`: the chunks put and the ids deleted, one operation per line, replayed on open;
+     - `{field}.{gen}.f32`: the vectors of a vector field, see `VectorColumn`;
+     - `gen`: the generation of the files above, bumped when the log is compacted.
+
+    Writers take an exclusive `flock` on the directory, so several processes (the server, the task
+    executors) share a table: each of them replays what the others appended to the log before a read.
+    The chunks, a postings list per token of the `*_tks`/`*_ltks` fields and per value of the keyword
+    fields, and the vector ids live in memory.
+    """
+
+    def __init__(self, path: str, ivf_min_rows: int, nprobe: int):
+        self.path = path
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self.lock = threading.RLock()
+        self.pending = []
+        self._reset(None)
+
+    def _reset(self, gen):
+        self.gen = gen
+        self.offset = 0
+        self.lines = 0
+        self.docs = {}
+        self.vectors = {}
+        self.postings = defaultdict(lambda: defaultdict(dict))
+        self.lengths = defaultdict(dict)
+        self.total_lengths = defaultdict(int)
+        self.unavailable = set()
+
+    @contextmanager
+    def _flock(self, exclusive: bool):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "lock"), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _file(self, name: str, gen: int | None = None) -> str:
+        return os.path.join(self.path, f"{name}.{self.gen if gen is None else gen}")
+
+    def _sync(self):
+        """Replays the operations appended to the log since the last call. The caller holds the flock."""
+        try:
+            with open(os.path.join(self.path, "gen")) as f:
+                gen = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            gen = 0
+        if gen != self.gen:
+            self._reset(gen)
+        log = self._file("log") + ".jsonl"
+        if not os.path.exists(log) or os.path.getsize(log) <= self.offset:
+            return
+        with open(log, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                op = json.loads(line)
+            except ValueError:
+                logger.warning(f"Table {self.path} skips a corrupted log line: {line[:100]}")
+                continue
+            self._apply(op)
+        self.offset += end
+
+    @contextmanager
+    def reading(self):
+        with self.lock:
+            with self._flock(False):
+                self._sync()
+            yield self
+
+    @contextmanager
+    def writing(self):
+        with self.lock, self._flock(True):
+            self._sync()
+            self.pending = []
+            try:
+                yield self
+            finally:
+                if self.pending:
+                    log = self._file("log") + ".jsonl"
+                    # Drops the partial line a writer killed midway left behind, all complete ones were replayed.
+                    if os.path.exists(log) and os.path.getsize(log) > self.offset:
+                        os.truncate(log, self.offset)
+                    with open(log, "ab") as f:
+                        f.write("".join(self.pending).encode("utf-8"))
+                    self.pending = []
+                    self._sync()
+                if self.lines > 2 * len(self.docs) + 10000:
+                    self._compact()
+
+    def column(self, field: str) -> VectorColumn:
+        if field not in self.vectors:
+            dim = int(VECTOR_FIELD.match(field).group(1))
+            self.vectors[field] = VectorColumn(self._file(field) + ".f32", dim, self.ivf_min_rows, self.nprobe)
+        return self.vectors[field]
+
+    def _index(self, doc: dict, sign: int):
+        chunk_id = doc["id"]
+        if doc.get("available_int") is not None and doc["available_int"] < 1:
+            if sign > 0:
+                self.unavailable.add(chunk_id)
+            else:
+                self.unavailable.discard(chunk_id)
+        for field, value in doc.items():
+            tokens = _field_tokens(field, value)
+            if tokens is None:
+                continue
+            postings = self.postings[field]
+            for t, tf in Counter(tokens).items():
+                if sign > 0:
+                    postings[t][chunk_id] = tf
+                else:
+                    postings[t].pop(chunk_id, None)
+                    if not postings[t]:
+                        del postings[t]
+            if TEXT_FIELD.match(field):
+                if sign > 0:
+                    self.lengths[field][chunk_id] = len(tokens)
+                else:
+                    self.lengths[field].pop(chunk_id, None)
+                self.total_lengths[field] += sign * len(tokens)
+
+    def _apply(self, op: dict):
+        self.lines += 1
+        if op["op"] == "put":
+            doc = op["doc"]
+            old = self.docs.get(doc["id"])
+            if old:
+                self._index(old, -1)
+            self.docs[doc["id"]] = doc
+            self._index(doc, 1)
+            vectors = op.get("vectors", {})
+            for field, column in self.vectors.items():
+                if field not in vectors:
+                    column.remove(doc["id"])
+            for field, row in vectors.items():
+                self.column(field).put(doc["id"], row)
+        elif op["op"] == "delete":
+            for chunk_id in op["ids"]:
+                old = self.docs.pop(chunk_id, None)
+                if old:
+                    self._index(old, -1)
+                for column in self.vectors.values():
+                    column.remove(chunk_id)
+
+    def put(self, doc: dict, vectors: dict[str, int]):
+        """Queues the put of `doc`, whose vectors are at the given rows of their columns. Within `writing` only."""
+        self.pending.append(json.dumps({"op": "put", "doc": doc, "vectors": vectors}, ensure_ascii=False,
+                                       default=lambda o: o.item() if hasattr(o, "item") else str(o)) + "\n")
+
+    def delete(self, chunk_ids: list[str]):
+        if chunk_ids:
+            self.pending.append(json.dumps({"op": "delete", "ids": chunk_ids}) + "\n")
+
+    def append_vectors(self, field: str, vectors: list) -> int:
+        return self.column(field).append(np.array(vectors, dtype=np.float32).reshape(len(vectors), -1))
+
+    def vector_rows(self, chunk_id: str) -> dict[str, int]:
+        return {f: c.id_rows[chunk_id] for f, c in self.vectors.items() if chunk_id in c.id_rows}
+
+    def _compact(self):
+        """Rewrites the live chunks and vectors as the next generation. The caller holds the exclusive flock."""
+        gen = self.gen + 1
+        with open(self._file("log", gen) + ".jsonl", "wb") as log:
+            files = {}
+            for field, column in self.vectors.items():
+                column.refresh()
+                files[field] = open(self._file(field, gen) + ".f32", "wb")
+            rows = defaultdict(int)
+            for chunk_id, doc in self.docs.items():
+                vectors = {}
+                for field, column in self.vectors.items():
+                    if chunk_id in column.id_rows:
+                        files[field].write(np.asarray(column.mm[column.id_rows[chunk_id]]).tobytes())
+                        vectors[field] = rows[field]
+                        rows[field] += 1
+                log.write((json.dumps({"op": "put", "doc": doc, "vectors": vectors}, ensure_ascii=False)
+                           + "\n").encode("utf-8"))
+            for f in files.values():
+                f.close()
+        with open(os.path.join(self.path, "gen.tmp"), "w") as f:
+            f.write(str(gen))
+        os.replace(os.path.join(self.path, "gen.tmp"), os.path.join(self.path, "gen"))
+        old = self.gen
+        fields = list(self.vectors.keys())
+        self._sync()
+        for name in [f"log.{old}.jsonl"] + [f"{field}.{old}.f32" for field in fields]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+        logger.info(f"Table {self.path} compacted to generation {gen} with {len(self.docs)} chunks")
+
+    """
+    Queries, within `reading` or `writing`
+    """
+
+    def filter(self, condition: dict) -> set[str] | None:
+        """Ids of the chunks matching `condition` the way `ESConnection` reads it, None for all of them."""
+        ids = None
+        excluded = set()
+        predicates = []
+        for k, v in condition.items():
+            if not isinstance(k, str):
+                continue
+            if k == "available_int":
+                if v == 0:
+                    ids = set(self.unavailable) if ids is None else ids & self.unavailable
+                else:
+                    excluded = self.unavailable
+                continue
+            if k == "exists":
+                predicates.append(lambda d, f=v: d.get(f) is not None)
+                continue
+            if k == "must_not":
+                if isinstance(v, dict) and v.get("exists"):
+                    predicates.append(lambda d, f=v["exists"]: d.get(f) is None)
+                continue
+            if not v:
+                continue
+            if not isinstance(v, (list, str, int)):
+                raise Exception(
+                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+            values = v if isinstance(v, list) else [v]
+            if k == "id":
+                matched = {i for i in values if i in self.docs}
+            elif KEYWORD_FIELD.match(k):
+                postings = self.postings.get(k, {})
+                matched = set()
+                for value in values:
+                    matched.update(postings.get(str(value), {}).keys())
+            else:
+                def predicate(d, f=k, values=values):
+                    value = d.get(f)
+                    if isinstance(value, list):
+                        return any(x in values for x in value)
+                    return value in values
+                predicates.append(predicate)
+                continue
+            ids = matched if ids is None else ids & matched
+        if excluded:
+            ids = (self.docs.keys() if ids is None else ids) - excluded
+        if predicates:
+            ids = {i for i in (self.docs if ids is None else ids) if all(p(self.docs[i]) for p in predicates)}
+        return ids
+
+    def _field_score(self, field: str, token: str, chunk_id: str, df: int, n: int) -> float:
+        tf = self.postings[field].get(token, {}).get(chunk_id)
+        if not tf:
+            return 0.
+        if KEYWORD_FIELD.match(field):
+            return 1.
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        if field.endswith("_ltks"):
+            avgdl = self.total_lengths[field] / max(1, len(self.lengths[field]))
+            dl = self.lengths[field].get(chunk_id, 0)
+            return idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / max(avgdl, 1e-6)))
+        # scripted_sim of conf/mapping.json
+        return idf / max(math.log(1 + (n - 0.5) / 1.5), 1e-6) * min(tf, 1)
+
+    def match_text(self, m: MatchTextExpr, chunk_ids: set[str] | None) -> dict[str, float]:
+        """Scores of the chunks matching `m`, as a `query_string` of type best_fields over `m.fields`."""
+        clauses = parse_query_string(m.matching_text)
+        if not clauses:
+            return {}
+        fields = []
+        for f in m.fields:
+            f, _, boost = f.partition("^")
+            fields.append((f, float(boost) if boost else 1.))
+        n = {f: max(1, len(self.lengths[f]) if TEXT_FIELD.match(f) else len(self.docs)) for f, _ in fields}
+        stats = {}
+
+        def collect(clause):
+            kind, v, _ = clause
+            for t in ([v] if kind == "term" else v if kind == "phrase" else []):
+                if t not in stats:
+                    stats[t] = [(f, b, len(self.postings[f].get(t, {}))) for f, b in fields]
+            if kind == "group":
+                for c in v:
+                    collect(c)
+
+        for c in clauses:
+            collect(c)
+        candidates = set()
+        for t, fs in stats.items():
+            for f, _, df in fs:
+                if df:
+                    candidates.update(self.postings[f][t].keys())
+        if chunk_ids is not None:
+            candidates &= chunk_ids
+
+        def score(clause, chunk_id) -> float:
+            kind, v, boost = clause
+            if kind == "group":
+                return boost * sum(score(c, chunk_id) for c in v)
+            tokens = [v] if kind == "term" else v
+            best = 0.
+            for i, (f, b, _) in enumerate(stats[tokens[0]]):
+                s = 0.
+                for t in tokens:
+                    f, b, df = stats[t][i]
+                    ts = self._field_score(f, t, chunk_id, df, n[f]) if df else 0.
+                    if ts <= 0:
+                        s = 0.
+                        break
+                    s += ts
+                best = max(best, b * s)
+            return boost * best
+
+        minimum_should_match = m.extra_options.get("minimum_should_match", 0.0)
+        if isinstance(minimum_should_match, str):
+            minimum_should_match = float(minimum_should_match.strip("%") or 0) / 100.
+        required = max(1, int(len(clauses) * minimum_should_match))
+        res = {}
+        for chunk_id in candidates:
+            scores = [score(c, chunk_id) for c in clauses]
+            if sum(1 for s in scores if s > 0) >= required:
+                res[chunk_id] = sum(scores)
+        return res
+
+    def rank_features(self, chunk_id: str, rank_feature: dict) -> float:
+        doc = self.docs[chunk_id]
+        s = 0.
+        for fld, sc in rank_feature.items():
+            value = doc.get(PAGERANK_FLD) if fld == PAGERANK_FLD else (doc.get(TAG_FLD) or {}).get(fld)
+            try:
+                s += float(value or 0) * sc
+            except (TypeError, ValueError):
+                continue
+        return s
+
+    def chunk(self, chunk_id: str, vector_fields: list[str] | None = None) -> dict:
+        """A copy of the chunk with the vectors of `vector_fields`, all of them if None."""
+        doc = copy.deepcopy(self.docs[chunk_id])
+        for field, column in self.vectors.items():
+            if vector_fields is None or field in vector_fields:
+                v = column.vector(chunk_id)
+                if v is not None:
+                    doc[field] = v
+        return doc
+
+
+@singleton
+class EmbeddedConnection(DocStoreConnection):
+    """
+    A doc store in the local file system, for a single node or tests: no Elasticsearch nor Infinity to run.
+    Every knowledge base of an index is a `Table` under `{path}/{indexName}/{knowledgebaseId}`. Searches,
+    conditions, updates and results follow `ESConnection`, so `rag.nlp.search.Dealer` works unchanged.
+    """
+
+    def __init__(self):
+        conf = settings.EMBEDDED
+        self.path = conf.get("path", os.path.join("data", "doc_store"))
+        if not os.path.isabs(self.path):
+            self.path = os.path.join(get_project_base_directory(), self.path)
+        self.ivf_min_rows = int(conf.get("ivf_min_rows", 20000))
+        self.nprobe = int(conf.get("nprobe", 32))
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.tables = {}
+        logger.info(f"Use the embedded doc store at {self.path} as the doc engine.")
+
+    @staticmethod
+    def _name(name: str) -> str:
+        return re.sub(r"[^\w.-]", "_", name or "_")
+
+    def _table(self, indexName: str, knowledgebaseId: str) -> Table:
+        path = os.path.join(self.path, self._name(indexName), self._name(knowledgebaseId))
+        with self.lock:
+            if path not in self.tables:
+                self.tables[path] = Table(path, self.ivf_min_rows, self.nprobe)
+            return self.tables[path]
+
+    def _tables(self, indexNames: str | list[str], knowledgebaseIds: str | list[str] | None) -> list[Table]:
+        """The existing tables of the knowledge bases in the indices, of all the knowledge bases if none given."""
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        if isinstance(knowledgebaseIds, str):
+            knowledgebaseIds = [knowledgebaseIds]
+        res = []
+        for indexName in indexNames:
+            index_dir = os.path.join(self.path, self._name(indexName))
+            if not os.path.isdir(index_dir):
+                continue
+            kb_ids = [self._name(kb_id) for kb_id in knowledgebaseIds] if knowledgebaseIds else sorted(
+                os.listdir(index_dir))
+            for kb_id in kb_ids:
+                if os.path.isdir(os.path.join(index_dir, kb_id)):
+                    res.append(self._table(indexName, kb_id))
+        return res
+
+    """
+    Database operations
+    """
+
+    def dbType(self) -> str:
+        return "embedded"
+
+    def health(self) -> dict:
+        usage = shutil.disk_usage(self.path)
+        return {
+            "type": "embedded",
+            "status": "green" if os.access(self.path, os.W_OK) else "red",
+            "path": self.path,
+            "tables": len(self.tables),
+            "disk_free": usage.free,
+        }
+
+    """
+    Table operations
+    """
+
+    def createIdx(self, indexName: str, knowledgebaseId: str, vectorSize: int):
+        os.makedirs(self._table(indexName, knowledgebaseId).path, exist_ok=True)
+        return True
+
+    def deleteIdx(self, indexName: str, knowledgebaseId: str):
+        path = os.path.join(self.path, self._name(indexName))
+        if knowledgebaseId:
+            path = os.path.join(path, self._name(knowledgebaseId))
+        with self.lock:
+            for p in [p for p in self.tables if p == path or p.startswith(path + os.sep)]:
+                del self.tables[p]
+        shutil.rmtree(path, ignore_errors=True)
+
+    def indexExist(self, indexName: str, knowledgebaseId: str) -> bool:
+        path = os.path.join(self.path, self._name(indexName))
+        if knowledgebaseId:
+            path = os.path.join(path, self._name(knowledgebaseId))
+        return os.path.isdir(path)
+
+    """
+    CRUD operations
+    """
+
+    def search(
+            self, selectFields: list[str],
+            highlightFields: list[str],
+            condition: dict,
+            matchExprs: list[MatchExpr],
+            orderBy: OrderByExpr,
+            offset: int,
+            limit: int,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            aggFields: list[str] = [],
+            rank_feature: dict | None = None
+    ):
+        """
+        Text matches score like Elasticsearch's `query_string` over the fields of the `MatchTextExpr`, dense
+        matches (1 + cosine) / 2 like its kNN search, and a chunk matching both the weighted sum of the two.
+        """
+        assert "_id" not in condition
+        condition = {k: v for k, v in condition.items() if k != "kb_id"}
+        vector_similarity_weight = 0.5
+        for m in matchExprs:
+            if isinstance(m, FusionExpr) and m.method == "weighted_sum" and "weights" in m.fusion_params:
+                vector_similarity_weight = float(m.fusion_params["weights"].split(",")[1])
+        vector_fields = [f for f in selectFields if VECTOR_FIELD.match(f)] if selectFields else None
+
+        hits = []
+        for table in self._tables(indexNames, knowledgebaseIds):
+            with table.reading():
+                chunk_ids = table.filter(condition)
+                scores = {}
+                text = None
+                for m in matchExprs:
+                    if isinstance(m, MatchTextExpr):
+                        text = table.match_text(m, chunk_ids)
+                        for chunk_id, s in text.items():
+                            scores[chunk_id] = (1.0 - vector_similarity_weight) * s
+                    elif isinstance(m, MatchDenseExpr):
+                        if m.vector_column_name not in table.vectors:
+                            continue
+                        for chunk_id, sim in table.column(m.vector_column_name).search(
+                                m.embedding_data, m.topn, chunk_ids, m.extra_options.get("similarity", 0.0)):
+                            scores[chunk_id] = scores.get(chunk_id, 0.) + (1. + sim) / 2.
+                if rank_feature and text:
+                    for chunk_id in text:
+                        scores[chunk_id] += table.rank_features(chunk_id, rank_feature)
+                if not any(isinstance(m, (MatchTextExpr, MatchDenseExpr)) for m in matchExprs):
+                    # In the order of insertion, as chunk lists page through them.
+                    hits.extend((0., table, chunk_id, doc) for chunk_id, doc in table.docs.items()
+                                if chunk_ids is None or chunk_id in chunk_ids)
+                    continue
+                hits.extend((s, table, chunk_id, table.docs[chunk_id]) for chunk_id, s in scores.items())
+
+        hits.sort(key=lambda h: -h[0])
+        if orderBy and orderBy.fields:
+            for field, order in reversed(orderBy.fields):
+                def key(h, field=field):
+                    v = h[3].get(field)
+                    if isinstance(v, list):
+                        v = [x for x in v if isinstance(x, (int, float))]
+                        v = sum(v) / len(v) if v else None
+                    return v
+                present = [h for h in hits if key(h) is not None]
+                present.sort(key=key, reverse=order != 0)
+                hits = present + [h for h in hits if key(h) is None]
+
+        aggregations = {}
+        for fld in aggFields:
+            counter = Counter()
+            for h in hits:
+                v = h[3].get(fld)
+                for x in (v if isinstance(v, list) else [v]):
+                    if x is not None and x != "":
+                        counter[x] += 1
+            aggregations[fld] = counter.most_common()
+
+        res = []
+        for s, table, chunk_id, doc in hits[offset:offset + limit] if limit > 0 else hits[:10]:
+            with table.lock:
+                doc = table.chunk(chunk_id, vector_fields) if chunk_id in table.docs else copy.deepcopy(doc)
+            doc["id"] = chunk_id
+            doc["_score"] = s
+            res.append(doc)
+        logger.debug(f"EmbeddedConnection.search {str(indexNames)} got {len(hits)} hits")
+        return {"total": len(hits), "hits": res, "aggregations": aggregations, "highlight": bool(highlightFields)}
+
+    def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
+        for table in self._tables(indexName, knowledgebaseIds):
+            with table.reading():
+                if chunkId in table.docs:
+                    chunk = table.chunk(chunkId)
+                    chunk["id"] = chunkId
+                    return chunk
+        return None
+
+    @invalidates_retrieval
+    def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
+        by_kb = defaultdict(list)
+        for d in documents:
+            assert "_id" not in d
+            assert "id" in d
+            by_kb[knowledgebaseId or d.get("kb_id", "")].append(d)
+        res = []
+        for kb_id, docs in by_kb.items():
+            try:
+                with self._table(indexName, kb_id).writing() as table:
+                    columns = defaultdict(list)
+                    for d in docs:
+                        for field in d:
+                            if VECTOR_FIELD.match(field):
+                                columns[field].append(d)
+                    rows = {}
+                    for field, ds in columns.items():
+                        start = table.append_vectors(field, [d[field] for d in ds])
+                        for i, d in enumerate(ds):
+                            rows[(d["id"], field)] = start + i
+                    for d in docs:
+                        doc = {k: v for k, v in d.items() if not VECTOR_FIELD.match(k)}
+                        table.put(doc, {f: rows[(d["id"], f)] for f in d if (d["id"], f) in rows})
+            except Exception as e:
+                logger.exception(f"EmbeddedConnection.insert {indexName}/{kb_id} got exception")
+                res.extend(str(d["id"]) + ":" + str(e) for d in docs)
+        return res
+
+    @invalidates_retrieval
+    def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
+        # Like `ESConnection.update`, empty values only reset the fields of a single chunk, available_int aside.
+        single = isinstance(condition.get("id"), str)
+        try:
+            for table in self._tables(indexName, knowledgebaseId or None):
+                with table.writing():
+                    chunk_ids = table.filter(condition)
+                    for chunk_id in (table.docs if chunk_ids is None else chunk_ids):
+                        doc = copy.deepcopy(table.docs[chunk_id])
+                        vectors = table.vector_rows(chunk_id)
+                        for k, v in newValue.items():
+                            if k == "id":
+                                continue
+                            if k == "remove":
+                                if isinstance(v, str):
+                                    doc.pop(v, None)
+                                    vectors.pop(v, None)
+                                elif isinstance(v, dict):
+                                    for kk, vv in v.items():
+                                        if isinstance(doc.get(kk), list) and vv in doc[kk]:
+                                            doc[kk].remove(vv)
+                                continue
+                            if k == "add":
+                                if isinstance(v, dict):
+                                    for kk, vv in v.items():
+                                        doc.setdefault(kk, [])
+                                        if isinstance(doc[kk], list):
+                                            doc[kk].append(vv.strip() if isinstance(vv, str) else vv)
+                                continue
+                            if not single and not v and k != "available_int":
+                                continue
+                            if VECTOR_FIELD.match(k):
+                                vectors[k] = table.append_vectors(k, [v])
+                                continue
+                            doc[k] = v
+                        table.put(doc, vectors)
+            return True
+        except Exception:
+            logger.exception(f"EmbeddedConnection.update {indexName} condition {json.dumps(condition)} got exception")
+        return False
+
+    @invalidates_retrieval
+    def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
+        assert "_id" not in condition
+        deleted = 0
+        for table in self._tables(indexName, knowledgebaseId or None):
+            with table.writing():
+                chunk_ids = table.filter(condition)
+                chunk_ids = list(table.docs if chunk_ids is None else chunk_ids)
+                table.delete(chunk_ids)
+                deleted += len(chunk_ids)
+        return deleted
+
+    """
+    Helper functions for search result
+    """
+
+    def getTotal(self, res):
+        return res["total"]
+
+    def getChunkIds(self, res):
+        return [d["id"] for d in res["hits"]]
+
+    def getFields(self, res, fields: list[str]) -> dict[str, dict]:
+        res_fields = {}
+        if not fields:
+            return {}
+        for d in res["hits"]:
+            m = {n: d.get(n) for n in fields if d.get(n) is not None}
+            for n, v in m.items():
+                if isinstance(v, list):
+                    continue
+                if not isinstance(v, str):
+                    m[n] = str(m[n])
+            if m:
+                res_fields[d["id"]] = m
+        return res_fields
+
+    def getHighlight(self, res, keywords: list[str], fieldnm: str):
+        ans = {}
+        if not res.get("highlight"):
+            return ans
+        for d in res["hits"]:
+            txt = d.get(fieldnm)
+            if not isinstance(txt, str):
+                continue
+            txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
+            txts = []
+            for t in re.split(r"[.?!;\n]", txt):
+                for w in keywords:
+                    t = re.sub(r"(^|[ .?/'\"\(\)!,:;-])(%s)([ .?/'\"\(\)!,:;-])" % re.escape(w), r"\1<em>\2</em>\3", t,
+                               flags=re.IGNORECASE | re.MULTILINE)
+                if not re.search(r"<em>[^<>]+</em>", t, flags=re.IGNORECASE | re.MULTILINE):
+                    continue
+                txts.append(t)
+            if txts:
+                ans[d["id"]] = "...".join(txts)
+        return ans
+
+    def getAggregation(self, res, fieldnm: str):
+        return res.get("aggregations", {}).get(fieldnm, [])
+
+    """
+    SQL
+    """
+
+    def sql(self, sql: str, fetch_size: int, format: str):
+        logger.warning("EmbeddedConnection.sql is not supported by the embedded doc store.")
+        return None
@@ -0,0 +1,139 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import struct
+import threading
+
+import numpy as np
+import xxhash
+from cachetools import LRUCache
+
+from rag import settings
+from rag.utils.redis_conn import REDIS_CONN
+
+# Packed vector: b"RVEC", format version, dtype code, dimension, then little-endian floats.
+VECTOR_MAGIC = b"RVEC"
+VECTOR_VERSION = 1
+VECTOR_HEADER = struct.Struct("<4sBBI")
+VECTOR_DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+VECTOR_DTYPE_CODES = {"float32": 0, "float16": 1}
+
+
+def pack_vector(vec, dtype: str = "float32") -> bytes:
+    code = VECTOR_DTYPE_CODES[dtype]
+    arr = np.asarray(vec, dtype=VECTOR_DTYPES[code]).ravel()
+    return VECTOR_HEADER.pack(VECTOR_MAGIC, VECTOR_VERSION, code, arr.shape[0]) + arr.tobytes()
+
+
+def unpack_vector(data: bytes) -> np.ndarray | None:
+    """Returns the float32 vector, or None if `data` is not a packed vector."""
+    if not data or len(data) < VECTOR_HEADER.size or not data.startswith(VECTOR_MAGIC):
+        return None
+    _, version, code, dim = VECTOR_HEADER.unpack_from(data)
+    if version != VECTOR_VERSION or code not in VECTOR_DTYPES:
+        return None
+    dt = VECTOR_DTYPES[code]
+    if len(data) != VECTOR_HEADER.size + dim * dt.itemsize:
+        return None
+    return np.frombuffer(data, dtype=dt, count=dim, offset=VECTOR_HEADER.size).astype(np.float32)
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model, hash of the stripped text), so identical chunk text is embedded once
+    across re-parses and knowledge bases. A per-process LRU sits in front of Redis; lookups and
+    writes for a batch of texts are a single MGET and a single pipeline.
+    """
+
+    def __init__(self, enabled=True, local_size=20000, ttl=7 * 24 * 3600, dtype="float32", remote=True):
+        self.enabled = enabled
+        self.remote = remote
+        self.ttl = ttl
+        self.dtype = dtype
+        self.local = LRUCache(maxsize=local_size) if local_size > 0 else None
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return "embd:{}:{}".format(xxhash.xxh64(str(model).encode("utf-8")).hexdigest(),
+                                   xxhash.xxh128(str(text).strip().encode("utf-8")).hexdigest())
+
+    def get_many(self, model: str, texts: list[str]) -> list[np.ndarray | None]:
+        keys = [self.key(model, t) for t in texts]
+        res = [None] * len(texts)
+        remote = []
+        with self.lock:
+            for i, k in enumerate(keys):
+                v = self.local.get(k) if self.local is not None else None
+                if v is not None:
+                    res[i] = v
+                    self.local_hits += 1
+                else:
+                    remote.append(i)
+        if not remote:
+            return res
+        if not self.remote:
+            with self.lock:
+                self.misses += len(remote)
+            return res
+
+        found = {}
+        for i, data in zip(remote, REDIS_CONN.mget_bin([keys[i] for i in remote])):
+            v = unpack_vector(data)
+            if v is not None:
+                res[i] = v
+                found[keys[i]] = v
+        with self.lock:
+            self.redis_hits += len(found)
+            self.misses += len(remote) - len(found)
+            if self.local is not None:
+                for k, v in found.items():
+                    self.local[k] = v
+        return res
+
+    def set_many(self, model: str, texts: list[str], vectors):
+        mapping = {}
+        local = {}
+        for t, v in zip(texts, vectors):
+            k = self.key(model, t)
+            mapping[k] = pack_vector(v, self.dtype)
+            local[k] = np.asarray(v, dtype=np.float32)
+        if self.local is not None:
+            with self.lock:
+                for k, v in local.items():
+                    self.local[k] = v
+        if self.remote:
+            REDIS_CONN.mset_bin(mapping, self.ttl)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.local_hits + self.redis_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.local_hits + self.redis_hits) / total, 4) if total else 0.,
+            }
+
+
+EMBEDDING_CACHE = EmbeddingCache(settings.EMBEDDING_CACHE, settings.EMBEDDING_CACHE_LOCAL_SIZE,
+                                 settings.EMBEDDING_CACHE_TTL, settings.EMBEDDING_CACHE_DTYPE)
+# Query vectors (`encode_queries`) may differ from document vectors of the same text, so they have their own cache.
+QUERY_EMBEDDING_CACHE = EmbeddingCache(settings.QUERY_EMBEDDING_CACHE, settings.QUERY_EMBEDDING_CACHE_LOCAL_SIZE,
+                                       settings.EMBEDDING_CACHE_TTL, "float32", settings.QUERY_EMBEDDING_CACHE_REDIS)
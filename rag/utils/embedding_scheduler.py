@@ -0,0 +1,108 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from rag.utils import num_tokens_from_string
+
+RETRIABLE_ERROR = re.compile(r"(429|rate.?limit|too many requests|throttl|quota|timeout|timed out|temporarily|"
+                             r"connection (reset|aborted|refused)|503|502)", re.IGNORECASE)
+
+
+class EmbeddingScheduler:
+    """
+    Encodes a large list of texts with an embedding model (usually an `LLMBundle`).
+
+    Batches are cut by a token budget derived from the model's `max_length` instead of a fixed
+    count, several batches are in flight at once for remote providers, results are written
+    into one preallocated matrix, and rate-limit/timeout errors are retried with backoff.
+    """
+
+    def __init__(self, mdl, max_batch_size: int = 64, batch_tokens: int = 0, concurrency: int = 0,
+                 max_retries: int = 5):
+        self.mdl = mdl
+        self.max_batch_size = max(1, max_batch_size)
+        max_length = int(getattr(mdl, "max_length", 0) or 8192)
+        self.batch_tokens = batch_tokens if batch_tokens > 0 else 4 * max_length
+        if concurrency <= 0:
+            concurrency = getattr(getattr(mdl, "mdl", mdl), "max_concurrency", 1)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+
+    def batches(self, texts: list[str]) -> list[tuple[int, int]]:
+        batches = []
+        s, tokens = 0, 0
+        for i, t in enumerate(texts):
+            n = num_tokens_from_string(t)
+            if i > s and (i - s >= self.max_batch_size or tokens + n > self.batch_tokens):
+                batches.append((s, i))
+                s, tokens = i, 0
+            tokens += n
+        if s < len(texts):
+            batches.append((s, len(texts)))
+        return batches
+
+    def encode(self, texts: list[str], callback=None) -> tuple[np.ndarray, int]:
+        """
+        Returns the embeddings in input order and the token count reported by the model.
+        `callback(done, total)` is called on the caller's thread as batches complete.
+        """
+        batches = self.batches(texts)
+        vects = None
+        tk_count = 0
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embedding") as pool:
+            pending = {}
+            it = iter(batches)
+            while True:
+                for b in it:
+                    pending[pool.submit(self._encode, texts[b[0]:b[1]])] = b
+                    if len(pending) >= self.concurrency:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                for f in finished:
+                    s, e = pending.pop(f)
+                    vts, c = f.result()
+                    vts = np.asarray(vts)
+                    if vects is None:
+                        vects = np.empty((len(texts), vts.shape[1]), dtype=vts.dtype)
+                    vects[s:e] = vts
+                    tk_count += c
+                    done += e - s
+                    if callback:
+                        callback(done, len(texts))
+        if vects is None:
+            vects = np.empty((0, 0))
+        return vects, tk_count
+
+    def _encode(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.mdl.encode(texts)
+            except Exception as e:
+                if attempt >= self.max_retries or not RETRIABLE_ERROR.search(str(e)):
+                    raise
+                delay = min(2 ** attempt, 30) * (0.5 + random.random())
+                logging.warning(f"EmbeddingScheduler: encode got {e}, retry in {delay:.1f}s")
+                time.sleep(delay)
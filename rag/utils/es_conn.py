@@ -28,6 +28,7 @@ from rag import settings
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton
 from api.utils.file_utils import get_project_base_directory
+from rag.utils.retrieval_cache import invalidates_retrieval
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
 from rag.nlp import is_english, rag_tokenizer
@@ -162,6 +163,9 @@ class ESConnection(DocStoreConnection):
                 continue
             if not v:
                 continue
+            if k == "id":
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
             if isinstance(v, list):
                 bqry.filter.append(Q("terms", **{k: v}))
             elif isinstance(v, str) or isinstance(v, int):
@@ -277,6 +281,7 @@ class ESConnection(DocStoreConnection):
         logger.error("ESConnection.get timeout for 3 times!")
         raise Exception("ESConnection.get timeout.")
 
+    @invalidates_retrieval
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
         operations = []
@@ -313,6 +318,7 @@ class ESConnection(DocStoreConnection):
                     continue
         return res
 
+    @invalidates_retrieval
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -394,6 +400,7 @@ class ESConnection(DocStoreConnection):
                 break
         return False
 
+    @invalidates_retrieval
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -32,6 +32,7 @@ import polars as pl
 from polars.series.series import Series
 from api.utils.file_utils import get_project_base_directory
 
+from rag.utils.retrieval_cache import invalidates_retrieval
 from rag.utils.doc_store_conn import (
     DocStoreConnection,
     MatchExpr,
@@ -437,6 +438,7 @@ class InfinityConnection(DocStoreConnection):
         res_fields = self.getFields(res, res.columns)
         return res_fields.get(chunkId, None)
 
+    @invalidates_retrieval
     def insert(
             self, documents: list[dict], indexName: str, knowledgebaseId: str = None
     ) -> list[str]:
@@ -507,6 +509,7 @@ class InfinityConnection(DocStoreConnection):
         logger.debug(f"INFINITY inserted into {table_name} {str_ids}.")
         return []
 
+    @invalidates_retrieval
     def update(
             self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str
     ) -> bool:
@@ -547,6 +550,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         return True
 
+    @invalidates_retrieval
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
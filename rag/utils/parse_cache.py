@@ -0,0 +1,164 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import logging
+import threading
+import zlib
+from io import BytesIO
+
+import numpy as np
+import xxhash
+from PIL import Image
+
+from rag import settings
+
+
+def _encode(o):
+    if isinstance(o, np.ndarray):
+        return {"__ndarray__": o.tolist(), "dtype": str(o.dtype)}
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"{type(o).__name__} is not a parse artifact")
+
+
+def _decode(d):
+    if "__ndarray__" in d:
+        return np.array(d["__ndarray__"], dtype=d["dtype"])
+    return d
+
+
+class ParseArtifactCache:
+    """
+    Outputs of the expensive stages of a document parse (OCR boxes, layouts, table components, page
+    image crops) in object storage, keyed by the file content, the parser, the deepdoc version and the
+    page range. Re-chunking a document with other settings then reuses them and only reruns the merging,
+    tokenizing and embedding. Artifacts are stored as JSON or PNG, never pickled: the bucket is shared.
+
+    A Redis hash per file content lists the artifacts stored, so misses cost no storage round trip and
+    `remove` finds them all when a document is deleted. Artifacts are never invalidated: bump the
+    deepdoc version instead.
+    """
+
+    BUCKET = "ragflow-parse-artifacts"
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, fnm, parser: str, **params) -> str | None:
+        """`fnm` is the file's content or path, `params` whatever else the parse output depends on."""
+        if not self.enabled:
+            return None
+        try:
+            if isinstance(fnm, str):
+                with open(fnm, "rb") as f:
+                    fnm = f.read()
+            h = xxhash.xxh128(fnm).hexdigest()
+        except Exception as e:
+            logging.warning(f"ParseArtifactCache.key got exception: {e}")
+            return None
+        raw = json.dumps([parser, params], sort_keys=True, default=str)
+        return "{}/{}".format(h, xxhash.xxh64(raw.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def _name(key: str, stage: str) -> str:
+        return f"{key}/{stage}"
+
+    @staticmethod
+    def _manifest(key: str) -> str:
+        """The Redis hash of the artifacts of the file content `key` (or a key of it) stands for."""
+        return "parse_artifacts:" + key.split("/")[0]
+
+    def get(self, key: str | None, stage: str) -> dict | None:
+        return self._get(key, stage, lambda data: json.loads(zlib.decompress(data), object_hook=_decode))
+
+    def put(self, key: str | None, stage: str, artifacts: dict):
+        self._put(key, stage, lambda: zlib.compress(
+            json.dumps(artifacts, ensure_ascii=False, default=_encode).encode("utf-8")))
+
+    def get_image(self, key: str | None, stage: str) -> Image.Image | None:
+        """A page image crop saved by `put_image`, so that the page it was cut from is not rendered again."""
+        return self._get(key, stage, lambda data: Image.open(BytesIO(data)).convert("RGB"))
+
+    def put_image(self, key: str | None, stage: str, img: Image.Image):
+        def encode():
+            buf = BytesIO()
+            img.save(buf, format="PNG")
+            return buf.getvalue()
+        self._put(key, stage, encode)
+
+    def _get(self, key: str | None, stage: str, decode):
+        if not key:
+            return None
+        from rag.utils.redis_conn import REDIS_CONN
+        from rag.utils.storage_factory import STORAGE_IMPL
+        res = None
+        try:
+            if REDIS_CONN.REDIS.hexists(self._manifest(key), self._name(key, stage)):
+                data = STORAGE_IMPL.get(self.BUCKET, self._name(key, stage))
+                res = decode(data) if data else None
+        except Exception as e:
+            logging.warning(f"ParseArtifactCache.get {stage} got exception: {e}")
+        with self.lock:
+            if res is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return res
+
+    def _put(self, key: str | None, stage: str, encode):
+        if not key:
+            return
+        from rag.utils.redis_conn import REDIS_CONN
+        from rag.utils.storage_factory import STORAGE_IMPL
+        try:
+            data = encode()
+            STORAGE_IMPL.put(self.BUCKET, self._name(key, stage), data)
+            REDIS_CONN.REDIS.hset(self._manifest(key), self._name(key, stage), len(data))
+        except Exception as e:
+            logging.warning(f"ParseArtifactCache.put {stage} got exception: {e}")
+
+    def remove(self, bucket: str, name: str):
+        """Deletes the artifacts of the file stored as `name` in `bucket`, once its document is deleted."""
+        if not self.enabled:
+            return
+        from rag.utils.redis_conn import REDIS_CONN
+        from rag.utils.storage_factory import STORAGE_IMPL
+        try:
+            binary = STORAGE_IMPL.get(bucket, name)
+            if not binary:
+                return
+            manifest = self._manifest(xxhash.xxh128(binary).hexdigest())
+            for artifact in REDIS_CONN.REDIS.hkeys(manifest) or []:
+                STORAGE_IMPL.rm(self.BUCKET, artifact)
+            REDIS_CONN.REDIS.delete(manifest)
+        except Exception as e:
+            logging.warning(f"ParseArtifactCache.remove {bucket}/{name} got exception: {e}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.,
+            }
+
+
+PARSE_ARTIFACTS = ParseArtifactCache(settings.PARSE_CACHE)
@@ -0,0 +1,105 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import queue
+import threading
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline: `func(item)` runs on `workers` threads fed by a bounded queue.
+    `func` returns the item to hand to the next stage, or None when the item is finished early.
+    """
+
+    def __init__(self, name: str, func, workers: int = 1, queue_size: int = 4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.threads = []
+        self.busy = 0
+
+
+class Pipeline:
+    """
+    Chains stages with bounded queues. `put` blocks once the first stage is saturated,
+    and every stage blocks on a full downstream queue, so memory held by in-flight items
+    is bounded by the queue sizes plus the number of workers.
+    """
+
+    def __init__(self, stages: list[Stage], on_done=None, on_error=None):
+        assert stages, "Pipeline needs at least one stage"
+        self.stages = stages
+        self.on_done = on_done
+        self.on_error = on_error
+        self.lock = threading.Lock()
+
+    def start(self):
+        for i, stage in enumerate(self.stages):
+            for j in range(stage.workers):
+                t = threading.Thread(target=self._work, args=(i,), name=f"{stage.name}_{j}", daemon=True)
+                t.start()
+                stage.threads.append(t)
+        return self
+
+    def put(self, item, timeout=None):
+        self.stages[0].queue.put(item, timeout=timeout)
+
+    def stop(self):
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for t in stage.threads:
+                t.join()
+            stage.threads = []
+
+    def depth(self) -> dict:
+        with self.lock:
+            return {s.name: {"queued": s.queue.qsize(), "busy": s.busy, "workers": s.workers} for s in self.stages}
+
+    def _work(self, i):
+        stage = self.stages[i]
+        nxt = self.stages[i + 1] if i + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                return
+            with self.lock:
+                stage.busy += 1
+            try:
+                res = stage.func(item)
+            except Exception as e:
+                self._finish(self.on_error, item, e)
+                continue
+            finally:
+                with self.lock:
+                    stage.busy -= 1
+            if res is None or nxt is None:
+                self._finish(self.on_done, item if res is None else res)
+                continue
+            nxt.queue.put(res)
+
+    @staticmethod
+    def _finish(cb, *args):
+        if not cb:
+            return
+        try:
+            cb(*args)
+        except Exception:
+            logging.exception("Pipeline callback got exception")
@@ -0,0 +1,59 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Context manager allowing at most `concurrency` holders at a time (0: unbounded)
+    and at most `rpm` entries per minute (0: unbounded), evenly spaced.
+    """
+
+    def __init__(self, concurrency: int = 0, rpm: int = 0):
+        self.semaphore = threading.BoundedSemaphore(concurrency) if concurrency > 0 else None
+        self.interval = 60. / rpm if rpm > 0 else 0.
+        self.lock = threading.Lock()
+        self.next_at = 0.
+
+    def __enter__(self):
+        if self.semaphore:
+            self.semaphore.acquire()
+        if self.interval:
+            with self.lock:
+                now = time.monotonic()
+                at = max(now, self.next_at)
+                self.next_at = at + self.interval
+            if at > now:
+                time.sleep(at - now)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.semaphore:
+            self.semaphore.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, concurrency: int = 0, rpm: int = 0) -> RateLimiter:
+    """Returns the process-wide limiter registered under `name`, e.g. one per tenant."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(concurrency, rpm)
+        return _limiters[name]
@@ -48,6 +48,7 @@ class Payload:
 class RedisDB:
     def __init__(self):
         self.REDIS = None
+        self.REDIS_BIN = None
         self.config = settings.REDIS
         self.__open__()
 
@@ -60,6 +61,14 @@ class RedisDB:
                 password=self.config.get("password"),
                 decode_responses=True,
             )
+            # Same server, raw bytes in and out, for binary payloads such as packed vectors.
+            self.REDIS_BIN = redis.StrictRedis(
+                host=self.config["host"].split(":")[0],
+                port=int(self.config.get("host", ":6379").split(":")[1]),
+                db=int(self.config.get("db", 1)),
+                password=self.config.get("password"),
+                decode_responses=False,
+            )
         except Exception:
             logging.warning("Redis can't be connected.")
         return self.REDIS
@@ -111,6 +120,54 @@ class RedisDB:
             self.__open__()
         return False
 
+    def mget(self, keys: list[str]) -> list[str | None]:
+        if not self.REDIS or not keys:
+            return [None] * len(keys)
+        try:
+            return self.REDIS.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset(self, mapping: dict[str, str], exp=3600):
+        if not self.REDIS or not mapping:
+            return False
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def mget_bin(self, keys: list[str]) -> list[bytes | None]:
+        if not self.REDIS_BIN or not keys:
+            return [None] * len(keys)
+        try:
+            return self.REDIS_BIN.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget_bin " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset_bin(self, mapping: dict[str, bytes], exp=3600):
+        if not self.REDIS_BIN or not mapping:
+            return False
+        try:
+            pipeline = self.REDIS_BIN.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset_bin " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
     def sadd(self, key: str, member: str):
         try:
             self.REDIS.sadd(key, member)
@@ -239,6 +296,35 @@ class RedisDB:
                 )
         return None
 
+    def publish_event(self, stream, message, maxlen=settings.PROGRESS_QUEUE_MAX_LEN) -> bool:
+        """Appends `message` to `stream`, which keeps about its `maxlen` latest events."""
+        try:
+            self.REDIS.xadd(stream, {"message": json.dumps(message)}, maxlen=maxlen, approximate=True)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.publish_event " + str(stream) + " got exception: " + str(e))
+        return False
+
+    def consume_events(self, stream, group_name, consumer_name, count=1024, block=1000) -> list[dict] | None:
+        """
+        Reads the events of `stream` no consumer of `group_name` has read yet, waiting at most `block`
+        milliseconds for one. Events are not acknowledged: a consumer that dies loses the ones it read.
+        Returns None if Redis could not be read.
+        """
+        try:
+            group_info = self.REDIS.xinfo_groups(stream) if self.REDIS.exists(stream) else []
+            if not any(e["name"] == group_name for e in group_info):
+                self.REDIS.xgroup_create(stream, group_name, id="$", mkstream=True)
+            messages = self.REDIS.xreadgroup(group_name, consumer_name, {stream: ">"}, count=count,
+                                             block=block, noack=True)
+            return [json.loads(payload["message"]) for _, elements in messages or [] for _, payload in elements]
+        except Exception as e:
+            if str(e).find("BUSYGROUP") >= 0:
+                return []
+            logging.warning("RedisDB.consume_events " + str(stream) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
     def get_unacked_for(self, consumer_name, queue_name, group_name):
         try:
             group_info = self.REDIS.xinfo_groups(queue_name)
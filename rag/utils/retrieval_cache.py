@@ -0,0 +1,148 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+import xxhash
+
+from rag import settings
+from rag.utils.redis_conn import REDIS_CONN
+
+
+def model_key(mdl) -> str | None:
+    """Identifies the model behind an `LLMBundle`: "" for no model, None if it can not be identified."""
+    if mdl is None:
+        return ""
+    return mdl.cache_key() if hasattr(mdl, "cache_key") else None
+
+
+class RetrievalCache:
+    """
+    Results of `Dealer.retrieval` in Redis, keyed by the retrieval parameters and by the current
+    version of every knowledge base and index searched.
+
+    A version is the time of the last write to a knowledge base (or to an index, when the writer
+    does not tell the knowledge base); `DocStoreConnection` implementations call `invalidate` on
+    insert, update and delete, which makes every cached result of the knowledge base unreachable.
+    Results are not cached while a write may not be searchable yet (`settle` seconds).
+    """
+
+    def __init__(self, enabled=True, ttl=3600, settle=2.):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def version_key(name: str) -> str:
+        return f"retrieval_ver:{name}"
+
+    def invalidate(self, index_name: str | None = None, kb_ids: str | list[str] | None = None):
+        if not self.enabled:
+            return
+        names = set()
+        for kb_id in [kb_ids] if isinstance(kb_ids, str) else kb_ids or []:
+            if isinstance(kb_id, list):
+                names.update(kb_id)
+            elif kb_id:
+                names.add(kb_id)
+        if not names and index_name:
+            names = [index_name]
+        if not names:
+            return
+        keys = [self.version_key(n) for n in names]
+        for _ in range(3):
+            version = repr(time.time())
+            # Versions outlive the results they guard, so a version never goes back to a value a live result was keyed by.
+            if REDIS_CONN.mset({k: version for k in keys}, 2 * self.ttl):
+                return
+            time.sleep(0.1)
+        # Without a version, retrievals are keyed by None and miss the results cached under the old one.
+        try:
+            REDIS_CONN.REDIS.delete(*keys)
+            logging.warning(f"RetrievalCache.invalidate dropped the versions of {sorted(names)}")
+        except Exception as e:
+            logging.error(f"RetrievalCache.invalidate failed for {sorted(names)}, cached retrievals may be "
+                          f"stale for up to {self.ttl} seconds: {e}")
+
+    def key(self, index_names: list[str], kb_ids: list[str], **params) -> str | None:
+        """Returns the cache key of a retrieval, or None if it should not be cached."""
+        if not self.enabled or not kb_ids:
+            return None
+        names = sorted(set(index_names)) + sorted(set(kb_ids))
+        versions = REDIS_CONN.mget([self.version_key(n) for n in names])
+        now = time.time()
+        for v in versions:
+            if v and now - float(v) < self.settle:
+                return None
+        raw = json.dumps([names, versions, params], sort_keys=True, ensure_ascii=False, default=str)
+        return "retrieval:" + xxhash.xxh128(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        res = REDIS_CONN.get(key)
+        with self.lock:
+            if res:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not res:
+            return None
+        return json.loads(res)
+
+    def set(self, key: str, ranks: dict):
+        try:
+            REDIS_CONN.set(key, json.dumps(ranks, ensure_ascii=False, default=float), self.ttl)
+        except Exception as e:
+            logging.warning(f"RetrievalCache.set got exception: {e}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.,
+            }
+
+
+RETRIEVAL_CACHE = RetrievalCache(settings.RETRIEVAL_CACHE, settings.RETRIEVAL_CACHE_TTL)
+
+
+def invalidates_retrieval(func):
+    """
+    Decorates the insert/update/delete methods of a `DocStoreConnection` so that, once the write is done,
+    the cached retrievals of the knowledge bases written (taken from the arguments) are invalidated.
+    """
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            arguments = sig.bind(*args, **kwargs).arguments
+            kb_ids = arguments.get("knowledgebaseId") or (arguments.get("condition") or {}).get("kb_id") or \
+                [d.get("kb_id") for d in arguments.get("documents") or []]
+            RETRIEVAL_CACHE.invalidate(arguments.get("indexName"), kb_ids)
+
+    return wrapper
@@ -0,0 +1,279 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import logging
+import threading
+import time
+
+import valkey as redis
+
+from rag import settings
+from rag.utils.redis_conn import REDIS_CONN, Payload
+
+PRIORITIES = ["interactive", "bulk", "graph"]
+GRAPH_TASK_TYPES = ["raptor", "graphrag", "graph_resolution", "graph_community"]
+# Attempts of a task before `TaskService.get_task` abandons it.
+MAX_ATTEMPTS = 3
+
+
+def parse_weights(weights: str) -> dict[str, int]:
+    res = {p: 1 for p in PRIORITIES}
+    for kv in weights.split(","):
+        if kv.find(":") < 0:
+            continue
+        p, w = kv.split(":", 1)
+        if p.strip() in res:
+            res[p.strip()] = max(0, int(w))
+    return res
+
+
+def smooth_round_robin(weights: dict[str, int]) -> list[str]:
+    """One round of smooth weighted round robin: 6/3/1 gives I B I I B I G I B I rather than six I in a row."""
+    current = {p: 0 for p in weights}
+    total = sum(weights.values())
+    res = []
+    for _ in range(total):
+        for p, w in weights.items():
+            current[p] += w
+        p = max(current, key=lambda k: current[k])
+        current[p] -= total
+        res.append(p)
+    return res
+
+
+class TaskQueue:
+    """
+    Task messages in one Redis stream per priority and tenant, over which the task executors share a consumer
+    group. An executor takes the next message in smooth weighted round robin over the priorities and in round
+    robin over the tenants of a priority, so neither a tenant queuing thousands of documents nor a long
+    GraphRAG job holds everybody else up. Priorities without messages are skipped.
+
+    Messages of a task executor that died are claimed by live ones, see `reclaim`.
+
+    The tenants of a priority are a Redis set. The stream of a tenant is deleted, and the tenant dropped from
+    the set, once every message of it was read and acknowledged; `put` adds both back atomically.
+    """
+
+    def __init__(self, name=settings.SVR_QUEUE_NAME, group_name="rag_flow_svr_task_broker",
+                 weights=settings.TASK_QUEUE_WEIGHTS, bulk_tasks=settings.TASK_QUEUE_BULK_TASKS,
+                 reclaim_interval=settings.TASK_RECLAIM_INTERVAL, reclaim_idle=settings.TASK_RECLAIM_IDLE):
+        # Messages queued to the single stream of older versions are still consumed, as interactive ones.
+        self.legacy = name
+        self.name = name
+        self.group_name = group_name
+        self.bulk_tasks = bulk_tasks
+        self.rounds = smooth_round_robin(parse_weights(weights)) or PRIORITIES
+        self.lock = threading.Lock()
+        self.round = 0
+        self.cursors = {p: 0 for p in PRIORITIES}
+        self.reclaim_interval = reclaim_interval
+        self.reclaim_idle = reclaim_idle
+        self.reclaimed_at = 0.
+
+    def priority(self, task_type: str = "", task_num: int = 1) -> str:
+        """Priority of a task of `task_type`, queued with `task_num` tasks for the same document."""
+        if task_type in GRAPH_TASK_TYPES:
+            return "graph"
+        return "bulk" if task_num > self.bulk_tasks else "interactive"
+
+    def tenants_key(self, priority: str) -> str:
+        return f"{self.name}:{priority}:tenants"
+
+    def stream(self, priority: str, tenant_id: str) -> str:
+        return f"{self.name}:{priority}:{tenant_id}"
+
+    def streams(self, priority: str) -> list[str]:
+        tenants = sorted(REDIS_CONN.REDIS.smembers(self.tenants_key(priority)) or [])
+        res = [self.stream(priority, t) for t in tenants]
+        if priority == "interactive":
+            res.append(self.legacy)
+        return res
+
+    def put(self, message: dict, tenant_id: str, priority: str = "interactive") -> bool:
+        for _ in range(3):
+            try:
+                pipeline = REDIS_CONN.REDIS.pipeline(transaction=True)
+                pipeline.xadd(self.stream(priority, tenant_id), {"message": json.dumps(message)})
+                pipeline.sadd(self.tenants_key(priority), tenant_id)
+                pipeline.execute()
+                return True
+            except Exception as e:
+                logging.exception("TaskQueue.put " + str(priority) + " got exception: " + str(e))
+        return False
+
+    def get(self, consumer_name: str) -> Payload | None:
+        """The next message for `consumer_name`, None if every stream is drained."""
+        with self.lock:
+            start = self.round
+            self.round = (self.round + 1) % len(self.rounds)
+        # Priorities weighted 0 are only served when the others are drained.
+        order = [self.rounds[(start + i) % len(self.rounds)] for i in range(len(self.rounds))] + PRIORITIES
+        for priority in dict.fromkeys(order):
+            streams = self.streams(priority)
+            if not streams:
+                continue
+            with self.lock:
+                offset = self.cursors[priority]
+            for j in range(len(streams)):
+                k = (offset + j) % len(streams)
+                payload = self._read(streams[k], consumer_name)
+                if payload:
+                    with self.lock:
+                        self.cursors[priority] = k + 1
+                    return payload
+                if streams[k] != self.legacy:
+                    self._retire(priority, streams[k])
+        return None
+
+    def get_unacked_for(self, consumer_name: str) -> Payload | None:
+        for priority in PRIORITIES:
+            for stream in self.streams(priority):
+                payload = REDIS_CONN.get_unacked_for(consumer_name, stream, self.group_name)
+                if payload:
+                    return payload
+        return None
+
+    def alive(self, consumer_name: str) -> bool:
+        """Whether the task executor named `consumer_name` reported a heartbeat (`report_status`) lately."""
+        now = time.time()
+        return bool(REDIS_CONN.REDIS.zrangebyscore(consumer_name, now - self.reclaim_idle, now, start=0, num=1))
+
+    def reclaim(self, consumer_name: str) -> Payload | None:
+        """
+        Claims for `consumer_name` a message that a task executor without heartbeats for `reclaim_idle` seconds
+        read and did not acknowledge, at most once per `reclaim_interval` seconds. Every delivery is an attempt
+        of `TaskService.get_task`, which abandons a task after MAX_ATTEMPTS of them: a message delivered once more
+        than that fails its task and is acknowledged instead of claimed.
+        """
+        with self.lock:
+            now = time.time()
+            if now - self.reclaimed_at < self.reclaim_interval:
+                return None
+            self.reclaimed_at = now
+        dead = {}
+        for priority in PRIORITIES:
+            for stream in self.streams(priority):
+                try:
+                    pendings = REDIS_CONN.REDIS.xpending_range(stream, self.group_name, min="-", max="+", count=100,
+                                                               idle=int(self.reclaim_idle * 1000))
+                except redis.exceptions.ResponseError:
+                    continue
+                for p in pendings:
+                    owner = p["consumer"]
+                    if owner == consumer_name:
+                        continue
+                    if owner not in dead:
+                        dead[owner] = not self.alive(owner)
+                    if not dead[owner]:
+                        continue
+                    if p["times_delivered"] > MAX_ATTEMPTS:
+                        logging.warning(f"TaskQueue.reclaim drops message {p['message_id']} of {stream} "
+                                        f"after {p['times_delivered']} deliveries")
+                        self._abandon(stream, p["message_id"])
+                        REDIS_CONN.REDIS.xack(stream, self.group_name, p["message_id"])
+                        continue
+                    claimed = REDIS_CONN.REDIS.xclaim(stream, self.group_name, consumer_name,
+                                                      int(self.reclaim_idle * 1000), [p["message_id"]])
+                    if not claimed:
+                        continue
+                    msg_id, payload = claimed[0]
+                    if not payload:
+                        REDIS_CONN.REDIS.xack(stream, self.group_name, msg_id)
+                        continue
+                    logging.info(f"TaskQueue.reclaim claimed message {msg_id} of {stream} from {owner}")
+                    return Payload(REDIS_CONN.REDIS, stream, self.group_name, msg_id, payload)
+        return None
+
+    @staticmethod
+    def _abandon(stream: str, msg_id: str):
+        """Fails the task of a message dropped after MAX_ATTEMPTS deliveries, the way `TaskService.get_task` does."""
+        from api.db.services.task_service import TaskService
+        try:
+            messages = REDIS_CONN.REDIS.xrange(stream, min=msg_id, max=msg_id, count=1)
+            if not messages:
+                return
+            task_id = json.loads(messages[0][1]["message"]).get("id")
+            if task_id:
+                msg = f"ERROR: Task is abandoned after {MAX_ATTEMPTS} times attempts."
+                TaskService.update_progress(task_id, {"progress": -1, "progress_msg": msg})
+        except Exception:
+            logging.exception(f"TaskQueue.reclaim can not fail the task of message {msg_id} of {stream}")
+
+    def _read(self, stream: str, consumer_name: str) -> Payload | None:
+        for _ in range(2):
+            try:
+                messages = REDIS_CONN.REDIS.xreadgroup(self.group_name, consumer_name, {stream: ">"}, count=1)
+                if not messages:
+                    return None
+                _, element_list = messages[0]
+                msg_id, payload = element_list[0]
+                return Payload(REDIS_CONN.REDIS, stream, self.group_name, msg_id, payload)
+            except redis.exceptions.ResponseError as e:
+                if str(e).find("NOGROUP") < 0 or not REDIS_CONN.REDIS.exists(stream):
+                    return None
+                try:
+                    REDIS_CONN.REDIS.xgroup_create(stream, self.group_name, id="0")
+                except redis.exceptions.ResponseError as e:
+                    if str(e).find("BUSYGROUP") < 0:
+                        raise
+        return None
+
+    def _retire(self, priority: str, stream: str):
+        """Deletes the stream of a tenant if all of it was read and acknowledged, unless a message comes in meanwhile."""
+        tenant_id = stream[len(self.stream(priority, "")):]
+        try:
+            with REDIS_CONN.REDIS.pipeline() as pipeline:
+                pipeline.watch(stream)
+                groups = pipeline.xinfo_groups(stream) if pipeline.exists(stream) else []
+                group = next((g for g in groups if g["name"] == self.group_name), None)
+                if pipeline.exists(stream) and (not group or group.get("lag") != 0 or group.get("pending")):
+                    pipeline.unwatch()
+                    return
+                pipeline.multi()
+                pipeline.delete(stream)
+                pipeline.srem(self.tenants_key(priority), tenant_id)
+                pipeline.execute()
+        except redis.exceptions.WatchError:
+            pass
+        except Exception as e:
+            logging.warning("TaskQueue._retire " + stream + " got exception: " + str(e))
+
+    def depth(self) -> dict | None:
+        """Tenants with messages, messages not read yet (lag) and read but not acknowledged (pending), per priority."""
+        try:
+            res = {}
+            for priority in PRIORITIES:
+                d = {"tenants": 0, "lag": 0, "pending": 0}
+                for stream in self.streams(priority):
+                    if not REDIS_CONN.REDIS.exists(stream):
+                        continue
+                    group = next((g for g in REDIS_CONN.REDIS.xinfo_groups(stream) if g["name"] == self.group_name),
+                                 None)
+                    lag = REDIS_CONN.REDIS.xlen(stream) if not group else group.get("lag") or 0
+                    pending = group.get("pending", 0) if group else 0
+                    if stream != self.legacy or lag or pending:
+                        d["tenants"] += 1
+                    d["lag"] += int(lag)
+                    d["pending"] += int(pending)
+                res[priority] = d
+            return res
+        except Exception as e:
+            logging.warning("TaskQueue.depth got exception: " + str(e))
+        return None
+
+
+TASK_QUEUE = TaskQueue()
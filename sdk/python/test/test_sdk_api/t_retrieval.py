@@ -0,0 +1,71 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+from ragflow_sdk import RAGFlow
+from common import HOST_ADDRESS
+from time import sleep
+
+
+def wait_for_parsing(ds, doc_id, timeout=300):
+    for _ in range(timeout):
+        doc = ds.list_documents(id=doc_id)[0]
+        if doc.progress == 1:
+            return doc
+        assert doc.progress >= 0, doc.progress_msg
+        sleep(1)
+    raise Exception("Run time ERROR: Document parsing did not complete in time.")
+
+
+def test_retrieve_parsed_chunks(get_api_key_fixture):
+    API_KEY = get_api_key_fixture
+    rag = RAGFlow(API_KEY, HOST_ADDRESS)
+    ds = rag.create_dataset(name="test_retrieve_parsed_chunks")
+    with open("test_data/ragflow_test.txt", "rb") as file:
+        blob = file.read()
+    doc = ds.upload_documents([{"display_name": "ragflow_test.txt", "blob": blob}])[0]
+    ds.async_parse_documents(document_ids=[doc.id])
+    wait_for_parsing(ds, doc.id)
+    # For Elasticsearch, the chunks are not searchable in short time (~2s).
+    sleep(3)
+
+    chunks = rag.retrieve(dataset_ids=[ds.id], question="What is RagFlow?", similarity_threshold=0.)
+    assert chunks, "Nothing retrieved from a parsed document"
+    assert all(c.document_id == doc.id for c in chunks)
+    assert any("RagFlow" in c.content for c in chunks)
+
+    chunks = rag.retrieve(dataset_ids=[ds.id], question="RagFlow", keyword=True, similarity_threshold=0.)
+    assert chunks
+    rag.delete_datasets(ids=[ds.id])
+
+
+def test_retrieve_added_and_deleted_chunk(get_api_key_fixture):
+    API_KEY = get_api_key_fixture
+    rag = RAGFlow(API_KEY, HOST_ADDRESS)
+    ds = rag.create_dataset(name="test_retrieve_added_and_deleted_chunk")
+    doc = ds.upload_documents([{"display_name": "ragflow.txt", "blob": b"RAGFlow retrieval test."}])[0]
+    chunk = doc.add_chunk(content="Platypuses lay eggs and hunt with electroreception")
+    sleep(3)
+
+    chunks = rag.retrieve(dataset_ids=[ds.id], document_ids=[doc.id], question="Which animal uses electroreception?",
+                          similarity_threshold=0.)
+    assert chunk.id in [c.id for c in chunks]
+
+    doc.delete_chunks(ids=[chunk.id])
+    sleep(3)
+    chunks = rag.retrieve(dataset_ids=[ds.id], document_ids=[doc.id], question="Which animal uses electroreception?",
+                          similarity_threshold=0.)
+    assert chunk.id not in [c.id for c in chunks]
+    rag.delete_datasets(ids=[ds.id])